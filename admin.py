@@ -1,8 +1,9 @@
 import os, sys
 import pytz
 import streamlit as st
-from firebase_client import firebase_sign_in_with_google, firestore_set, firestore_get, firestore_delete, firestore_list, firestore_update_field, firestore_to_python, firebase_refresh_id_token
+from firebase_client import firebase_sign_in_with_google, firestore_set, firestore_get, firestore_delete, firestore_list, firestore_to_python, session_token_manager, WriteBatch, FirestoreConflict
 from datetime import datetime
+from core.model import Layer
 from services.flow_builder import firestore_fields_to_layers, build_default_flow
 from services.flow_builder import ensure_flow_ids
 from services.presets import load_layer_presets_once
@@ -11,12 +12,17 @@ from services.flow_defaults import DEFAULT_FLOW
 from core.metadata import normalize_meta, ensure_kv_rows, build_package_chip_meta, get_package_chips, get_measure_fridges, build_measure_fridge_meta
 from ui.flow_editor import flow_editor, update_flow_editor
 from ui.metadata_ui import render_metadata_ui, save_package_info_core, save_measure_info_core
-from services.drive import upload_file_via_cleanroom_api, delete_file_via_cleanroom_api
-import requests, time, json
+from services.attachments import upload_attachment, upload_attachments, release_attachment
+from services.run_query import run_filter_fields
+from services.run_snapshot import invalidate_runs
+from services.run_changes import CONFLICT_MESSAGE, start_tracking, get_tracker, commit_run_writes, update_run_field
+import requests, json
 from zoneinfo import ZoneInfo
 from notion_client.helpers import get_id
-from notion.notion_ops import update_page_properties, create_measure_page, set_relation, update_date_range, archive_page, get_page, create_fab_page, get_page_url_by_title
+from notion.notion_ops import create_measure_page, set_relation, archive_page, get_page, create_fab_page, get_page_url_by_title
 from notion.notion_add_fab_content import add_fab_content
+from notion.notion_metrics import track, summary as notion_call_summary, recent_runs as notion_recent_runs, export_json as notion_metrics_json, reset as reset_notion_metrics
+from notion.notion_outbox import enqueue_page_properties, enqueue_date_range, enqueue_archive, start_drainer, run_status, retry_failed
 import urllib.parse
 import notion_client
 import inspect
@@ -144,6 +150,50 @@ def notion_success(msg: str, label: str = ""):
         st.success(f"✅ {msg} ({label})")
 
 
+def render_notion_sync_status(run_id: str):
+    """Pending / failed Notion outbox entries for the loaded run."""
+    start_drainer(st.secrets["notion"]["NOTION_TOKEN"])   # picks up entries left by a restart
+    status = run_status(run_id)
+
+    if status["pending"]:
+        st.caption(f"🔄 {status['pending']} Notion update(s) pending")
+
+    if status["failed"]:
+        with st.expander(f"⚠️ {status['failed']} Notion update(s) failed", expanded=False):
+            for op, err in status["errors"]:
+                st.write(f"- {op}: {err}")
+            if st.button("Retry failed Notion updates", key=f"notion_outbox_retry_{run_id}"):
+                retry_failed(run_id)
+                st.rerun()
+
+
+def render_notion_metrics():
+    """Notion calls per action (this server process), with JSON export."""
+    with st.sidebar.expander("📊 Notion API calls", expanded=False):
+        rows = notion_call_summary()
+        if not rows:
+            st.caption("No Notion calls yet.")
+            return
+
+        st.dataframe(
+            [{k: v for k, v in r.items() if k not in ("histogram", "statuses")} for r in rows],
+            use_container_width=True,
+            hide_index=True,
+        )
+        st.caption("Recent actions")
+        st.dataframe(notion_recent_runs(), use_container_width=True, hide_index=True)
+
+        st.download_button(
+            "Download JSON",
+            notion_metrics_json(),
+            file_name="notion_metrics.json",
+            mime="application/json",
+        )
+        if st.button("Reset", key="notion_metrics_reset"):
+            reset_notion_metrics()
+            st.rerun()
+
+
 def _pick_fab_db_url(run_class: str | None) -> str:
     if (run_class or "").lower() == "test":
         return st.secrets["notion"]["NOTION_FAB_TEST_DB_URL"]
@@ -174,17 +224,8 @@ def run_exists(run_no, id_token):
 
 
 def compute_layer_progress(layer):
-    all_chips = [
-        ch
-        for sub in layer.get("substeps", [])
-        for ch in sub.get("chips", [])
-    ]
-
-    if not all_chips:
-        return 0
-
-    done_count = sum(1 for ch in all_chips if ch["status"] == "done")
-    return int(100 * done_count / len(all_chips))
+    # same rule as the viewer cards (core.model.Layer.chip_progress)
+    return Layer.from_dict(layer).chip_progress()
 
 
 
@@ -313,7 +354,6 @@ if "user" not in st.session_state:
         st.stop()
 
     st.session_state["user"] = user
-    st.session_state["login_time"] = time.time()
 
     # st.experimental_set_query_params()
     st.query_params.clear()
@@ -341,32 +381,19 @@ if "user" not in st.session_state:
 
 user = st.session_state["user"]
 
-# --- Auto-refresh token if expired (copy from viewer) ---
-expires_in = int(user.get("expiresIn", "3600"))
-login_time = st.session_state.get("login_time", time.time())
-
-# Check if 55 minutes passed
-if time.time() - login_time > 3300:  # 55 minutes
-    refresh_token = user["refreshToken"]
-    new_tokens = firebase_refresh_id_token(refresh_token)
-
-    # Update session_state with new tokens
-    user["idToken"] = new_tokens["id_token"]
-    user["refreshToken"] = new_tokens["refresh_token"]
-    user["expiresIn"] = new_tokens["expires_in"]
-    st.session_state["user"] = user
-    st.session_state["login_time"] = time.time()
-
-# Always use updated token
-id_token = user["idToken"]
+# Firebase ID token: refreshed ahead of expiry off the render path, and
+# on a 401 (firebase_client.TokenManager); passed as id_token everywhere
+id_token = session_token_manager(st.session_state, "user")
 user_email = user["email"]
 
 
 
 st.sidebar.success("Logged in as: " + user_email)
 if st.sidebar.button("Logout"):
+    id_token.close()
     st.session_state.clear()
     st.rerun()
+render_notion_metrics()
 
 # ------------------------------------------------------------
 # Fast preset loading (only once!)
@@ -971,6 +998,9 @@ if mode == "Create Run":
             # firestore_set("runs", run_no, data, id_token=id_token)
             doc_id = f"{run_class.lower()}_{run_no}"
 
+            # Denormalized filter fields (viewer runQuery pushes filters down on these)
+            data.update(run_filter_fields(data["metadata"]))
+
             firestore_set("runs", doc_id, data, id_token=id_token)
 
             st.success(f"Run '{run_no}' created successfully!")
@@ -1054,10 +1084,11 @@ if mode == "Create Run":
                         if last_id and last_sig == sig:
                             st.info("This file is already uploaded.")
                         else:
-                            out = upload_file_via_cleanroom_api(
+                            out = upload_attachment(
                                 uploaded_file=uploaded,
                                 filename=uploaded.name,
                                 folder_id=st.secrets["app"]["drive_folder_id_design"],
+                                id_token=id_token,
                             )
 
                             if out.get("success"):
@@ -1080,10 +1111,11 @@ if mode == "Create Run":
                     else:
                         old_id = st.session_state.get("create_design_file_id", "")
 
-                        out = upload_file_via_cleanroom_api(
+                        out = upload_attachment(
                             uploaded_file=uploaded,
                             filename=uploaded.name,
                             folder_id=st.secrets["app"]["drive_folder_id_design"],
+                            id_token=id_token,
                         )
 
                         if out.get("success"):
@@ -1095,8 +1127,9 @@ if mode == "Create Run":
                             st.session_state["create_design_file_name"] = uploaded.name
 
                             # Trash old file only after new upload succeeds
-                            if old_id and old_id != new_id:
-                                del_out = delete_file_via_cleanroom_api(file_id=old_id)
+                            # same content again: only drops the extra registry reference
+                            if old_id:
+                                del_out = release_attachment(file_id=old_id, id_token=id_token)
                                 if not del_out.get("success"):
                                     st.warning(
                                         "New file uploaded, but old file could not be trashed: "
@@ -1249,10 +1282,11 @@ if mode == "Create Run":
                     if last_sig == sig:
                         st.info("This file is already uploaded.")
                     else:
-                        out = upload_file_via_cleanroom_api(
+                        out = upload_attachment(
                             uploaded_file=uploaded_fab,
                             filename=uploaded_fab.name,
                             folder_id=st.secrets["app"]["drive_folder_id_fab"],
+                            id_token=id_token,
                         )
 
                         if out.get("success"):
@@ -1296,10 +1330,11 @@ if mode == "Create Run":
                     fab_files = st.session_state.get("create_fab_files", [])
                     old_id = fab_files[replace_idx].get("id", "")
 
-                    out = upload_file_via_cleanroom_api(
+                    out = upload_attachment(
                         uploaded_file=uploaded_fab,
                         filename=uploaded_fab.name,
                         folder_id=st.secrets["app"]["drive_folder_id_fab"],
+                        id_token=id_token,
                     )
 
                     if out.get("success"):
@@ -1318,8 +1353,9 @@ if mode == "Create Run":
                         st.session_state["create_fab_files"] = fab_files
 
                         # Trash old only after new upload succeeds
-                        if old_id and old_id != new_id:
-                            del_out = delete_file_via_cleanroom_api(file_id=old_id)
+                        # same content again: only drops the extra registry reference
+                        if old_id:
+                            del_out = release_attachment(file_id=old_id, id_token=id_token)
                             if not del_out.get("success"):
                                 st.warning(
                                     "New file uploaded, but old file could not be trashed: "
@@ -1472,6 +1508,7 @@ if mode == "Update Run":
 
                 # 2. save new run
                 st.session_state["loaded_run"] = run_data
+                start_tracking(run_data)
                 # st.session_state["loaded_run_no"] = run_to_load
                 st.session_state["loaded_run_no"] = (
                     fields.get("run_no", {}).get("stringValue", run_to_load)
@@ -1528,6 +1565,8 @@ if mode == "Update Run":
         loaded_run_doc_id = st.session_state["loaded_run_doc_id"]
         fields = run["fields"]
 
+        render_notion_sync_status(loaded_run_doc_id)
+
         # 👇 EVERYTHING BELOW MUST BE INDENTED under this else:
 
         # ------------------------------------------------------------
@@ -1997,6 +2036,7 @@ if mode == "Update Run":
             return props
 
 
+        @track("save_full_run")
         def save_full_run(
             *,
             notion_source: str | None = None,
@@ -2087,27 +2127,17 @@ if mode == "Update Run":
 
 
 
-            def _dbg_meas(uid: str, tag: str):
-                # SS view
-                ss = (
-                    st.session_state.get("update_meta", {})
-                    .get("measure", {})
-                    .get("fridges", {})
-                    .get(uid, {})
-                    or {}
-                )
-                ss_url = (ss.get("notion", "") or "").strip()
-                ss_id  = (ss.get("notion_page_id", "") or "").strip()
-
-                # DB view
-                # runx = firestore_get("runs", loaded_run_no, id_token)
-                runx = firestore_get("runs", loaded_run_doc_id, id_token)
-                metax = firestore_to_python((runx or {}).get("fields", {}).get("metadata", {}))
-                db = (metax.get("measure", {}).get("fridges", {}).get(uid, {}) or {})
-                db_url = (db.get("notion", "") or "").strip()
-                db_id  = (db.get("notion_page_id", "") or "").strip()
-
-
+            # ------------------------------------------------------------
+            # 💾 The save sends only the field paths that differ from the
+            # run as loaded (change tracker), in ONE commit guarded by the
+            # run's updateTime: a concurrent save by another admin fails
+            # the commit instead of being silently overwritten.
+            # ------------------------------------------------------------
+            run_changes = get_tracker(loaded_run_doc_id)
+            if run_changes is None:
+                # session predates tracking (or lost it): baseline = stored run
+                run_changes = start_tracking(firestore_get("runs", loaded_run_doc_id, id_token))
+            run_writes = WriteBatch(id_token)
 
             # ------------------------------------------------------------
             # 🔧 PRUNE MEASUREMENT METADATA BASED ON FLOW (AUTHORITATIVE)
@@ -2127,34 +2157,23 @@ if mode == "Update Run":
             meta_measure = st.session_state.get("update_meta", {}).get("measure", {})
             meta_fridges = meta_measure.get("fridges", {})
 
+            stale_fridge_uids = set()
             if isinstance(meta_fridges, dict):
-                stale_uids = set(meta_fridges.keys()) - flow_fridge_uids
-
-                if stale_uids:
-                    for uid in stale_uids:
-                        meta_fridges.pop(uid, None)
+                stale_fridge_uids = set(meta_fridges.keys()) - flow_fridge_uids
 
-                    # Write pruned metadata back to Firestore
-                    firestore_update_field(
-                        "runs",
-                        # loaded_run_no,
-                        loaded_run_doc_id,
-                        "metadata.measure.fridges",
-                        meta_fridges,
-                        id_token=id_token,
-                    )
+                for uid in stale_fridge_uids:
+                    meta_fridges.pop(uid, None)
+                # (deleted in Firestore by the commit below; the merge skips them too)
 
             # ------------------------------------------------------------
-            # 🔒 Preserve Measurement Notion facts (write-once like FABIN)
-            # AND prevent firestore_set from wiping nested fridge fields:
-            # - merge DB fridge dict → then overlay SS dict
+            # 🔒 Preserve Measurement Notion facts (write-once like FABIN):
+            # - merge stored fridge dict (tracker baseline) → then overlay SS dict
             # - notion/notion_page_id are write-once: never overwritten by ""
             # ------------------------------------------------------------
             try:
-                # run0  = firestore_get("runs", loaded_run_no, id_token)
-                run0  = firestore_get("runs", loaded_run_doc_id, id_token)
-                meta0 = firestore_to_python((run0 or {}).get("fields", {}).get("metadata", {}))
-                db_fridges = (meta0.get("measure", {}).get("fridges", {}) or {})
+                meta0 = run_changes.baseline.get("metadata") or {}
+                meas0 = meta0.get("measure") if isinstance(meta0, dict) else {}
+                db_fridges = ((meas0 or {}).get("fridges", {}) if isinstance(meas0, dict) else {}) or {}
 
                 fr_ss = (
                     st.session_state.setdefault("update_meta", {})
@@ -2166,7 +2185,7 @@ if mode == "Update Run":
 
                 # 1) start from DB as baseline (full dict)
                 for uid, dbm in (db_fridges or {}).items():
-                    if not isinstance(dbm, dict):
+                    if not isinstance(dbm, dict) or uid not in flow_fridge_uids:
                         continue
 
                     ssm = fr_ss.get(uid, {})
@@ -2216,10 +2235,7 @@ if mode == "Update Run":
                 fields.get("device_name", {}).get("stringValue", "")
             )
 
-            firestore_set(
-                "runs",
-                loaded_run_doc_id,
-                {
+            run_doc_data = {
                     "run_no": loaded_run_no,
                     "class": st.session_state["loaded_run_class"],  # ✅ REQUIRED
                     # "device_name": fields["device_name"]["stringValue"],
@@ -2228,9 +2244,8 @@ if mode == "Update Run":
                     "creator": fields["creator"]["stringValue"],
                     "steps": st.session_state["update_layers"],
                     "metadata": st.session_state["update_meta"],
-                },
-                id_token=id_token,
-            )
+                    **run_filter_fields(st.session_state["update_meta"]),
+            }
 
 
             flow_fridge_labels = {}
@@ -2247,29 +2262,11 @@ if mode == "Update Run":
             meta_measure = st.session_state.get("update_meta", {}).get("measure", {})
             meta_fridges = meta_measure.get("fridges", {})
 
-            changed = False
+            # changed labels reach Firestore as ...fridges.<uid>.label paths
             for uid, meta in meta_fridges.items():
                 flow_label = flow_fridge_labels.get(uid)
                 if flow_label and meta.get("label") != flow_label:
                     meta["label"] = flow_label
-                    changed = True
-
-            if changed:
-                for uid, meta in meta_fridges.items():
-                    flow_label = flow_fridge_labels.get(uid)
-                    if flow_label and meta.get("label") != flow_label:
-                        # keep local cache consistent
-                        meta["label"] = flow_label
-
-                        # ✅ update ONLY the label field (do NOT overwrite entire fridges map)
-                        firestore_update_field(
-                            "runs",
-                            # loaded_run_no,
-                            loaded_run_doc_id,
-                            f"metadata.measure.fridges.{uid}.label",
-                            flow_label,
-                            id_token=id_token,
-                        )
 
 
             # ------------------------------------------------------------
@@ -2293,21 +2290,38 @@ if mode == "Update Run":
             if isinstance(meta_chips, dict):
                 stale_uids = set(meta_chips.keys()) - flow_chip_uids
 
-                if stale_uids:
-                    for uid in stale_uids:
-                        meta_chips.pop(uid, None)
+                for uid in stale_uids:
+                    meta_chips.pop(uid, None)
 
-                    # Write pruned metadata back to Firestore
-                    firestore_update_field(
+            # ------------------------------------------------------------
+            # 💾 Minimal diff → one round-trip for the whole save
+            # - changed / added values, deleted keys (e.g. fridges / chips
+            #   pruned from the flow above)
+            # ------------------------------------------------------------
+            run_updates = run_changes.changes(run_doc_data)
+
+            try:
+                if run_updates:
+                    run_writes.update_fields(
                         "runs",
-                        # loaded_run_no,
                         loaded_run_doc_id,
-                        "metadata.package.chips",
-                        meta_chips,
-                        id_token=id_token,
+                        run_updates,
+                        update_time=run_changes.update_time,
                     )
+                    run_writes.commit()
+                    run_changes.mark_saved(run_updates)
+            except FirestoreConflict:
+                st.error(CONFLICT_MESSAGE)
+                return
+            except requests.HTTPError as e:
+                st.error(f"Not saved: Firestore write failed: {e}")
+                return
 
 
+            # Notion side effects below are queued in the outbox and applied
+            # in the background (page creation stays inline: its id is saved)
+            if notion_source is not None:
+                start_drainer(st.secrets["notion"]["NOTION_TOKEN"])
 
             # ====================================================
             # ✅ MEASUREMENT NOTION: trigger ONLY on cooldown_start edge
@@ -2317,6 +2331,9 @@ if mode == "Update Run":
             # ====================================================
             if sync_measure_notion:
 
+                # Notion URL / page_id pointers: one commit after the loop
+                notion_refs = WriteBatch(id_token)
+
                 try:
                 
                     ###################### new
@@ -2333,13 +2350,16 @@ if mode == "Update Run":
                     # 0) previous snapshot from run-load (Step A)
                     prev_fridges = st.session_state.get("prev_measure_fridges_snapshot", {}) or {}
 
-                    # 1) read back Firestore after write (authoritative post-save state)
-                    # run_data_live = firestore_get("runs", loaded_run_no, id_token)
-                    run_data_live = firestore_get("runs", loaded_run_doc_id, id_token)
-                    fields_live = (run_data_live or {}).get("fields", {})
-                    meta_live = firestore_to_python(fields_live.get("metadata", {})) if fields_live else {}
-                    meas_live = (meta_live or {}).get("measure", {}) if isinstance(meta_live, dict) else {}
-                    fridges_live = (meas_live or {}).get("fridges", {}) if isinstance(meas_live, dict) else {}
+                    # 1) post-save state: the merged session fridges are exactly
+                    #    what was just committed (no read-back needed); copies,
+                    #    the loop below edits them independently of the session
+                    fridges_live = {
+                        uid: dict(meta)
+                        for uid, meta in (
+                            st.session_state["update_meta"].get("measure", {}).get("fridges", {}) or {}
+                        ).items()
+                        if isinstance(meta, dict)
+                    }
 
                     # 2) build a uid -> label map from the *saved* steps (or update_layers)
                     fridge_label = {}
@@ -2396,12 +2416,11 @@ if mode == "Update Run":
                         # If page_id is empty but URL exists → clear URL
                         # ------------------------------------------------------------
                         if (not cur_page_id) and cur_notion_url:
-                            firestore_update_field(
+                            notion_refs.update_field(
                                 "runs",
                                 loaded_run_doc_id,
                                 f"metadata.measure.fridges.{fridge_uid}.notion",
                                 "",
-                                id_token=id_token,
                             )
 
                             st.session_state["update_meta"]["measure"]["fridges"][fridge_uid]["notion"] = ""
@@ -2501,26 +2520,22 @@ if mode == "Update Run":
 
                                 # ✅ Backfill URL if page_id exists but URL missing (write-once repair)
                                 if page_id and (not cur_notion_url) and notion_url:
-                                    firestore_update_field(
+                                    notion_refs.update_field(
                                         "runs",
-                                        # loaded_run_no,
                                         loaded_run_doc_id,
                                         f"metadata.measure.fridges.{fridge_uid}.notion",
                                         notion_url,
-                                        id_token=id_token,
                                     )
                                     st.session_state["update_meta"]["measure"]["fridges"][fridge_uid]["notion"] = notion_url
                                     cur_meta["notion"] = notion_url
 
                                 # ✅ Backfill page_id if URL exists but page_id missing (optional)
                                 if notion_url and (not cur_page_id) and page_id:
-                                    firestore_update_field(
+                                    notion_refs.update_field(
                                         "runs",
-                                        # loaded_run_no,
                                         loaded_run_doc_id,
                                         f"metadata.measure.fridges.{fridge_uid}.notion_page_id",
                                         page_id,
-                                        id_token=id_token,
                                     )
                                     st.session_state["update_meta"]["measure"]["fridges"][fridge_uid]["notion_page_id"] = page_id
                                     cur_meta["notion_page_id"] = page_id
@@ -2528,23 +2543,20 @@ if mode == "Update Run":
 
                                 # write-once facts: persist to Firestore
                                 if notion_url:
-                                    firestore_update_field(
+                                    notion_refs.update_field(
                                         "runs",
                                         loaded_run_doc_id,
                                         f"metadata.measure.fridges.{fridge_uid}.notion",
                                         notion_url,
-                                        id_token=id_token,
                                     )
 
 
                                 if page_id:
-                                    firestore_update_field(
+                                    notion_refs.update_field(
                                         "runs",
-                                        # loaded_run_no,
                                         loaded_run_doc_id,
                                         f"metadata.measure.fridges.{fridge_uid}.notion_page_id",
                                         page_id,
-                                        id_token=id_token,
                                     )
 
 
@@ -2581,8 +2593,8 @@ if mode == "Update Run":
 
                             if cur_url:
                                 try:
-                                    update_page_properties(
-                                        notion_token=st.secrets["notion"]["NOTION_TOKEN"],
+                                    enqueue_page_properties(
+                                        loaded_run_doc_id,
                                         db_url=db_url,
                                         page_url=cur_url,              # 🔑 page_url (not page_id)
                                         properties={
@@ -2596,19 +2608,18 @@ if mode == "Update Run":
                                     cur_warm = (cur_meta.get("warmup_start") or "").strip()
                                     end_date = cur_warm.split(" ")[0] if cur_warm else ""
 
-                                    update_date_range(
-                                        notion_token=st.secrets["notion"]["NOTION_TOKEN"],
+                                    enqueue_date_range(
+                                        loaded_run_doc_id,
                                         page_id=cur_page_id,            # page_id is safest for date ops
                                         prop_name="Cooldown dates",
                                         start_date=start_date,
                                         end_date=end_date,
                                     )
 
-                                    # st.warning(f"[DBG][RENAME] calling update_page_properties for uid={fridge_uid}")
-                                    notion_success("Measurement Notion Name & cooldown dates updated", fridge_display_label.get(fridge_uid, label))
+                                    notion_success("Measurement Notion Name & cooldown dates queued", fridge_display_label.get(fridge_uid, label))
 
                                 except Exception as e:
-                                    st.warning(f"[RENAME] Notion rename failed (non-blocking): {e}")
+                                    st.warning(f"[RENAME] Notion rename not queued (non-blocking): {e}")
                             else:
                                 st.warning(f"[RENAME] skipped: missing notion url (uid={fridge_uid})")
 
@@ -2629,37 +2640,31 @@ if mode == "Update Run":
 
                             if page_id_to_archive:
                                 try:
-                                   
-                                    archive_page(
-                                        notion_token=st.secrets["notion"]["NOTION_TOKEN"],
+                                    enqueue_archive(
+                                        loaded_run_doc_id,
                                         page_id=page_id_to_archive,
-                                        archived=True,
                                         clear_relations=True,
                                     )
 
-                                    notion_success("Related Notion pages deleted)", fridge_display_label.get(fridge_uid, label))
+                                    notion_success("Related Notion page deletion queued", fridge_display_label.get(fridge_uid, label))
 
                                 except Exception as e:
-                                    st.warning(f"Notion archive failed (non-blocking): {e}")
+                                    st.warning(f"Notion archive not queued (non-blocking): {e}")
 
                             # ------------------------------------------------------------
                             # 1) Clear Firestore pointers (authoritative)
                             # ------------------------------------------------------------
-                            firestore_update_field(
+                            notion_refs.update_field(
                                 "runs",
-                                # loaded_run_no,
                                 loaded_run_doc_id,
                                 f"metadata.measure.fridges.{fridge_uid}.notion",
                                 "",
-                                id_token=id_token,
                             )
-                            firestore_update_field(
+                            notion_refs.update_field(
                                 "runs",
-                                # loaded_run_no,
                                 loaded_run_doc_id,
                                 f"metadata.measure.fridges.{fridge_uid}.notion_page_id",
                                 "",
-                                id_token=id_token,
                             )
 
                             # ------------------------------------------------------------
@@ -2707,20 +2712,18 @@ if mode == "Update Run":
                                     end_date   = cur_warm.split(" ")[0] if cur_warm else ""  # "" clears end
 
 
-                                    # st.warning(f"[DBG][DATE-RANGE] calling update_date_range for uid={fridge_uid}")
-
-                                    update_date_range(
-                                        notion_token=st.secrets["notion"]["NOTION_TOKEN"],
+                                    enqueue_date_range(
+                                        loaded_run_doc_id,
                                         page_id=page_id_live,
                                         prop_name="Cooldown dates",
                                         start_date=start_date,
                                         end_date=end_date,
                                     )
 
-                                    notion_success("Measurement Notion cooldown date updated", fridge_display_label.get(fridge_uid, label))
+                                    notion_success("Measurement Notion cooldown date queued", fridge_display_label.get(fridge_uid, label))
 
                         except Exception as e:
-                            st.warning(f"Saved, but Cooldown date-range update failed (non-blocking): {e}")
+                            st.warning(f"Saved, but Cooldown date-range update not queued (non-blocking): {e}")
 
                     # ------------------------------------------------------------
                     # Measurement → Bluefors Notion: sync "Chip" (multi-select)
@@ -2813,11 +2816,8 @@ if mode == "Update Run":
                             continue
 
                         try:
-                            # st.write("[DBG][BLUEFORS] calling notion_update_page.py ...")
-                            # st.warning(f"[DBG][BLUEFORS-CHIP] calling update_page_properties for uid={bf_uid}")
-
-                            update_page_properties(
-                                notion_token=st.secrets["notion"]["NOTION_TOKEN"],
+                            enqueue_page_properties(
+                                loaded_run_doc_id,
                                 page_url=bf_notion_url,
                                 db_url=db_url_used,
                                 properties={
@@ -2826,12 +2826,11 @@ if mode == "Update Run":
                             )
 
                             st.session_state[prev_key] = sig_new
-                            # st.write("[DBG][BLUEFORS] notion update OK")
-                            notion_success("Bluefors Notion chip list updated", fridge_display_label.get(bf_uid, fridge_label.get(bf_uid)))
+                            notion_success("Bluefors Notion chip list queued", fridge_display_label.get(bf_uid, fridge_label.get(bf_uid)))
 
                         except Exception as e:
                             st.warning(
-                                f"Saved, but Bluefors Chip -> Notion sync failed "
+                                f"Saved, but Bluefors Chip -> Notion sync not queued "
                                 f"(uid={bf_uid}, non-blocking): {e}"
                             )
 
@@ -2852,6 +2851,15 @@ if mode == "Update Run":
                 except Exception as e:
                     st.warning(f"Measurement Notion sync failed (non-blocking): {e}")
 
+                finally:
+                    # persist whatever was recorded, even if a later fridge failed
+                    try:
+                        commit_run_writes(notion_refs, loaded_run_doc_id)
+                    except FirestoreConflict:
+                        st.error(CONFLICT_MESSAGE)
+                    except requests.HTTPError as e:
+                        st.warning(f"Measurement Notion links not saved: {e}")
+
 
 
             # 2) Optional: sync Design Lotid → Fab Notion page "Lot ID"
@@ -2897,18 +2905,17 @@ if mode == "Update Run":
 
                     if props:
                         try:
-                            update_page_properties(
-                                notion_token=st.secrets["notion"]["NOTION_TOKEN"],
-                                # db_url=st.secrets["notion"]["NOTION_FAB_DB_URL"],
+                            enqueue_page_properties(
+                                loaded_run_doc_id,
                                 db_url=_pick_fab_db_url(st.session_state["loaded_run_class"]),
                                 page_url=fab_notion_url,
                                 properties=props,
                             )
-                            
-                            notion_success("Fab Notion updated")
+
+                            notion_success("Fab Notion update queued")
 
                         except Exception as e:
-                            st.warning(f"Saved, but Notion update failed: {e}")
+                            st.warning(f"Saved, but Notion update not queued: {e}")
 
                 st.session_state[prev_key] = sig_new
 
@@ -2931,19 +2938,17 @@ if mode == "Update Run":
 
                 if fab_notion_url and fab_props and (sig_new != sig_old):
                     try:
-                   
-                        update_page_properties(
-                            notion_token=st.secrets["notion"]["NOTION_TOKEN"],
-                            # db_url=st.secrets["notion"]["NOTION_FAB_DB_URL"],
+                        enqueue_page_properties(
+                            loaded_run_doc_id,
                             db_url=_pick_fab_db_url(st.session_state["loaded_run_class"]),
                             page_url=fab_notion_url,
                             properties=fab_props,
                         )
 
-                        notion_success("Fab Notion sync completed")
+                        notion_success("Fab Notion sync queued")
 
                     except Exception as e:
-                        st.warning(f"Saved, but Fab Notion fields update failed: {e}")
+                        st.warning(f"Saved, but Fab Notion fields update not queued: {e}")
 
                     st.session_state[prev_key2] = sig_new
 
@@ -3046,9 +3051,8 @@ if mode == "Update Run":
 
                     if fab_notion_url and (sig_new3 != sig_old3):
 
-                        update_page_properties(
-                            notion_token=st.secrets["notion"]["NOTION_TOKEN"],
-                            # db_url=st.secrets["notion"]["NOTION_FAB_DB_URL"],
+                        enqueue_page_properties(
+                            loaded_run_doc_id,
                             db_url=_pick_fab_db_url(st.session_state["loaded_run_class"]),
                             page_url=fab_notion_url,
                             properties=props,
@@ -3056,11 +3060,18 @@ if mode == "Update Run":
 
                         st.session_state[prev_key3] = sig_new3
 
-                        notion_success("Fab Notion sync completed")
+                        notion_success("Fab Notion sync queued")
 
                 except Exception as e:
-                    st.warning(f"Saved, but Bond -> Notion sync failed (non-blocking): {e}")
+                    st.warning(f"Saved, but Bond -> Notion sync not queued (non-blocking): {e}")
+
 
+            # ------------------------------------------
+            # 🔄 Viewers: drop the shared run cache (every write above
+            # already does this via the firebase_client write listener;
+            # this is the one that must not be missed)
+            # ------------------------------------------
+            invalidate_runs()
 
             # ------------------------------------------
             # 🔒 Reset all status locks after save
@@ -3291,10 +3302,11 @@ if mode == "Update Run":
                                             old_id = _get_design_val("FileId") if has_file else ""
 
                                             with st.spinner("Uploading to Drive…"):
-                                                out = upload_file_via_cleanroom_api(
+                                                out = upload_attachment(
                                                     uploaded_file=uploaded,
                                                     filename=uploaded.name,
                                                     folder_id=st.secrets["app"]["drive_folder_id_design"],
+                                                    id_token=id_token,
                                                 )
 
                                             if not out.get("success", False):
@@ -3309,8 +3321,9 @@ if mode == "Update Run":
                                                 _upsert_design_kv("FileName", file_name)
 
                                                 # ✅ Trash old file only after new upload succeeds
-                                                if old_id and old_id != file_id:
-                                                    del_out = delete_file_via_cleanroom_api(file_id=old_id)
+                                                # same content again: only drops the extra registry reference
+                                                if old_id:
+                                                    del_out = release_attachment(file_id=old_id, id_token=id_token)
                                                     if not del_out.get("success", False):
                                                         st.warning(
                                                             "New file uploaded, but old file could not be trashed: "
@@ -3409,33 +3422,53 @@ if mode == "Update Run":
                         with tab_add:
                             col, _ = st.columns([1,1])
                             with col:
-                                uploaded_add = st.file_uploader(
+                                uploaded_adds = st.file_uploader(
                                     "Add",
                                     key=f"upd_fab_add_{loaded_run_doc_id}_{st.session_state['upd_fab_upload_nonce']}",
                                     type=None,
+                                    accept_multiple_files=True,
                                 )
 
-                            if uploaded_add is not None:
+                            if uploaded_adds:
                                 with col:
-                                    if st.button("Add attachment", key=f"upd_fab_add_btn_{loaded_run_doc_id}", use_container_width=True):
-                                        out = upload_file_via_cleanroom_api(
-                                            uploaded_file=uploaded_add,
-                                            filename=uploaded_add.name,
+                                    label = "Add attachment" if len(uploaded_adds) == 1 else f"Add {len(uploaded_adds)} attachments"
+                                    if st.button(label, key=f"upd_fab_add_btn_{loaded_run_doc_id}", use_container_width=True):
+                                        # concurrent uploads, one progress bar per file
+                                        bars = [st.progress(0.0, text=f.name) for f in uploaded_adds]
+
+                                        def _show_progress(i, sent, total):
+                                            bars[i].progress(sent / total if total else 1.0, text=uploaded_adds[i].name)
+
+                                        outs = upload_attachments(
+                                            files=[(f, f.name) for f in uploaded_adds],
                                             folder_id=st.secrets["app"]["drive_folder_id_fab"],
+                                            id_token=id_token,
+                                            on_progress=_show_progress,
                                         )
-                                        if out.get("success"):
-                                            fab_files.append({
-                                                "id": out.get("id",""),
-                                                "name": out.get("name", uploaded_add.name),
-                                                "url": out.get("url",""),
-                                                "sig": (uploaded_add.name, uploaded_add.size),
-                                            })
+
+                                        failed = []
+                                        for uploaded_add, out in zip(uploaded_adds, outs):
+                                            if out.get("success"):
+                                                fab_files.append({
+                                                    "id": out.get("id",""),
+                                                    "name": out.get("name", uploaded_add.name),
+                                                    "url": out.get("url",""),
+                                                    "sig": (uploaded_add.name, uploaded_add.size),
+                                                })
+                                            else:
+                                                failed.append(f"{uploaded_add.name}: {out.get('error','Upload failed')}")
+
+                                        if len(failed) < len(outs):
+                                            # uploaded ones are kept: clear the picker so they are not sent twice
                                             _sync_fab_files_to_meta()
                                             st.session_state["upd_fab_upload_nonce"] += 1
-                                            st.success("Attachment added.")
-                                            st.rerun()
+
+                                        if failed:
+                                            for msg in failed:
+                                                st.error(msg)
                                         else:
-                                            st.error(out.get("error","Upload failed"))
+                                            st.success("Attachment added." if len(outs) == 1 else f"{len(outs)} attachments added.")
+                                            st.rerun()
 
                         # -------------------------
                         # ✏️ Edit tab
@@ -3498,10 +3531,11 @@ if mode == "Update Run":
                                                 key=f"upd_fab_replace_confirm_{loaded_run_doc_id}",
                                                 use_container_width=True,
                                             ):
-                                                out = upload_file_via_cleanroom_api(
+                                                out = upload_attachment(
                                                     uploaded_file=uploaded_rep,
                                                     filename=uploaded_rep.name,
                                                     folder_id=st.secrets["app"]["drive_folder_id_fab"],
+                                                    id_token=id_token,
                                                 )
                                                 if out.get("success"):
                                                     old_id = fab_files[sel].get("id", "")
@@ -3516,8 +3550,10 @@ if mode == "Update Run":
 
                                                     _sync_fab_files_to_meta()
 
-                                                    if old_id and old_id != new_id:
-                                                        del_out = delete_file_via_cleanroom_api(file_id=old_id)
+                                                    # same content again: only drops the extra registry reference
+
+                                                    if old_id:
+                                                        del_out = release_attachment(file_id=old_id, id_token=id_token)
                                                         if not del_out.get("success"):
                                                             st.warning("Old file could not be trashed.")
 
@@ -3548,7 +3584,7 @@ if mode == "Update Run":
                                     ):
                                         old_id = fab_files[sel].get("id", "")
                                         if old_id:
-                                            del_out = delete_file_via_cleanroom_api(file_id=old_id)
+                                            del_out = release_attachment(file_id=old_id, id_token=id_token)
                                             if not del_out.get("success"):
                                                 st.warning("Removed from list but not trashed in Drive.")
                                         fab_files.pop(sel)
@@ -3657,7 +3693,7 @@ if mode == "Update Run":
                                         st.session_state["update_meta"]["design"] = new_design_meta
 
                                         # Then write full list back
-                                        firestore_update_field(
+                                        update_run_field(
                                             "runs",
                                             loaded_run_doc_id,
                                             "metadata.design",
@@ -3704,7 +3740,7 @@ if mode == "Update Run":
                                     st.session_state["update_meta"]["design"] = new_design_meta
 
                                     # Update Firestore
-                                    firestore_update_field(
+                                    update_run_field(
                                         "runs",
                                         loaded_run_doc_id,
                                         "metadata.design",
@@ -3843,7 +3879,7 @@ if mode == "Update Run":
                                         "value": fab_top_note,
                                     })
 
-                                firestore_update_field(
+                                update_run_field(
                                     "runs",
                                     loaded_run_doc_id,
                                     "metadata.fab",
@@ -3852,14 +3888,17 @@ if mode == "Update Run":
                                 )
 
                                 with st.spinner("Applying Fab content template (Notion)…"):
-                                    result = add_fab_content(
-                                        notion_token=st.secrets["notion"]["NOTION_TOKEN"],
-                                        page_url=payload["page_url"],
-                                        num_chips=payload["num_chips"],
-                                        payload=payload,
-                                        fabdata_db_urls=st.secrets["notion"]["NOTION_FABDATA_DB_URLS"],
-                                        mode="all",
-                                    )
+                                    try:
+                                        result = add_fab_content(
+                                            notion_token=st.secrets["notion"]["NOTION_TOKEN"],
+                                            page_url=payload["page_url"],
+                                            num_chips=payload["num_chips"],
+                                            payload=payload,
+                                            fabdata_db_urls=st.secrets["notion"]["NOTION_FABDATA_DB_URLS"],
+                                            mode="all",
+                                        )
+                                    except Exception as e:
+                                        result = {"error": str(e)}
 
                                 if result.get("success"):
                                     child_ids = result.get("fab_child_page_ids", [])
@@ -3878,7 +3917,7 @@ if mode == "Update Run":
                                                 "value": child_ids,
                                             })
 
-                                        firestore_update_field(
+                                        update_run_field(
                                             "runs",
                                             loaded_run_doc_id,
                                             "metadata.fab",
@@ -3889,7 +3928,8 @@ if mode == "Update Run":
                                     st.success("Fab content added and page IDs saved.")
 
                                 else:
-                                    st.warning(f"Fab content failed: {result}")
+                                    # finished steps are journaled: clicking again resumes
+                                    st.warning(f"Fab content failed: {result} (click again to resume; finished steps are skipped)")
 
 
 
@@ -3955,7 +3995,7 @@ if mode == "Update Run":
                                         # ✅ only set if currently empty (prevents restamp on repeated Save)
                                         if not (ss_completed.get("value") or "").strip():
                                             ss_completed["value"] = now_chi
-                                            firestore_update_field(
+                                            update_run_field(
                                                 "runs",
                                                 # loaded_run_no,
                                                 loaded_run_doc_id,
@@ -3968,7 +4008,7 @@ if mode == "Update Run":
                                         # ✅ clear when <100 (but only if currently non-empty)
                                         if (ss_completed.get("value") or "").strip():
                                             ss_completed["value"] = ""
-                                            firestore_update_field(
+                                            update_run_field(
                                                 "runs",
                                                 # loaded_run_no,
                                                 loaded_run_doc_id,
@@ -4020,7 +4060,7 @@ if mode == "Update Run":
 
                             if all_pending and fabin_row and fabin_row.get("value"):
                                 fabin_row["value"] = ""
-                                firestore_update_field(
+                                update_run_field(
                                     "runs",
                                     loaded_run_doc_id,
                                     "metadata.fab.fabin",
@@ -4039,7 +4079,7 @@ if mode == "Update Run":
                                 if started_times:
                                     fabin_time = min(started_times)
                                     fabin_row["value"] = fabin_time
-                                    firestore_update_field("runs", loaded_run_doc_id, "metadata.fab.fabin", fabin_time, id_token)
+                                    update_run_field("runs", loaded_run_doc_id, "metadata.fab.fabin", fabin_time, id_token)
 
                             override_fabout_on = st.session_state.get(f"ovr_fab_fabout_{loaded_run_doc_id}", False)
 
@@ -4048,7 +4088,7 @@ if mode == "Update Run":
                                     # ✅ only set if currently empty (prevents restamp on repeated Save)
                                     if not (fabout_row.get("value") or "").strip():
                                         fabout_row["value"] = now_chi
-                                        firestore_update_field(
+                                        update_run_field(
                                             "runs",
                                             # loaded_run_no,
                                             loaded_run_doc_id,
@@ -4061,7 +4101,7 @@ if mode == "Update Run":
                                     # ✅ clear when <100 (but only if currently non-empty)
                                     if (fabout_row.get("value") or "").strip():
                                         fabout_row["value"] = ""
-                                        firestore_update_field(
+                                        update_run_field(
                                             "runs",
                                             # loaded_run_no,
                                             loaded_run_doc_id,
@@ -0,0 +1,334 @@
+# benchmarks/bench_firestore_decode.py
+#
+# Micro-benchmark: decoding a synthetic 500-run collection.
+#
+#   python -m benchmarks.bench_firestore_decode [--runs 500] [--repeat 5]
+#
+# Compares the code that existed before core/firestore_codec.py (copied
+# below as legacy_*: firebase_client.firestore_to_python, viewer
+# parse_layers, flow_builder firestore_fields_to_layers) with the
+# dispatch-table decoder, the typed steps fast path (decode_steps) and
+# core.model Layer objects built from it.
+#
+# decode_steps alone beats the viewer walker, but does not normalize
+# substep names or fall back to chip progress; with those added the gain
+# is within noise. Layer / Substep / Chip objects cost about 3x the
+# dicts, and flow_builder would have to rebuild its dicts from
+# decode_steps. So viewer.parse_layers and
+# flow_builder.firestore_fields_to_layers keep their walkers; the
+# "flow_builder" row checks the one in use against the copy.
+
+import argparse
+import copy
+import random
+import time
+
+from core.firestore_codec import decode_steps, decode_value, encode_value
+from core.model import Layer
+from services.flow_builder import ensure_flow_ids, firestore_fields_to_layers
+from services.flow_defaults import DEFAULT_FLOW
+
+
+STATUSES = ("pending", "in_progress", "done", "terminate", "store#1", "delivery#2")
+
+
+# ============================================================
+# SYNTHETIC COLLECTION
+# ============================================================
+
+def synthetic_run(i, rng):
+    steps = copy.deepcopy(DEFAULT_FLOW)
+    for layer in steps:
+        layer["progress"] = rng.choice((0, 0, 50, 100))
+        for n, sub in enumerate(layer["substeps"]):
+            sub["id"] = f"sub-{i}-{n}"
+            sub.setdefault("label", sub.get("name", ""))
+            sub.setdefault("name", sub["label"])
+            if layer["layer_name"] == "Package":
+                sub["chip_uid"] = f"chip_{i:04d}{n}"
+            if layer["layer_name"] == "Measurement":
+                sub["fridge_uid"] = f"fridge_{i:04d}{n}"
+            for chip in sub["chips"]:
+                chip["status"] = rng.choice(STATUSES)
+                if chip["status"] != "pending":
+                    chip["started_at"] = "2026-01-05 10:00:00"
+                if chip["status"] == "done":
+                    chip["completed_at"] = "2026-01-06 10:00:00"
+
+    metadata = {
+        "design": [{"key": "Lotid", "value": f"L{i:04d}"}, {"key": "Completed", "value": "2026-01-02"}],
+        "fab": [{"key": "Fabin", "value": "2026-01-03"}, {"key": "Fabout", "value": ""}],
+        "package": {"chips": {f"chip_{i:04d}0": {"pcb_ready": "", "bond_date": "", "notion": None}}},
+        "measure": {"fridges": {f"fridge_{i:04d}0": {"cooldown_start": "2026-01-09", "storage": ""}}},
+    }
+
+    return {
+        "name": f"projects/p/databases/(default)/documents/runs/main_{i:04d}",
+        "fields": {
+            "run_no": encode_value(f"{i:04d}"),
+            "class": encode_value("Main"),
+            "device_name": encode_value(f"Device-{i % 17}"),
+            "created_date": encode_value("2026-01-01"),
+            "creator": encode_value("bench"),
+            "steps": encode_value(steps),
+            "metadata": encode_value(metadata),
+        },
+    }
+
+
+# ============================================================
+# LEGACY DECODERS (as they were before core/firestore_codec.py)
+# ============================================================
+
+def legacy_firestore_to_python(v):
+    # firebase_client.firestore_to_python
+    if not isinstance(v, dict):
+        return v
+    if "stringValue" in v:
+        return v["stringValue"]
+    if "integerValue" in v:
+        return int(v["integerValue"])
+    if "doubleValue" in v:
+        return float(v["doubleValue"])
+    if "booleanValue" in v:
+        return bool(v["booleanValue"])
+    if "timestampValue" in v:
+        return v["timestampValue"]
+    if "arrayValue" in v:
+        out = []
+        for item in v["arrayValue"].get("values", []):
+            if "mapValue" in item:
+                fields = item["mapValue"].get("fields", {})
+                if "key" in fields and "value" in fields:
+                    out.append({
+                        "key": legacy_firestore_to_python(fields["key"]),
+                        "value": legacy_firestore_to_python(fields["value"]),
+                    })
+                else:
+                    out.append({kk: legacy_firestore_to_python(vv) for kk, vv in fields.items()})
+            else:
+                out.append(legacy_firestore_to_python(item))
+        return out
+    if "mapValue" in v:
+        fields = v["mapValue"].get("fields", {})
+        if "key" in fields and "value" in fields:
+            return {
+                "key": legacy_firestore_to_python(fields["key"]),
+                "value": legacy_firestore_to_python(fields["value"]),
+            }
+        return {kk: legacy_firestore_to_python(vv) for kk, vv in fields.items()}
+    return v
+
+
+def legacy_get_num(field_dict, default=0):
+    # viewer.get_num
+    if not isinstance(field_dict, dict):
+        return default
+    if "integerValue" in field_dict:
+        return int(field_dict["integerValue"])
+    if "doubleValue" in field_dict:
+        return float(field_dict["doubleValue"])
+    return default
+
+
+def legacy_parse_layers(fields):
+    # viewer.parse_layers (commented-out variants dropped)
+    root = fields.get("steps", {}).get("arrayValue", {}).get("values", [])
+    if not root:
+        return []
+
+    layers = []
+    for lv in root:
+        f = lv["mapValue"]["fields"]
+
+        layer_name = f["layer_name"]["stringValue"]
+        progress = legacy_get_num(f.get("progress", {}), 0)
+
+        sub_raw = f["substeps"]["arrayValue"]["values"]
+        substeps = []
+
+        for sv in sub_raw:
+            sm = sv["mapValue"]["fields"]
+            sub_name = (
+                sm.get("label", {}).get("stringValue")
+                or sm.get("name", {}).get("stringValue")
+                or "Unknown"
+            )
+
+            chips = []
+            chips_raw = sm.get("chips", {}).get("arrayValue", {}).get("values", [])
+            for cv in chips_raw:
+                cf = cv["mapValue"]["fields"]
+                chip_obj = {
+                    "name": cf["name"]["stringValue"],
+                    "status": cf["status"]["stringValue"],
+                }
+                if "started_at" in cf:
+                    chip_obj["started_at"] = cf["started_at"]["stringValue"]
+                if "completed_at" in cf:
+                    chip_obj["completed_at"] = cf["completed_at"]["stringValue"]
+                chips.append(chip_obj)
+
+            substep_obj = {
+                "name": sub_name,
+                "label": sub_name,
+                "chips": chips,
+            }
+            if "chip_uid" in sm:
+                substep_obj["chip_uid"] = sm.get("chip_uid", {}).get("stringValue")
+            if "fridge_uid" in sm:
+                substep_obj["fridge_uid"] = sm.get("fridge_uid", {}).get("stringValue")
+
+            substeps.append(substep_obj)
+
+        all_chips = [c for s in substeps for c in s["chips"]]
+
+        def is_completed(c):
+            status = (c.get("status") or "").lower()
+            return (
+                status == "done"
+                or status.startswith("store#")
+                or status.startswith("delivery#")
+            )
+
+        def is_terminated(c):
+            return (c.get("status") or "").lower() == "terminate"
+
+        if progress == 0 and all_chips:
+            lname = layer_name.lower()
+            if lname in ("package", "measurement"):
+                total = 0
+                done = 0
+                for sub in substeps:
+                    chips = sub.get("chips", [])
+                    if any(is_terminated(c) for c in chips):
+                        continue
+                    for c in chips:
+                        total += 1
+                        if is_completed(c):
+                            done += 1
+                progress = int(100 * done / total) if total else 0
+            else:
+                done_count = sum(1 for c in all_chips if is_completed(c))
+                progress = int(100 * done_count / len(all_chips))
+
+        layers.append({
+            "layer_name": layer_name,
+            "progress": progress,
+            "substeps": substeps,
+        })
+
+    return layers
+
+
+def legacy_fields_to_layers(fields):
+    # services/flow_builder.firestore_fields_to_layers
+    steps_raw = fields["steps"]["arrayValue"]["values"]
+    layers_py = []
+
+    for layer in steps_raw:
+        lf = layer["mapValue"]["fields"]
+
+        substeps_py = []
+        for sv in lf["substeps"]["arrayValue"]["values"]:
+            sf = sv["mapValue"]["fields"]
+
+            chips = []
+            for ch in sf["chips"]["arrayValue"]["values"]:
+                cf = ch["mapValue"]["fields"]
+                chips.append({
+                    "name": cf["name"]["stringValue"],
+                    "status": cf["status"]["stringValue"],
+                })
+
+            sub_name = (
+                sf.get("label", {}).get("stringValue")
+                or sf.get("name", {}).get("stringValue")
+                or "Unknown"
+            )
+
+            substeps_py.append({
+                "name": sub_name,
+                "chip_uid": sf.get("chip_uid", {}).get("stringValue"),
+                "label": sub_name,
+                "chips": chips,
+            })
+
+        layers_py.append({
+            "layer_name": lf["layer_name"]["stringValue"],
+            "progress": int(lf["progress"]["integerValue"]),
+            "substeps": substeps_py,
+        })
+
+    ensure_flow_ids(layers_py)
+
+    return layers_py
+
+
+# ============================================================
+# RUNNER
+# ============================================================
+
+def best_of(fn, docs, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for doc in docs:
+            fn(doc)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    docs = [synthetic_run(i, rng) for i in range(args.runs)]
+
+    # sanity: same results as before (metadata differs only where the old
+    # decoder returned {"nullValue": None} undecoded), fast path == generic
+    for doc in docs[:20]:
+        steps = doc["fields"]["steps"]
+        assert decode_value(steps) == legacy_firestore_to_python(steps)
+        for new, old in zip(decode_steps(doc["fields"]), legacy_parse_layers(doc["fields"])):
+            layer = Layer.from_dict(new)
+            assert new["layer_name"] == old["layer_name"]
+            assert (layer.progress or layer.chip_progress()) == old["progress"]
+            for ns, os_ in zip(new["substeps"], old["substeps"]):
+                assert (ns.get("label") or ns.get("name")) == os_["name"]
+                assert [c["status"] for c in ns["chips"]] == [c["status"] for c in os_["chips"]]
+        for new, old in zip(firestore_fields_to_layers(doc["fields"]), legacy_fields_to_layers(doc["fields"])):
+            assert new["layer_name"] == old["layer_name"] and new["progress"] == old["progress"]
+            assert [s["chips"] for s in new["substeps"]] == [s["chips"] for s in old["substeps"]]
+
+    cases = [
+        ("full document (generic)",
+         lambda d: {k: legacy_firestore_to_python(v) for k, v in d["fields"].items()},
+         lambda d: {k: decode_value(v) for k, v in d["fields"].items()}),
+        ("steps, full (admin)",
+         lambda d: legacy_firestore_to_python(d["fields"]["steps"]),
+         lambda d: decode_value(d["fields"]["steps"])),
+        ("steps -> dicts (decode_steps)",
+         lambda d: legacy_parse_layers(d["fields"]),
+         lambda d: decode_steps(d["fields"])),
+        ("steps -> Layer objects",
+         lambda d: legacy_parse_layers(d["fields"]),
+         lambda d: [Layer.from_dict(l) for l in decode_steps(d["fields"])]),
+        ("flow_builder",
+         lambda d: legacy_fields_to_layers(d["fields"]),
+         lambda d: firestore_fields_to_layers(d["fields"])),
+    ]
+
+    print(f"{args.runs} runs, best of {args.repeat}")
+    print(f"{'case':<34} {'legacy ms':>10} {'new ms':>10} {'speedup':>8}")
+    for label, old_fn, new_fn in cases:
+        old_t = best_of(old_fn, docs, args.repeat)
+        new_t = best_of(new_fn, docs, args.repeat)
+        print(f"{label:<34} {old_t * 1000:>10.1f} {new_t * 1000:>10.1f} {old_t / new_t:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+# benchmarks/bench_viewer_pipeline.py
+#
+# Stage-by-stage timing of the viewer's per-rerun pipeline over
+# synthetic run collections.
+#
+#   python -m benchmarks.bench_viewer_pipeline [--runs 50,500,2000,5000]
+#       [--repeat 3] [--latency 0.0] [--no-fetch] [--out FILE.json]
+#       [--compare OLD.json]
+#
+# Runs are shaped like admin.py's saves: DEFAULT_FLOW with a varying
+# number of Package chips (C01..), Measurement fridges and Fab chips,
+# Package / Measurement metadata from core.metadata's builders, and the
+# denormalized filter fields. Stages, each timed over the whole
+# collection (best of --repeat):
+#
+#   fetch_cold      RunSnapshot.sync, empty snapshot: runQuery listing +
+#                   batchGet of every run (HTTP + JSON decode), against
+#                   services.firestore_local
+#   fetch_warm      the same sync with nothing changed (listing only)
+#   matches_filters Lot ID + device refinement
+#   deepcopy        copy.deepcopy(fields) per run (what the viewer paid
+#                   before snapshot documents became read-only)
+#   parse_layers
+#   fridge_labels   build_measurement_fridge_display_labels
+#   dashboard_events collect_dashboard_events_from_metadata
+#   layer_card_html every layer card of every run, card caches emptied
+#                   first (a rerun where every run changed)
+#   layer_card_html_warm
+#                   the same with the caches kept (unchanged layers)
+#
+# The viewer functions are compiled from viewer.py itself (function
+# definitions only; importing the page would run it). Results go to a
+# JSON file; --compare prints the per-stage change against an earlier one.
+
+import argparse
+import ast
+import copy
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from core.firestore_codec import encode_fields
+from core.metadata import build_measure_fridge_meta, build_package_chip_meta
+from services.flow_defaults import DEFAULT_FLOW
+from ui import card_html
+
+
+REFRESH_BUDGET_MS = 10000      # viewer st_autorefresh interval
+STAGES = (
+    "fetch_cold",
+    "fetch_warm",
+    "matches_filters",
+    "deepcopy",
+    "parse_layers",
+    "fridge_labels",
+    "dashboard_events",
+    "layer_card_html",
+    "layer_card_html_warm",
+)
+# a rerun where every card is rebuilt (fetch_warm replaces fetch_cold on
+# later ticks; deepcopy is no longer part of the pipeline)
+COLD_RERUN = (
+    "fetch_cold",
+    "matches_filters",
+    "parse_layers",
+    "fridge_labels",
+    "dashboard_events",
+    "layer_card_html",
+)
+STATUSES = ("pending", "pending", "in_progress", "done", "done", "terminate")
+FRIDGES = ("ICEOxford", "Bluefors")
+VIEWER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "viewer.py")
+
+
+# ============================================================
+# SYNTHETIC COLLECTION
+# ============================================================
+
+def _day(rng, start="2025-06-01", span=300):
+    d = datetime.date.fromisoformat(start) + datetime.timedelta(days=rng.randrange(span))
+    return d.isoformat()
+
+
+def _chip_status(chip, rng):
+    name = chip["name"].lower()
+    status = rng.choice(STATUSES)
+    if name == "storage" and status == "done":
+        status = f"store#{rng.randint(1, 3)}"
+    if name == "delivery" and status == "done":
+        status = f"delivery#{rng.randint(1, 3)}"
+    chip["status"] = status
+    if status != "pending":
+        chip["started_at"] = f"{_day(rng)} 10:00:00"
+    if status not in ("pending", "in_progress"):
+        chip["completed_at"] = f"{_day(rng)} 18:00:00"
+
+
+def synthetic_steps(i, rng):
+    """DEFAULT_FLOW with 1-8 package chips, 1-4 fridges and 4-12 Fab chips."""
+    steps = copy.deepcopy(DEFAULT_FLOW)
+    for layer in steps:
+        name = layer["layer_name"]
+        template = layer["substeps"][0]
+
+        if name == "Fabrication":
+            sub = template
+            extra = rng.randint(0, 5)
+            sub["chips"] += [{"name": f"Step {k + 1}", "status": "pending"} for k in range(extra)]
+            layer["substeps"] = [sub]
+
+        elif name == "Package":
+            layer["substeps"] = []
+            for n in range(rng.randint(1, 8)):
+                sub = copy.deepcopy(template)
+                sub["label"] = sub["name"] = f"C{n + 1:02d}"
+                sub["chip_uid"] = f"chip_{i:05d}_{n}"
+                layer["substeps"].append(sub)
+
+        elif name == "Measurement":
+            subs = layer["substeps"]
+            layer["substeps"] = []
+            for n in range(rng.randint(1, 4)):
+                sub = copy.deepcopy(subs[n % len(subs)])
+                sub["label"] = sub["name"] = FRIDGES[n % len(FRIDGES)]
+                sub["fridge_uid"] = f"fridge_{i:05d}_{n}"
+                layer["substeps"].append(sub)
+
+        for sub in layer["substeps"]:
+            sub.setdefault("label", sub.get("name", ""))
+            sub.setdefault("name", sub["label"])
+            for chip in sub["chips"]:
+                _chip_status(chip, rng)
+
+        done = sum(1 for s in layer["substeps"] for c in s["chips"] if c["status"] == "done")
+        total = sum(len(s["chips"]) for s in layer["substeps"]) or 1
+        layer["progress"] = rng.choice((0, round(100 * done / total)))
+    return steps
+
+
+def synthetic_run(i, rng, run_class="Main"):
+    """One run as admin.py saves it (python values)."""
+    steps = synthetic_steps(i, rng)
+
+    chips = build_package_chip_meta(steps, {})
+    for n, chip in enumerate(chips.values()):
+        if rng.random() < 0.6:
+            chip["pcb_ready"] = _day(rng)
+            chip["pcb_type"] = rng.choice(("A", "B"))
+        if rng.random() < 0.4:
+            chip["bond_date"] = _day(rng)
+        if rng.random() < 0.2:
+            chip["delivery"] = rng.choice(("Lab A", "Lab B"))
+            chip["delivery_time"] = _day(rng)
+
+    chip_uids = list(chips)
+    fridges = build_measure_fridge_meta(steps, {})
+    for fridge in fridges.values():
+        fridge["chip_uid"] = rng.choice(chip_uids) if chip_uids else ""
+        if rng.random() < 0.5:
+            fridge["owner"] = rng.choice(("kim", "lee", "park"))
+            fridge["cooldown_start"] = f"{_day(rng)} 09:00"
+            if rng.random() < 0.5:
+                fridge["warmup_start"] = f"{_day(rng)} 09:00"
+
+    lot_id = f"L{i:05d}"
+    fabin = _day(rng) if rng.random() < 0.8 else ""
+    fabout = _day(rng) if fabin and rng.random() < 0.5 else ""
+    metadata = {
+        "design": [
+            {"key": "Creator", "value": "bench"},
+            {"key": "Verifier", "value": ""},
+            {"key": "Lotid", "value": lot_id},
+            {"key": "Completed", "value": _day(rng)},
+            {"key": "FileId_1", "value": f"drive{i:05d}"},
+        ],
+        "fab": [
+            {"key": "Fabin", "value": fabin},
+            {"key": "Fabout", "value": fabout},
+            {"key": "Notes", "value": "synthetic " * rng.randint(1, 20)},
+        ],
+        "package": {"chips": chips},
+        "measure": {"fridges": fridges},
+    }
+
+    return {
+        "run_no": f"{i:05d}",
+        "class": run_class,
+        "device_name": f"Device-{i % 37}",
+        "created_date": _day(rng),
+        "creator": "bench",
+        "lot_id": lot_id,
+        "fabin": fabin,
+        "fabout": fabout,
+        "steps": steps,
+        "metadata": metadata,
+    }
+
+
+def synthetic_collection(n, seed=0):
+    rng = random.Random(seed)
+    return {f"main_{i:05d}": synthetic_run(i, rng) for i in range(n)}
+
+
+def as_documents(collection):
+    """Firestore documents, without the fake (--no-fetch)."""
+    return [
+        {
+            "name": f"projects/bench/databases/(default)/documents/runs/{doc_id}",
+            "fields": encode_fields(data),
+            "updateTime": "2026-01-01T00:00:00.000000Z",
+        }
+        for doc_id, data in collection.items()
+    ]
+
+
+# ============================================================
+# VIEWER FUNCTIONS
+# ============================================================
+
+def load_viewer_functions(path=VIEWER_PATH, **module_globals):
+    """
+    viewer.py's imports and top-level function definitions, executed
+    without the page itself. module_globals stand in for values the page
+    computes (lotid_filter, device_filter, ...).
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    body = [
+        node for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef))
+    ]
+    namespace = {"__name__": "viewer_bench", **module_globals}
+    exec(compile(ast.Module(body=body, type_ignores=[]), path, "exec"), namespace)
+    return namespace
+
+
+# ============================================================
+# RUNNER
+# ============================================================
+
+def best_of(fn, repeat, setup=None):
+    best = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def clear_card_caches():
+    card_html._layer_cards.clear()
+    card_html.chip_badge_html.cache_clear()
+    card_html.progress_bar_html.cache_clear()
+
+
+def bench_size(n, *, repeat, fake, seed=0):
+    collection = synthetic_collection(n, seed)
+    viewer = load_viewer_functions(lotid_filter="", device_filter="device-1")
+    timings = {}
+
+    if fake is not None:
+        from services.run_snapshot import RunSnapshot
+
+        fake.clear()
+        fake.load("runs", collection)
+
+        def cold():
+            RunSnapshot().sync("bench", run_class="Main")
+
+        warm_snapshot = RunSnapshot()
+        docs = warm_snapshot.sync("bench", run_class="Main")
+        timings["fetch_cold"] = best_of(cold, repeat)
+        timings["fetch_warm"] = best_of(lambda: warm_snapshot.sync("bench", run_class="Main"), repeat)
+    else:
+        docs = as_documents(collection)
+
+    all_fields = [doc["fields"] for doc in docs]
+    matches_filters = viewer["matches_filters"]
+    parse_layers = viewer["parse_layers"]
+    fridge_labels_of = viewer["build_measurement_fridge_display_labels"]
+    dashboard_events = viewer["collect_dashboard_events_from_metadata"]
+    layer_card_html = viewer["layer_card_html"]
+
+    parsed = [parse_layers(fields) for fields in all_fields]
+    labels = [fridge_labels_of(layers) for layers in parsed]
+
+    def cards():
+        for fields, layers, fridge_labels in zip(all_fields, parsed, labels):
+            for idx, layer in enumerate(layers):
+                layer_card_html(layer, idx, fridge_labels=fridge_labels, fields=fields, layers=layers)
+
+    timings["matches_filters"] = best_of(lambda: [matches_filters(f) for f in all_fields], repeat)
+    timings["deepcopy"] = best_of(lambda: [copy.deepcopy(f) for f in all_fields], repeat)
+    timings["parse_layers"] = best_of(lambda: [parse_layers(f) for f in all_fields], repeat)
+    timings["fridge_labels"] = best_of(lambda: [fridge_labels_of(layers) for layers in parsed], repeat)
+    timings["dashboard_events"] = best_of(
+        lambda: [dashboard_events(fields=f, layers=l) for f, l in zip(all_fields, parsed)], repeat
+    )
+    timings["layer_card_html"] = best_of(cards, repeat, setup=clear_card_caches)
+    timings["layer_card_html_warm"] = best_of(cards, repeat)
+
+    stages = {
+        stage: {"ms": round(t * 1000, 3), "us_per_run": round(t * 1e6 / n, 2)}
+        for stage, t in timings.items()
+    }
+    cold = [stage for stage in stages if stage in COLD_RERUN]
+    total_ms = sum(stages[stage]["ms"] for stage in cold)
+    dominant = max(cold, key=lambda stage: stages[stage]["ms"])
+    return {
+        "runs": n,
+        "layers": sum(len(l) for l in parsed),
+        "substeps": sum(len(layer["substeps"]) for l in parsed for layer in l),
+        "chips": sum(len(sub["chips"]) for l in parsed for layer in l for sub in layer["substeps"]),
+        "stages": stages,
+        "total_ms": round(total_ms, 3),
+        # unchanged runs: listing + filters, cards come from the DocMemo
+        "warm_ms": round(sum(stages[s]["ms"] for s in ("fetch_warm", "matches_filters") if s in stages), 3),
+        "budget_pct": round(100 * total_ms / REFRESH_BUDGET_MS, 2),
+        "dominant": dominant,
+    }
+
+
+def growth(results):
+    """Per-stage per-run cost at the largest size / at the smallest (1.0 = linear)."""
+    if len(results) < 2:
+        return {}
+    small, large = results[0], results[-1]
+    out = {}
+    for stage, s in large["stages"].items():
+        base = small["stages"].get(stage, {}).get("us_per_run")
+        if base:
+            out[stage] = round(s["us_per_run"] / base, 2)
+    return out
+
+
+def report(data):
+    results = data["results"]
+    stages = [s for s in STAGES if s in results[0]["stages"]]
+
+    print(f"best of {data['repeat']}, latency {data['latency'] * 1000:.0f} ms, python {data['python']}")
+    print(f"{'stage':<22}" + "".join(f"{r['runs']:>12}" for r in results) + "   (ms)")
+    for stage in stages:
+        print(f"{stage:<22}" + "".join(f"{r['stages'][stage]['ms']:>12.1f}" for r in results))
+    print(f"{'total (cold)':<22}" + "".join(f"{r['total_ms']:>12.1f}" for r in results))
+    print(f"{'% of 10 s tick':<22}" + "".join(f"{r['budget_pct']:>11.1f}%" for r in results))
+    print(f"{'warm tick':<22}" + "".join(f"{r['warm_ms']:>12.1f}" for r in results))
+
+    print()
+    for r in results:
+        share = 100 * r["stages"][r["dominant"]]["ms"] / (r["total_ms"] or 1)
+        print(f"{r['runs']:>6} runs: {r['dominant']} dominates ({share:.0f}% of the cold rerun)")
+    # ignore stages too small to matter (and to time reliably)
+    largest = results[-1]
+    significant = {
+        stage: g for stage, g in data["growth"].items()
+        if stage in COLD_RERUN and largest["stages"][stage]["ms"] >= 0.05 * largest["total_ms"]
+    }
+    if significant:
+        worst = max(significant, key=significant.get)
+        print(f"fastest-growing per-run cost: {worst} (x{significant[worst]} from "
+              f"{results[0]['runs']} to {results[-1]['runs']} runs)")
+
+
+def compare(data, old_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    old_by_runs = {r["runs"]: r for r in old.get("results", [])}
+
+    print(f"\nchange vs {old_path} ({old.get('created', '?')}):")
+    for r in data["results"]:
+        before = old_by_runs.get(r["runs"])
+        if before is None:
+            continue
+        parts = []
+        for stage, s in r["stages"].items():
+            prev = before["stages"].get(stage, {}).get("ms")
+            if prev:
+                parts.append(f"{stage} {100 * (s['ms'] - prev) / prev:+.0f}%")
+        print(f"{r['runs']:>6} runs: " + ", ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", default="50,500,2000,5000", help="comma-separated collection sizes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Firestore latency per request, seconds")
+    parser.add_argument("--no-fetch", action="store_true", help="skip the fetch stages (no HTTP)")
+    parser.add_argument("--out", default=None, help="result file (default benchmarks/results/viewer_pipeline_<time>.json)")
+    parser.add_argument("--compare", default=None, help="earlier result file to compare with")
+    args = parser.parse_args()
+
+    sizes = sorted(int(n) for n in args.runs.split(",") if n.strip())
+
+    fake = None
+    if not args.no_fetch:
+        from services.firestore_local import serve_in_thread
+
+        fake, server, host = serve_in_thread(latency=args.latency)
+        # must be set before firebase_client is imported (BASE_URL)
+        os.environ["FIRESTORE_HOST"] = host
+
+    results = []
+    for n in sizes:
+        print(f"{n} runs...", file=sys.stderr)
+        results.append(bench_size(n, repeat=args.repeat, fake=fake, seed=args.seed))
+
+    data = {
+        "benchmark": "viewer_pipeline",
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "latency": args.latency if fake is not None else 0.0,
+        "refresh_budget_ms": REFRESH_BUDGET_MS,
+        "results": results,
+        "growth": growth(results),
+    }
+
+    out = args.out or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "results",
+        f"viewer_pipeline_{datetime.datetime.now():%Y%m%d-%H%M%S}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+    report(data)
+    if args.compare:
+        compare(data, args.compare)
+    print(f"\nresults: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# core/change_tracker.py
+
+import copy
+
+from core.firestore_codec import DELETE_FIELD, decode_fields, field_path, split_field_path
+
+
+# ============================================================
+# FIELD-LEVEL CHANGE TRACKING (admin saves)
+# ============================================================
+#
+# The tracker keeps the document as it was loaded (python values) and,
+# at save time, diffs the editor's data against it:
+#
+#   maps         -> recursed, one path per changed leaf / sub-map
+#   lists, other -> sent whole when different (arrays are not
+#                   addressable by field path)
+#   removed keys -> DELETE_FIELD
+#
+# The new data is the whole document, as the full firestore_set used to
+# send it: editors that do not carry every stored key (e.g. fridge
+# "label" / "storage") merge the baseline in first.
+
+
+def diff_updates(old, new, prefix=()):
+    """
+    {field_path: value} for everything in `new` that differs from `old`,
+    DELETE_FIELD for keys of `old` missing from `new`.
+    `old` / `new` are python dicts (decoded document fields).
+    """
+    out = {}
+    old = old if isinstance(old, dict) else {}
+
+    for key, value in new.items():
+        path = prefix + (key,)
+
+        if key not in old:
+            out[field_path(*path)] = value
+            continue
+
+        before = old[key]
+        if isinstance(value, dict) and isinstance(before, dict) and value:
+            out.update(diff_updates(before, value, path))
+        elif value != before or type(value) is not type(before):
+            out[field_path(*path)] = value
+
+    for key in old:
+        if key not in new:
+            out[field_path(*(prefix + (key,)))] = DELETE_FIELD
+
+    return out
+
+
+class ChangeTracker:
+    """Baseline + updateTime of one loaded document."""
+
+    def __init__(self, collection, doc_id, baseline, update_time=None):
+        self.collection = collection
+        self.doc_id = doc_id
+        self.baseline = baseline
+        # updateTime of the stored document as last seen by this session;
+        # used as the save precondition
+        self.update_time = update_time
+
+    @classmethod
+    def from_document(cls, collection, doc):
+        """From a Firestore document ({"name", "updateTime", "fields"})."""
+        return cls(
+            collection,
+            doc.get("name", "").rsplit("/", 1)[-1],
+            decode_fields(doc.get("fields", {})),
+            doc.get("updateTime"),
+        )
+
+    def changes(self, data):
+        """Minimal {field_path: value} turning the baseline into `data`."""
+        return diff_updates(self.baseline, data)
+
+    def mark_saved(self, updates, update_time=None):
+        """Fold saved field-path updates into the baseline."""
+        for path, value in updates.items():
+            keys = split_field_path(path)
+            node = self.baseline
+            for k in keys[:-1]:
+                child = node.get(k)
+                if not isinstance(child, dict):
+                    child = node[k] = {}
+                node = child
+            if value is DELETE_FIELD:
+                node.pop(keys[-1], None)
+            else:
+                node[keys[-1]] = copy.deepcopy(value)
+
+        if update_time:
+            self.update_time = update_time
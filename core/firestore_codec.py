@@ -0,0 +1,271 @@
+# core/firestore_codec.py
+
+import base64
+import re
+
+
+# ============================================================
+# FIRESTORE WIRE VALUE -> PYTHON (single decoder)
+# ============================================================
+#
+# A Firestore value is a dict with exactly one type tag:
+#   {"stringValue": "x"}, {"mapValue": {"fields": {...}}}, ...
+#
+# decode_value looks the tag up in a dispatch table instead of testing
+# "xxxValue" in v for every type on every node.
+#
+#   stringValue / referenceValue / timestampValue -> str (as stored)
+#   integerValue   -> int          doubleValue  -> float
+#   booleanValue   -> bool         bytesValue   -> bytes
+#   geoPointValue  -> {"latitude": float, "longitude": float}
+#   arrayValue     -> list         mapValue     -> dict
+#   nullValue      -> `null` argument (None by default; the viewers use "")
+#
+# Non-dict input, {} and unknown tags are returned unchanged.
+#
+# Strings and nested maps are most of a run document, so arrays and maps
+# handle those two inline and dispatch (a function call) for the rest.
+
+
+def _decode_array(payload, null):
+    out = []
+    for item in (payload or {}).get("values", ()):
+        if "stringValue" in item:
+            out.append(item["stringValue"])
+        elif "mapValue" in item:
+            out.append(_decode_map(item["mapValue"], null))
+        else:
+            out.append(decode_value(item, null))
+    return out
+
+
+def _decode_map(payload, null):
+    out = {}
+    for k, v in (payload or {}).get("fields", {}).items():
+        if "stringValue" in v:
+            out[k] = v["stringValue"]
+        elif "mapValue" in v:
+            out[k] = _decode_map(v["mapValue"], null)
+        else:
+            out[k] = decode_value(v, null)
+    return out
+
+
+def _decode_geo_point(payload, null):
+    return {
+        "latitude": float(payload.get("latitude", 0.0)),
+        "longitude": float(payload.get("longitude", 0.0)),
+    }
+
+
+_DECODERS = {
+    "stringValue":    lambda p, null: p,
+    "integerValue":   lambda p, null: int(p),
+    "doubleValue":    lambda p, null: float(p),
+    "booleanValue":   lambda p, null: bool(p),
+    "timestampValue": lambda p, null: p,
+    "referenceValue": lambda p, null: p,
+    "bytesValue":     lambda p, null: base64.b64decode(p),
+    "nullValue":      lambda p, null: null,
+    "geoPointValue":  _decode_geo_point,
+    "arrayValue":     _decode_array,
+    "mapValue":       _decode_map,
+}
+
+
+def decode_value(v, null=None):
+    """Decode one Firestore wire value (see table above)."""
+    if type(v) is not dict:
+        return v
+
+    for tag in v:
+        decoder = _DECODERS.get(tag)
+        if decoder is None or len(v) != 1:
+            return v
+        return decoder(v[tag], null)
+
+    return v
+
+
+def decode_fields(fields, null=None):
+    """Decode a document's top-level "fields" dict."""
+    return {k: decode_value(v, null) for k, v in (fields or {}).items()}
+
+
+# ============================================================
+# PYTHON -> FIRESTORE WIRE VALUE
+# ============================================================
+#
+# bool is tested before int (bool is an int subclass), tuples encode as
+# arrays, bytes as bytesValue; anything else unknown is stored as str().
+
+
+def encode_value(value):
+    """Recursively encode a Python value into Firestore REST format."""
+    if value is None:
+        return {"nullValue": None}
+    if isinstance(value, str):
+        return {"stringValue": value}
+    if isinstance(value, bool):
+        return {"booleanValue": value}
+    if isinstance(value, int):
+        return {"integerValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [encode_value(v) for v in value]}}
+    if isinstance(value, dict):
+        return {"mapValue": {"fields": {k: encode_value(v) for k, v in value.items()}}}
+    if isinstance(value, bytes):
+        return {"bytesValue": base64.b64encode(value).decode("ascii")}
+    return {"stringValue": str(value)}
+
+
+def encode_fields(data):
+    """Encode a python dict as a document's top-level "fields"."""
+    return {k: encode_value(v) for k, v in (data or {}).items()}
+
+
+# ============================================================
+# TYPED FAST PATH: runs/{id}.steps -> layers / substeps / chips
+# ============================================================
+#
+# Readers of a run (viewer cards, flow_builder) only look at a known set
+# of fields in steps, so decode_steps walks that schema directly and
+# skips everything else (icons, editor-only keys, ...):
+#
+#   [{"layer_name", "progress", "substeps": [
+#       {"name"?, "label"?, "chip_uid"?, "fridge_uid"?, "id"?, "chips": [
+#           {"name"?, "status"?, "type"?, "started_at"?, "completed_at"?}]}]}]
+#
+# Anything that writes steps back must decode them in full
+# (decode_value), or the skipped fields would be lost.
+
+CHIP_FIELDS = ("name", "status", "type", "started_at", "completed_at")
+SUBSTEP_FIELDS = ("name", "label", "chip_uid", "fridge_uid", "id")
+
+
+def _decode_known(f, keys):
+    # general path for records with non-string fields
+    return {k: decode_value(f[k]) for k in keys if k in f}
+
+
+def decode_steps(steps):
+    """
+    Decode a run's "steps" wire value (or its document "fields", in
+    which case fields["steps"] is used). Returns [] when missing.
+    """
+    if "steps" in steps:
+        steps = steps["steps"]
+
+    # One loop nest, no call per chip / substep: strings are assumed and
+    # a KeyError (another type) falls back to the general decoder.
+    layers = []
+    for lv in steps.get("arrayValue", {}).get("values", ()):
+        lf = lv["mapValue"]["fields"]
+
+        substeps = []
+        for sv in lf["substeps"]["arrayValue"].get("values", ()) if "substeps" in lf else ():
+            sf = sv["mapValue"]["fields"]
+
+            chips = []
+            for cv in sf["chips"]["arrayValue"].get("values", ()) if "chips" in sf else ():
+                cf = cv["mapValue"]["fields"]
+                try:
+                    chip = {"name": cf["name"]["stringValue"], "status": cf["status"]["stringValue"]}
+                    if "type" in cf:
+                        chip["type"] = cf["type"]["stringValue"]
+                    if "started_at" in cf:
+                        chip["started_at"] = cf["started_at"]["stringValue"]
+                    if "completed_at" in cf:
+                        chip["completed_at"] = cf["completed_at"]["stringValue"]
+                except KeyError:
+                    chip = _decode_known(cf, CHIP_FIELDS)
+                chips.append(chip)
+
+            try:
+                sub = {}
+                if "name" in sf:
+                    sub["name"] = sf["name"]["stringValue"]
+                if "label" in sf:
+                    sub["label"] = sf["label"]["stringValue"]
+                if "chip_uid" in sf:
+                    sub["chip_uid"] = sf["chip_uid"]["stringValue"]
+                if "fridge_uid" in sf:
+                    sub["fridge_uid"] = sf["fridge_uid"]["stringValue"]
+                if "id" in sf:
+                    sub["id"] = sf["id"]["stringValue"]
+            except KeyError:
+                sub = _decode_known(sf, SUBSTEP_FIELDS)
+            sub["chips"] = chips
+            substeps.append(sub)
+
+        progress = lf.get("progress", {})
+        if "integerValue" in progress:
+            progress = int(progress["integerValue"])
+        elif "doubleValue" in progress:
+            progress = float(progress["doubleValue"])
+        else:
+            progress = 0
+
+        layers.append({
+            "layer_name": lf["layer_name"]["stringValue"] if "layer_name" in lf else "",
+            "progress": progress,
+            "substeps": substeps,
+        })
+
+    return layers
+
+
+# ============================================================
+# FIELD PATHS (updateMask / commit)
+# ============================================================
+#
+# Segments that are not plain identifiers are backquoted:
+#   field_path("metadata", "measure", "fridges", "fridge-1")
+#     -> "metadata.measure.fridges.`fridge-1`"
+
+_SIMPLE_SEGMENT = re.compile(r"^[A-Za-z_][A-Za-z_0-9]*$")
+
+# Value marker for a field-path update that removes the field
+DELETE_FIELD = object()
+
+
+def _quote_segment(key):
+    key = str(key)
+    if _SIMPLE_SEGMENT.match(key):
+        return key
+    return "`" + key.replace("\\", "\\\\").replace("`", "\\`") + "`"
+
+
+def field_path(*keys):
+    """Join keys into one Firestore field path."""
+    return ".".join(_quote_segment(k) for k in keys)
+
+
+def split_field_path(path):
+    """Inverse of field_path: "a.`b.c`.d" -> ["a", "b.c", "d"]."""
+    if "`" not in path:
+        return path.split(".")
+
+    keys, buf, quoted, i = [], [], False, 0
+    while i < len(path):
+        ch = path[i]
+        if quoted:
+            if ch == "\\" and i + 1 < len(path):
+                i += 1
+                buf.append(path[i])
+            elif ch == "`":
+                quoted = False
+            else:
+                buf.append(ch)
+        elif ch == "`":
+            quoted = True
+        elif ch == ".":
+            keys.append("".join(buf))
+            buf = []
+        else:
+            buf.append(ch)
+        i += 1
+    keys.append("".join(buf))
+    return keys
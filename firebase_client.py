@@ -1,9 +1,16 @@
 
 
 # firebase_client.py
+import os
 import requests
 import json
+import threading
+import time
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from core.firestore_codec import DELETE_FIELD, decode_value, encode_value, encode_fields, split_field_path
 
 # ============================================
 # 1. FIREBASE WEB CONFIG
@@ -19,7 +26,117 @@ firebaseConfig = {
 }
 
 # ============================================
-# 2. AUTHENTICATION (REST API replaces Pyrebase)
+# 2. SHARED HTTP TRANSPORT (pooled keep-alive session)
+# ============================================
+# (connect, read) seconds applied to every call unless overridden
+REQUEST_TIMEOUT = (5, 30)
+
+# Bounded retries with exponential backoff on throttling / server errors.
+# Retry-After from Firestore (429/503) is honored by urllib3.
+# POST is not replayed by the session (a :commit may have been applied
+# before the reply was lost); urllib3 still retries connect errors, where
+# nothing was sent. The read-only POSTs (runQuery, batchGet) retry at
+# the call site, see _read_post.
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+POOL_SIZE = 16
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    retry = Retry(
+        total=RETRY_TOTAL,
+        connect=RETRY_TOTAL,
+        read=RETRY_TOTAL,
+        status=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset({"GET", "PATCH", "DELETE"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_SIZE,
+        pool_maxsize=POOL_SIZE,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """
+    Process-wide pooled session shared by every Firebase / Firestore call.
+    Keeps TLS connections to googleapis.com alive across calls and reruns.
+    """
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def http_request(method, url, *, timeout=REQUEST_TIMEOUT, **kwargs):
+    """Send one request through the shared session (default timeout applied)."""
+    return get_http_session().request(method, url, timeout=timeout, **kwargs)
+
+
+def _auth_headers(id_token):
+    if isinstance(id_token, TokenManager):
+        id_token = id_token.token()
+    if not id_token:
+        return {}
+    return {"Authorization": f"Bearer {id_token}"}
+
+
+def firestore_request(method, url, id_token, **kwargs):
+    """
+    http_request with the caller's credentials. id_token is a raw ID
+    token or a TokenManager; with a manager, a 401 (token expired or
+    revoked early) refreshes it and retries once.
+    """
+    headers = _auth_headers(id_token)
+    res = http_request(method, url, headers=headers, **kwargs)
+
+    if res.status_code == 401 and isinstance(id_token, TokenManager):
+        id_token.refresh(stale=headers["Authorization"][len("Bearer "):])
+        res = http_request(method, url, headers=_auth_headers(id_token), **kwargs)
+    return res
+
+
+def _read_post(url, id_token, **kwargs):
+    """
+    firestore_request("POST", ...) for read-only endpoints, retried like
+    the session retries GETs (timeouts, RETRY_STATUS, Retry-After).
+    """
+    for attempt in range(RETRY_TOTAL + 1):
+        last = attempt == RETRY_TOTAL
+        delay = RETRY_BACKOFF * (2 ** attempt)
+        try:
+            res = firestore_request("POST", url, id_token, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if last:
+                raise
+        else:
+            if last or res.status_code not in RETRY_STATUS:
+                return res
+            retry_after = res.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+        time.sleep(delay)
+
+
+# ============================================
+# 2b. AUTHENTICATION (REST API replaces Pyrebase)
 # ============================================
 API_KEY = firebaseConfig["apiKey"]
 
@@ -33,68 +150,124 @@ def firebase_sign_in_with_google(google_id_token, request_uri):
         "returnSecureToken": True,
     }
 
-    res = requests.post(url, json=payload)
+    res = http_request("POST", url, json=payload)
     res.raise_for_status()
     return res.json()
 
 
+# ============================================
+# 2c. ID TOKEN MANAGER
+# ============================================
+# Firebase ID tokens live expiresIn seconds (3600). A TokenManager holds
+# a signed-in user's tokens and is passed wherever an id_token is
+# expected (every Firestore helper accepts either):
+#   - a timer refreshes the token TOKEN_REFRESH_MARGIN seconds before it
+#     expires, on its own thread, so no rerun waits on securetoken
+#   - the timer is only re-armed while the token is in use (an abandoned
+#     session stops refreshing after one period)
+#   - an expired token (timer missed, e.g. the machine slept) is
+#     refreshed inline by token(); a 401 refreshes and retries once
+#   - refreshes are written back into the user dict it was built from
+#     (the one in st.session_state)
+
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_MIN_VALID = 30
+
+
+class TokenManager:
+
+    def __init__(self, user: dict):
+        self.user = user
+        self._lock = threading.Lock()
+        self._expires_at = time.time() + int(user.get("expiresIn") or 3600)
+        self._used = True
+        self._timer = None
+        self._closed = False
+        self._schedule()
+
+    def token(self) -> str:
+        """A currently valid ID token."""
+        self._used = True
+        if time.time() > self._expires_at - TOKEN_MIN_VALID:
+            self.refresh(stale=self.user["idToken"])
+        elif self._timer is None and not self._closed:
+            # background refresh stopped while idle: resume it
+            self._schedule()
+        return self.user["idToken"]
+
+    def refresh(self, stale: str | None = None) -> None:
+        """
+        Exchange the refresh token for a new ID token. With stale, skip it
+        if another thread already replaced that token.
+        """
+        with self._lock:
+            if stale is not None and self.user["idToken"] != stale:
+                return
+            new_tokens = firebase_refresh_id_token(self.user["refreshToken"])
+            self.user["idToken"] = new_tokens["id_token"]
+            self.user["refreshToken"] = new_tokens["refresh_token"]
+            self.user["expiresIn"] = new_tokens["expires_in"]
+            self._expires_at = time.time() + new_tokens["expires_in"]
+        if not self._closed:
+            self._schedule()
+
+    def _schedule(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(self._expires_at - TOKEN_REFRESH_MARGIN - time.time(), 0)
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self) -> None:
+        if not self._used:
+            self._timer = None
+            return
+        self._used = False
+        try:
+            self.refresh(stale=self.user["idToken"])
+        except Exception as e:
+            # token() / a 401 retry inline later
+            print("⚠️ background token refresh failed:", e)
+
+    def close(self) -> None:
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+def session_token_manager(session_state, user_key: str) -> TokenManager:
+    """The TokenManager for the user stored under session_state[user_key]."""
+    manager_key = f"{user_key}_token_manager"
+    manager = session_state.get(manager_key)
+    user = session_state[user_key]
+    if manager is None or manager.user is not user:
+        if manager is not None:
+            manager.close()
+        manager = session_state[manager_key] = TokenManager(user)
+    return manager
+
+
 
 
 # ============================================
 # 3. FIRESTORE REST API BASE URL
 # ============================================
+# FIRESTORE_HOST points every Firestore call at another server with the
+# same REST surface, e.g. the local fake (python -m services.firestore_local)
+# or the Firestore emulator: FIRESTORE_HOST=http://127.0.0.1:8086
 PROJECT_ID = firebaseConfig["projectId"]
-BASE_URL = f"https://firestore.googleapis.com/v1/projects/{PROJECT_ID}/databases/(default)/documents"
+FIRESTORE_HOST = os.environ.get("FIRESTORE_HOST", "https://firestore.googleapis.com").rstrip("/")
+BASE_URL = f"{FIRESTORE_HOST}/v1/projects/{PROJECT_ID}/databases/(default)/documents"
 
 # ============================================
 # 4. HELPERS TO CONVERT PYTHON → FIRESTORE
 # ============================================
-def to_firestore_value(value):
-    """Recursively encode Python values into Firestore REST format"""
-    
-    # None → null
-    if value is None:
-        return {"nullValue": None}
-
-    # String
-    if isinstance(value, str):
-        return {"stringValue": value}
-
-    # Integer
-    if isinstance(value, int):
-        return {"integerValue": str(value)}
-
-    # Float
-    if isinstance(value, float):
-        return {"doubleValue": value}
-
-    # Boolean
-    if isinstance(value, bool):
-        return {"booleanValue": value}
-
-    # List
-    if isinstance(value, list):
-        return {
-            "arrayValue": {
-                "values": [to_firestore_value(v) for v in value]
-            }
-        }
-
-    # Dict
-    if isinstance(value, dict):
-        return {
-            "mapValue": {
-                "fields": {k: to_firestore_value(v) for k, v in value.items()}
-            }
-        }
-
-    # Fallback
-    return {"stringValue": str(value)}
-
-
-def to_firestore_fields(data: dict):
-    """Top-level wrapper used in Firestore PATCH and SET"""
-    return {k: to_firestore_value(v) for k, v in data.items()}
+# Encoder lives next to the decoder in core/firestore_codec.py
+# (bool before int, tuples as arrays)
+to_firestore_value = encode_value
+to_firestore_fields = encode_fields
 
 
 
@@ -103,46 +276,65 @@ def to_firestore_fields(data: dict):
 # 5. FIRESTORE REST API FUNCTIONS (CORRECT AUTH)
 # ============================================
 
+# Called as fn(collection, document, update_time, base_time) after every
+# write helper below; update_time is the document's new updateTime when
+# the response carried one, else None; base_time is the updateTime the
+# write was guarded by (WriteBatch precondition), None for unguarded
+# writes. (e.g. the viewer's shared run cache invalidates itself on runs
+# writes)
+_write_listeners = []
+
+
+def add_write_listener(fn):
+    if fn not in _write_listeners:
+        _write_listeners.append(fn)
 
-def firestore_list(collection, id_token):
-    url = f"{BASE_URL}/{collection}"
-    headers = {"Authorization": f"Bearer {id_token}"}
-    return requests.get(url, headers=headers).json()
+
+def _notify_write(collection, document, result=None, base_time=None):
+    update_time = result.get("updateTime") if isinstance(result, dict) else None
+    for fn in list(_write_listeners):
+        try:
+            fn(collection, document, update_time, base_time)
+        except Exception as e:
+            print("⚠️ write listener failed:", e)
 
 
 def firestore_set(collection, document, data, id_token):
     url = f"{BASE_URL}/{collection}/{document}"
-    headers = {"Authorization": f"Bearer {id_token}"}
 
     # body = {"fields": to_firestore_fields(data)}
     # body = {"fields": {k: to_firestore_value(v) for k, v in data.items()}}
     body = {"fields": to_firestore_fields(data)}
 
 
-    res = requests.patch(url, headers=headers, json=body)
-    return res.json()
+    res = firestore_request("PATCH", url, id_token, json=body)
+    j = res.json()
+    _notify_write(collection, document, j)
+    return j
 
 
 def firestore_get(collection, document, id_token):
     url = f"{BASE_URL}/{collection}/{document}"
-    headers = {"Authorization": f"Bearer {id_token}"}
 
-    res = requests.get(url, headers=headers)
+    res = firestore_request("GET", url, id_token)
     return res.json()
 
 
 def firestore_update(collection, document, data, id_token):
     url = f"{BASE_URL}/{collection}/{document}?updateMask.fieldPaths=*"
-    headers = {"Authorization": f"Bearer {id_token}"}
 
     body = {"fields": to_firestore_fields(data)}
-    res = requests.patch(url, headers=headers, json=body)
-    return res.json()
+    res = firestore_request("PATCH", url, id_token, json=body)
+    j = res.json()
+    _notify_write(collection, document, j)
+    return j
 
 def firestore_update_raw(collection, document, body, id_token):
-    url = f"{BASE_URL}/{collection}/{document}?access_token={id_token}&updateMask.fieldPaths=steps"
-    res = requests.patch(url, json=body)
-    return res.json()
+    url = f"{BASE_URL}/{collection}/{document}?updateMask.fieldPaths=steps"
+    res = firestore_request("PATCH", url, id_token, json=body)
+    j = res.json()
+    _notify_write(collection, document, j)
+    return j
 
 
 # def firestore_update_field(collection, document, field_path, value, id_token):
@@ -209,11 +401,6 @@ def firestore_update_field(collection, document, field_path, value, id_token):
         f"?updateMask.fieldPaths={field_path}"
     )
 
-    headers = {
-        "Authorization": f"Bearer {id_token}",
-        "Content-Type": "application/json",
-    }
-
     # Build ONLY the subtree required by updateMask
     keys = field_path.split(".")
 
@@ -232,84 +419,338 @@ def firestore_update_field(collection, document, field_path, value, id_token):
         "fields": node["mapValue"]["fields"]
     }
 
-    res = requests.patch(url, headers=headers, json=body)
-    return res.json()
+    res = firestore_request("PATCH", url, id_token, json=body)
+    j = res.json()
+    _notify_write(collection, document, j)
+    return j
 
 
 
-def firestore_list(collection, id_token):
-    url = f"https://firestore.googleapis.com/v1/projects/{PROJECT_ID}/databases/(default)/documents/{collection}"
-    headers = {"Authorization": f"Bearer {id_token}"}
-    return requests.get(url, headers=headers).json()
+# Firestore caps pageSize at 300; the REST default is much smaller.
+LIST_PAGE_SIZE = 300
+
+
+def firestore_iter(collection, id_token, *, page_size=LIST_PAGE_SIZE, field_paths=None, order_by=None, max_pages=None):
+    """
+    Lazily yield every document of a collection, following nextPageToken.
+
+    page_size   : documents per request (Firestore max 300)
+    field_paths : optional projection (mask.fieldPaths), e.g.
+                  ["run_no", "class", "device_name", "metadata.fab"]
+    order_by    : optional Firestore orderBy string, e.g. "run_no desc"
+    max_pages   : stop after this many pages (None = all)
+
+    Raises requests.HTTPError on a non-2xx page.
+    """
+    url = f"{BASE_URL}/{collection}"
+
+    base_params = []
+    if page_size:
+        base_params.append(("pageSize", int(page_size)))
+    if order_by:
+        base_params.append(("orderBy", order_by))
+    for fp in field_paths or ():
+        base_params.append(("mask.fieldPaths", fp))
+
+    page_token = None
+    pages = 0
+
+    while True:
+        params = list(base_params)
+        if page_token:
+            params.append(("pageToken", page_token))
+
+        res = firestore_request("GET", url, id_token, params=params)
+        res.raise_for_status()
+        j = res.json()
+
+        for doc in j.get("documents", []):
+            yield doc
+
+        pages += 1
+        page_token = j.get("nextPageToken")
+
+        if not page_token:
+            return
+        if max_pages is not None and pages >= max_pages:
+            return
+
+
+def firestore_list(collection, id_token, *, page_size=LIST_PAGE_SIZE, field_paths=None):
+    """
+    Return {"documents": [...]} for the whole collection (all pages).
+    On an HTTP error the Firestore error body is returned, as before.
+    """
+    try:
+        docs = list(
+            firestore_iter(
+                collection,
+                id_token,
+                page_size=page_size,
+                field_paths=field_paths,
+            )
+        )
+    except requests.HTTPError as e:
+        try:
+            return e.response.json()
+        except ValueError:
+            return {"error": {"code": e.response.status_code, "message": e.response.text}}
+
+    return {"documents": docs}
+
+def firestore_run_query(structured_query, id_token, *, parent=""):
+    """
+    POST a structuredQuery to :runQuery and return the matched documents.
+
+    parent: optional sub-path under documents/ (empty = root collections)
+    Raises requests.HTTPError on failure.
+    """
+    url = f"{BASE_URL}/{parent}:runQuery" if parent else f"{BASE_URL}:runQuery"
+
+    res = _read_post(url, id_token, json={"structuredQuery": structured_query})
+    res.raise_for_status()
+
+    # Response is a list of {"document": ..., "readTime": ...};
+    # entries without "document" only carry progress / readTime.
+    return [row["document"] for row in res.json() if "document" in row]
+
+
+# batchGet accepts many names per call; keep bodies reasonably small
+BATCH_GET_CHUNK = 100
+
+
+def firestore_batch_get(document_names, id_token, *, field_paths=None):
+    """
+    Fetch many documents by full resource name in as few calls as possible.
+
+    document_names: ["projects/.../documents/runs/main_001", ...]
+    Returns {name: document} for every document that exists.
+    Raises requests.HTTPError on failure.
+    """
+    url = f"{BASE_URL}:batchGet"
+    names = list(document_names)
+    found = {}
+
+    for i in range(0, len(names), BATCH_GET_CHUNK):
+        body = {"documents": names[i:i + BATCH_GET_CHUNK]}
+        if field_paths:
+            body["mask"] = {"fieldPaths": list(field_paths)}
+
+        res = _read_post(url, id_token, json=body)
+        res.raise_for_status()
+
+        for row in res.json():
+            doc = row.get("found")
+            if doc:
+                found[doc["name"]] = doc
+
+    return found
+
+
+def firestore_update_fields(collection, document, updates: dict, id_token):
+    """
+    Update several top-level or dotted field paths in ONE PATCH.
+
+    updates example:
+      {"lot_id": "A12", "fabin": "2026-01-05", "metadata.fab": [...]}
+    """
+    if not updates:
+        return {}
 
-def firestore_delete(collection, document, id_token):
     url = f"{BASE_URL}/{collection}/{document}"
-    headers = {"Authorization": f"Bearer {id_token}"}
-    res = requests.delete(url, headers=headers)
-    return res.status_code, res.text
+    params = [("updateMask.fieldPaths", fp) for fp in updates]
+
+    # Merge every path into one nested field tree
+    fields = {}
+    for field_path, value in updates.items():
+        keys = field_path.split(".")
+        node = fields
+        for k in keys[:-1]:
+            node = node.setdefault(k, {"mapValue": {"fields": {}}})["mapValue"]["fields"]
+        node[keys[-1]] = to_firestore_value(value)
+
+    res = firestore_request("PATCH", url, id_token, params=params, json={"fields": fields})
+    j = res.json()
+    _notify_write(collection, document, j)
+    return j
+
+
+# ============================================
+# 5b. WRITE BATCH (one documents:commit per save)
+# ============================================
+# Full resource name prefix used inside commit bodies
+DOCUMENTS_ROOT = f"projects/{PROJECT_ID}/databases/(default)/documents"
 
 
+class FirestoreConflict(requests.HTTPError):
+    """A commit precondition failed: the document changed since it was read."""
 
-def firestore_to_python(v):
-    if not isinstance(v, dict):
-        return v
-
-    # primitive values
-    if "stringValue" in v:
-        return v["stringValue"]
-    if "integerValue" in v:
-        return int(v["integerValue"])
-    if "doubleValue" in v:
-        return float(v["doubleValue"])
-    if "booleanValue" in v:
-        return bool(v["booleanValue"])
-    if "timestampValue" in v:          # ← THIS LINE FIXES IT
-        return v["timestampValue"]
-
-    # ARRAY — PRESERVE ORDER
-    if "arrayValue" in v:
-        arr = v["arrayValue"].get("values", [])
-        out = []
-
-        for item in arr:
-            if "mapValue" in item:
-                fields = item["mapValue"].get("fields", {})
-
-                # metadata-style array element
-                if "key" in fields and "value" in fields:
-                    out.append({
-                        "key": firestore_to_python(fields["key"]),
-                        "value": firestore_to_python(fields["value"]),
-                    })
-                else:
-                    # generic map inside array (substeps, chips, presets)
-                    out.append({
-                        kk: firestore_to_python(vv)
-                        for kk, vv in fields.items()
-                    })
-            else:
-                out.append(firestore_to_python(item))
-
-        return out
-
-    # MAP
-    if "mapValue" in v:
-        fields = v["mapValue"].get("fields", {})
-
-        # metadata-style map (key/value pair)
-        if "key" in fields and "value" in fields:
-            return {
-                "key": firestore_to_python(fields["key"]),
-                "value": firestore_to_python(fields["value"]),
+
+def _merge_field_path(fields, field_path, wire_value):
+    """
+    Place one encoded value at a field path inside a "fields" tree
+    (DELETE_FIELD removes it instead).
+    """
+    keys = split_field_path(field_path)
+    node = fields
+    for k in keys[:-1]:
+        child = node.get(k)
+        if not isinstance(child, dict) or "mapValue" not in child:
+            if wire_value is DELETE_FIELD:
+                return
+            child = node[k] = {"mapValue": {"fields": {}}}
+        node = child["mapValue"].setdefault("fields", {})
+    if wire_value is DELETE_FIELD:
+        node.pop(keys[-1], None)
+    else:
+        node[keys[-1]] = wire_value
+
+
+class WriteBatch:
+    """
+    Collect sets and field-path updates, then apply them in ONE atomic
+    documents:commit request.
+
+    - one write per document: updates to the same document merge into
+      one updateMask; updates after a set() are folded into the set
+    - update_time (a document's "updateTime" as read) becomes a
+      precondition; commit() raises FirestoreConflict when it no longer
+      matches (someone else saved the document in between)
+    - set(..., exists=False) only creates: FirestoreConflict if the
+      document is already there
+    - DELETE_FIELD as an update value removes that field
+
+    Usage:
+        batch = WriteBatch(id_token)
+        batch.set("runs", doc_id, data, update_time=run["updateTime"])
+        batch.update_field("runs", doc_id, "metadata.package.chips", chips)
+        batch.commit()
+    """
+
+    def __init__(self, id_token):
+        self.id_token = id_token
+        self._writes = {}         # (collection, document) -> pending write
+        self.update_times = {}    # (collection, document) -> updateTime after commit
+
+    def __len__(self):
+        return len(self._writes)
+
+    def _pending(self, collection, document, update_time):
+        w = self._writes.setdefault(
+            (collection, document),
+            {"fields": {}, "paths": [], "replace": False, "update_time": None, "exists": None},
+        )
+        if update_time:
+            w["update_time"] = update_time
+        return w
+
+    def set(self, collection, document, data, *, update_time=None, exists=None):
+        """Replace the whole document (same as firestore_set)."""
+        w = self._pending(collection, document, update_time)
+        w["exists"] = exists
+        w["fields"] = to_firestore_fields(data)
+        w["paths"] = []
+        w["replace"] = True
+        return self
+
+    def update_fields(self, collection, document, updates: dict, *, update_time=None):
+        """Queue dotted field-path updates (same as firestore_update_fields)."""
+        w = self._pending(collection, document, update_time)
+
+        for field_path, value in updates.items():
+            wire_value = value if value is DELETE_FIELD else to_firestore_value(value)
+            _merge_field_path(w["fields"], field_path, wire_value)
+
+            if w["replace"]:
+                continue
+            # updateMask paths must not overlap: a parent path already
+            # covers the new value; a new parent replaces its children
+            paths = w["paths"]
+            if any(field_path == p or field_path.startswith(p + ".") for p in paths):
+                continue
+            paths[:] = [p for p in paths if not p.startswith(field_path + ".")]
+            paths.append(field_path)
+
+        return self
+
+    def update_field(self, collection, document, field_path, value, *, update_time=None):
+        """Queue one dotted field-path update (same as firestore_update_field)."""
+        return self.update_fields(collection, document, {field_path: value}, update_time=update_time)
+
+    def require(self, collection, document, update_time):
+        """Set (None: drop) the updateTime precondition of a queued write."""
+        w = self._writes.get((collection, document))
+        if w is not None:
+            w["update_time"] = update_time
+        return self
+
+    def commit(self):
+        """
+        Send every queued write in one documents:commit (all or nothing).
+        Returns the commit response ({} when nothing was queued).
+        Raises FirestoreConflict on a failed precondition and
+        requests.HTTPError on any other failure.
+        """
+        if not self._writes:
+            return {}
+
+        keys = list(self._writes)
+        writes = []
+        for collection, document in keys:
+            w = self._writes[(collection, document)]
+            write = {
+                "update": {
+                    "name": f"{DOCUMENTS_ROOT}/{collection}/{document}",
+                    "fields": w["fields"],
+                },
             }
+            if not w["replace"]:
+                write["updateMask"] = {"fieldPaths": w["paths"]}
+            if w["update_time"]:
+                write["currentDocument"] = {"updateTime": w["update_time"]}
+            elif w["exists"] is not None:
+                write["currentDocument"] = {"exists": bool(w["exists"])}
+            writes.append(write)
+
+        url = f"{BASE_URL}:commit"
+        res = firestore_request("POST", url, self.id_token, json={"writes": writes})
+
+        if not res.ok:
+            try:
+                status = res.json().get("error", {}).get("status", "")
+            except ValueError:
+                status = ""
+            # exists=False on an existing document answers ALREADY_EXISTS
+            if status in ("FAILED_PRECONDITION", "ALREADY_EXISTS"):
+                raise FirestoreConflict(
+                    f"Document changed since it was read: {', '.join('/'.join(k) for k in keys)}",
+                    response=res,
+                )
+            res.raise_for_status()
+
+        j = res.json()
+        base_times = {key: self._writes[key]["update_time"] for key in keys}
+        self._writes.clear()
+
+        for key, result in zip(keys, j.get("writeResults", [])):
+            if result.get("updateTime"):
+                self.update_times[key] = result["updateTime"]
+        for key in keys:
+            _notify_write(*key, {"updateTime": self.update_times.get(key)}, base_times[key])
+
+        return j
+
+
+def firestore_delete(collection, document, id_token):
+    url = f"{BASE_URL}/{collection}/{document}"
+    res = firestore_request("DELETE", url, id_token)
+    _notify_write(collection, document, None)
+    return res.status_code, res.text
+
 
-        # generic Firestore map
-        return {
-            kk: firestore_to_python(vv)
-            for kk, vv in fields.items()
-        }
 
-    return v
+# One decoder for the whole app (type-tag dispatch, see core/firestore_codec.py)
+firestore_to_python = decode_value
 
 
 def firebase_refresh_id_token(refresh_token: str):
@@ -323,7 +764,7 @@ def firebase_refresh_id_token(refresh_token: str):
         "refresh_token": refresh_token,
     }
 
-    r = requests.post(url, data=payload, timeout=10)
+    r = http_request("POST", url, data=payload, timeout=10)
     r.raise_for_status()
 
     data = r.json()
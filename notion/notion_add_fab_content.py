@@ -1,38 +1,208 @@
+import asyncio
 import json
 import os
 import sys
-from .pkg.eeroq_notion import Page, Database, Block, table, toggle_blocks
-from notion_client import Client as NotionClient
+from functools import lru_cache
+from .pkg.eeroq_notion import Block, table, toggle_blocks, get_parent_id, get_properties_code, parse_database_info, cached_database, remember_database, remember_page
+from .notion_engine import run_notion
+from .notion_journal import StepJournal
+from .notion_metrics import track
 
 # import any helper you already use in the notebook logic
 
 
-def add_fab_content(
+# ----------------------------------------------------------------------
+# Fab content template (runs on the async Notion engine)
+# ----------------------------------------------------------------------
+# The main-page layout (callout + 9 synced blocks, including the Profile
+# table, Microscope / SEM chip toggles and Wire bond tables) is one block
+# tree, compiled once per chip count into an append plan (see
+# compile_appends). Independent calls run concurrently (rate-limited,
+# see notion_engine):
+#
+#   setup : retrieve the 9 fabdata DBs (cached) -> 9 parallel
+#           create one page in each               -> 9 parallel
+#   main  : the compiled plan: 1 append for the page, then only the
+#           synced blocks too deep for it (Profile, Microscope, SEM,
+#           Wire bond) and their deeper levels, in parallel
+#   fill  : 9 synced-block replicas               -> 9 parallel
+#
+# No blocks.children.list: every id a later step needs comes from an
+# append response.
+#
+# Every page create and append is journaled (notion_journal) once Notion
+# acknowledged it: after a failure, calling again with the same page
+# skips the finished steps and replays their ids, and the modes can run
+# in separate calls (fill reads the page / synced block ids from setup
+# and main).
+
+FABDATA_DB_LABELS = ["History", "Schematic", "Process", "Profile", "Design", "Microscope", "SEM", "Wirebond", "Report"]
+
+
+def _build_sync_blocks(n_databases, num_chips):
+    sync_block_list = [Block(sync=True) for i in range(n_databases)]
+
+    sync_block_list[0].heading("History", header_type=2).divider().toggle_blocks("data").space()
+    sync_block_list[1].heading("Schematic", header_type=2).divider().toggle_blocks("chip").toggle_blocks("wafer").space()
+    sync_block_list[2].heading("Process", header_type=2).divider().toggle_blocks("flow").space()
+    sync_block_list[3].heading("Profile", header_type=2).divider().toggle_blocks("cross-section").toggle_blocks("data").space()
+    sync_block_list[4].heading("Design", header_type=2).divider().toggle_blocks("chip file").toggle_blocks("wafer file").space()
+    sync_block_list[5].heading("Microscope", header_type=2).divider().toggle_blocks("wafer").toggle_blocks("chip").space()
+    sync_block_list[6].heading("SEM", header_type=2).divider().toggle_blocks("wafer").toggle_blocks("chip").space()
+
+    sync_block_list[7].heading("Wire bond", header_type=2).divider()
+    for i in range(num_chips):
+        sync_block_list[7].toggle_blocks(main="C0"+str(i+1), subs = ["PCB GPO connection","Resistance","Image"], sub_toggle=True)
+    sync_block_list[7].space()
+
+    sync_block_list[8].heading("Report", header_type=2).divider().toggle_blocks("file").space()
+
+    return sync_block_list
+
+
+async def _retrieve_database(engine, database_id):
+    # the fabdata DB schemas are shared with the sync wrappers' cache
+    raw = cached_database(database_id)
+    if raw is None:
+        raw = await engine.call("databases.retrieve", database_id=database_id)
+        remember_database(raw)
+    return raw
+
+
+PROFILE_TABLE = table(header = ["Label", "t1", "t2", "t3", "d1", "d2", "h"], content = [["Thickness", "", "", "", "", "", ""]],
+                      has_row_header = True)['code']
+
+WIREBOND_TABLE = table(header = ["Connection", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15", "16"],
+                       content = [["R (kOhm)", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", ""]], has_row_header = True)['code']
+
+
+def _fab_synced_blocks(n_databases, num_chips):
+    """The 9 synced blocks with the tables / toggles the fabdata pages get."""
+    sync_block_list = _build_sync_blocks(n_databases, num_chips)
+
+    # Profile: table in the "data" toggle
+    sync_block_list[3].code_list[3]["toggle"]["children"] = [PROFILE_TABLE]
+
+    # Microscope / SEM: one toggle per chip in the "chip" toggle
+    for chip_page in (sync_block_list[5], sync_block_list[6]):
+        chip_page.code_list[3]["toggle"]["children"] = [toggle_blocks('C0'+str(i+1))['code'] for i in range(num_chips)]
+
+    # Wire bond: table in each chip's "Resistance" sub-toggle
+    for i in range(num_chips):
+        chip_toggle = sync_block_list[7].code_list[2 + i]["toggle"]
+        chip_toggle["children"][1]["toggle"]["children"] = [WIREBOND_TABLE]
+
+    return [
+        {"type": "synced_block", "synced_block": {"synced_from": None, "children": s_block.code_list}}
+        for s_block in sync_block_list
+    ]
+
+
+# ----------------------------------------------------------------------
+# Template compiler
+# ----------------------------------------------------------------------
+# One append carries blocks plus one level of their children, and its
+# response lists the first-level blocks only. A block's children are
+# therefore sent inline when none of them has children of its own;
+# otherwise the block is sent bare and its children become a follow-up
+# append under the id the response returns.
+#
+#   plan = {"children": [block code, ...], "then": [[index, plan], ...]}
+
+MAX_APPEND_CHILDREN = 100
+
+
+def _block_type(code):
+    return code.get("type") or next(k for k in code if k != "object")
+
+
+def compile_appends(children):
+    sent, then = [], []
+
+    for i, code in enumerate(children):
+        code = json.loads(json.dumps(code))
+        value = code[_block_type(code)]
+        kids = value.get("children") or []
+
+        if kids:
+            if len(kids) <= MAX_APPEND_CHILDREN and not any(k[_block_type(k)].get("children") for k in kids):
+                value["children"] = kids
+            else:
+                value.pop("children")
+                then.append([i, compile_appends(kids)])
+
+        sent.append(code)
+
+    return {"children": sent, "then": then}
+
+
+@lru_cache(maxsize=8)
+def _compiled_fab_template(n_databases, num_chips):
+    # JSON text: every run gets its own copy of the cached plan
+    return json.dumps(compile_appends(_fab_synced_blocks(n_databases, num_chips)))
+
+
+async def _append_level(engine, block_id, plan, journal=None):
+    results = []
+    children = plan["children"]
+    for start in range(0, len(children), MAX_APPEND_CHILDREN):
+        # journaled appends are replayed from their recorded block ids
+        key = f"append:{block_id}:{start}"
+        if journal is not None and key in journal:
+            results += [{"id": block} for block in journal.get(key)]
+            continue
+
+        res = await engine.call("blocks.children.append", block_id=block_id, children=children[start:start + MAX_APPEND_CHILDREN])
+        results += res["results"]
+        if journal is not None:
+            journal.record(key, [r["id"] for r in res["results"]])
+    return results
+
+
+async def _follow_up(engine, results, plan, journal=None):
+    await engine.gather(*(run_appends(engine, results[i]["id"], sub, journal) for i, sub in plan["then"]))
+
+
+async def run_appends(engine, block_id, plan, journal=None):
+    """
+    Execute a compiled plan under block_id; returns first-level results.
+    With a StepJournal, appends it already holds are not sent again.
+    """
+    results = await _append_level(engine, block_id, plan, journal)
+    await _follow_up(engine, results, plan, journal)
+    return results
+
+
+async def _create_fab_page(engine, journal, database_id, properties):
+    raw = await _retrieve_database(engine, database_id)
+    page = await engine.call(
+        "pages.create",
+        parent={"database_id": raw["id"]},
+        icon=None,
+        properties=get_properties_code(parse_database_info(raw)["properties"], **properties),
+    )
+    remember_page(page)
+    journal.record(f"page:{database_id}", page["id"])
+    return page["id"]
+
+
+async def _add_fab_content(
+    engine,
     *,
-    notion_token: str,
     page_url: str,
     num_chips: int,
     payload: dict,
     fabdata_db_urls: list[str],
-    mode: str = "all",
+    mode: str,
 ):
-    notion = NotionClient(auth=notion_token)  
-    db_page = Page("link to notion db page", page_url)
+    page_id = get_parent_id(page_url)
     mode = (mode or "all").strip().lower()
 
-    fabdata_db = []
     created_page_ids = []
-  
-    for url in fabdata_db_urls:
-        db = Database(url=url)
-        fabdata_db.append(db)
-    
+
     ### notion page content only shows C01
     num_chips = 1
 
-    #### Update fabdata 9 databases
-    ####
-
     # -------------------------------------------------
     # Required properties (must be present)
     # -------------------------------------------------
@@ -68,153 +238,132 @@ def add_fab_content(
     }
 
 
-    if mode in ("all", "setup"):
-        # create 9 DB pages + add properties
-
-        db_page_list = []
-        for i in range(len(fabdata_db_urls)):
-            new_db_page = Page()
-            db_page_list.append(new_db_page)
-
-        for i, db in enumerate(fabdata_db):
-            db_page_list[i].add_properties(new_properties)
-            db.add_page(db_page_list[i])
-
-        # -------------------------------------------------
-        # Collect created Fab child page IDs (WRITE-ONCE FACT)
-        # -------------------------------------------------
-        for p in db_page_list:
-            if p and getattr(p, "id", None):
-                created_page_ids.append(p.id)
-
-
-
-        ### create db page content
-        ###
-        n_databases = len(fabdata_db_urls)
-        sync_block_list = [Block(sync=True) for i in range(n_databases)]
-
-        sync_block_list[0].heading("History", header_type=2).divider().toggle_blocks("data").space()
-        sync_block_list[1].heading("Schematic", header_type=2).divider().toggle_blocks("chip").toggle_blocks("wafer").space()
-        sync_block_list[2].heading("Process", header_type=2).divider().toggle_blocks("flow").space()
-        sync_block_list[3].heading("Profile", header_type=2).divider().toggle_blocks("cross-section").toggle_blocks("data").space()
-        sync_block_list[4].heading("Design", header_type=2).divider().toggle_blocks("chip file").toggle_blocks("wafer file").space()
-        sync_block_list[5].heading("Microscope", header_type=2).divider().toggle_blocks("wafer").toggle_blocks("chip").space()
-        sync_block_list[6].heading("SEM", header_type=2).divider().toggle_blocks("wafer").toggle_blocks("chip").space()
-
-        # sync_block_list[7].heading("Wire bond", header_type=2).divider().toggle_blocks(main="C01", 
-        #                                                                                subs = ["PCB GPO connection","Resistance","Image"], sub_toggle=True).space()
+    journal = StepJournal("fab_content", page_id)
+    if journal.complete:
+        # finished by an earlier run: nothing left to create
+        return {
+            "success": True,
+            "fab_child_page_ids": journal.get("fab_child_page_ids", []),
+            "requests": {},
+            "resumed": True,
+        }
+    if journal.resumed:
+        print(f"Fab content: resuming ({len(journal.steps)} steps already done)", file=sys.stderr, flush=True)
 
-        sync_block_list[7].heading("Wire bond", header_type=2).divider()
-        for i in range(num_chips):
-            sync_block_list[7].toggle_blocks(main="C0"+str(i+1), subs = ["PCB GPO connection","Resistance","Image"], sub_toggle=True)
-        sync_block_list[7].space()
+    database_ids = [get_parent_id(url) for url in fabdata_db_urls]
 
-        sync_block_list[8].heading("Report", header_type=2).divider().toggle_blocks("file").space()
+    if mode in ("all", "setup"):
+        with track("mode=setup"):
+            # create 9 DB pages + add properties
+            # (one journal step per page: a rerun only creates the missing ones)
+            await engine.gather(*(
+                _create_fab_page(engine, journal, database_id, new_properties)
+                for database_id in database_ids
+                if f"page:{database_id}" not in journal
+            ))
 
-        # top_block = Block().callout("Patterning process : L0 Alignment marker, L1 Si trench (top-metal covered), L2 bottom-metal, L3 top-metal,  L4 airbridge hole, L5 airbridge bar")
-        # top_block.space()
+    # -------------------------------------------------
+    # Collect created Fab child page IDs (WRITE-ONCE FACT)
+    # -------------------------------------------------
+    created_page_ids = [journal.get(f"page:{database_id}") for database_id in database_ids]
+    created_page_ids = [pid for pid in created_page_ids if pid]
 
-        # -----------------------------------------
-        # Top callout (payload-driven, fallback-safe)
-        # -----------------------------------------
-        if not top_callout:
-            top_callout = "Patterning process : L0 Alignment marker, L1 Si trench (top-metal covered), L2 bottom-metal, L3 top-metal,  L4 airbridge hole, L5 airbridge bar"
+    pending = []
 
-        top_block = Block().callout(top_callout)
-        top_block.space()
+    if mode in ("all", "main"):
+        with track("mode=main"):
+            ### create db page content
+            ###
+            plan = json.loads(_compiled_fab_template(len(fabdata_db_urls), num_chips))
+
+            # -----------------------------------------
+            # Top callout (payload-driven, fallback-safe)
+            # -----------------------------------------
+            if not top_callout:
+                top_callout = "Patterning process : L0 Alignment marker, L1 Si trench (top-metal covered), L2 bottom-metal, L3 top-metal,  L4 airbridge hole, L5 airbridge bar"
+
+            top_block = Block().callout(top_callout)
+            top_block.space()
+
+            n_top = len(top_block.code_list)
+            plan["children"] = top_block.code_list + plan["children"]
+            plan["then"] = [[i + n_top, sub] for i, sub in plan["then"]]
+
+            # add top_block + sync blocks to main page
+
+            #### add content to main device db page
+            #### one append creates the callout and every synced block in order;
+            #### the deeper levels follow while the replicas are created
+            results = await _append_level(engine, page_id, plan, journal)
+            if "sync_ids" not in journal:
+                journal.record("sync_ids", [r["id"] for r in results[n_top:]])
+            pending.append(asyncio.ensure_future(_follow_up(engine, results, plan, journal)))
 
+    if mode in ("all", "fill"):
+        with track("mode=fill"):
+            sync_ids = journal.get("sync_ids")
+            if not sync_ids or len(created_page_ids) < len(database_ids):
+                await engine.gather(*pending)
+                return {"error": "Fab content: run the setup and main steps before fill"}
+
+            #### add content to fabdata db page
+            #### (a synced-block replica on each page)
+            pending.extend(
+                asyncio.ensure_future(_append_level(
+                    engine,
+                    db_page_id,
+                    {"children": [{"type": "synced_block", "synced_block": {"synced_from": {"block_id": sync_id}}}], "then": []},
+                    journal,
+                ))
+                for db_page_id, sync_id in zip(created_page_ids, sync_ids)
+            )
+
+    await engine.gather(*pending)
 
-            
     if mode in ("all", "main"):
-        # add top_block + sync blocks to main page
-
-        #### add content to main device db page
-        ####
-        db_page.add_block(top_block)
-        for s_block in sync_block_list:
-            db_page.add_block(s_block)
         print("main page content is created!", file=sys.stderr, flush=True)
-        
-
     if mode in ("all", "fill"):
-        # append tables/toggles to profile/microscope/sem/wirebond etc.
-
-        #### add content to fabdata db page
-        ####
-
-        fabdata_db_label = ["History", "Schematic", "Process", "Profile", "Design", "Microscope", "SEM", "Wirebond", "Report"]
-
-        fabdata_db_content = []
-        for i, s_block in enumerate(sync_block_list):
-            block = db_page_list[i].copy_sync_block(s_block)
-            fabdata_db_content.append(block)
-            print(f"{fabdata_db_label[i]} page content is created!", file=sys.stderr, flush=True)
-
-
-        # import pandas
-        # from pkg.eeroq_notion import *
-        ####History db page
-        ####
-        history = fabdata_db_content[0]
-
-        # csv = pandas.read_csv("../Fab_history_TiN.csv")
-        # header = header = csv.columns.tolist()
-        # cell = csv.iloc[:].to_numpy()
-
-        # table_code = table(header = header, content = cell)['code']
-        notion.blocks.children.append(block_id = history.id_list[2]['child2'], children = [])
-
-        ####Profile db page
-        ####
-        profile = fabdata_db_content[3]
-        table_code = table(header = ["Label", "t1", "t2", "t3", "d1", "d2", "h"], content = [["Thickness", "", "", "", "", "", ""]], 
-                           has_row_header = True)['code']
-        notion.blocks.children.append(block_id = profile.id_list[3]['child3'], children = [table_code])
-
-        ####Microscope db page
-        ####
-        microscope = fabdata_db_content[5]
-        toggle_list = []
-        for i in range(num_chips):
-            toggle_list.append(toggle_blocks('C0'+str(i+1))['code'])
-        notion.blocks.children.append(block_id = microscope.id_list[3]['child3'], children = toggle_list)
-
-        ####SEM db page
-        ####
-        sem = fabdata_db_content[6]
-        toggle_list = []
-        for i in range(num_chips):
-            toggle_list.append(toggle_blocks('C0'+str(i+1))['code'])
-        notion.blocks.children.append(block_id = sem.id_list[3]['child3'], children = toggle_list)
-
-        ####Wirebond db page
-        ####
-        wirebond_block = fabdata_db_content[7]
-        toggle_id = []
-        child_list = ["child"+str(i+2) for i in range(num_chips)]
-        for child_id in wirebond_block.id_list:
-            for k, v in child_id.items():
-                if k in child_list:
-                    toggle_id.append(v) 
-
-        sub_toggle_id = []
-        for t_id in toggle_id:
-            sub_toggle_id.append(notion.blocks.children.list(t_id)['results'][1]['id'])
-
-        table_code = table(header = ["Connection", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15", "16"], 
-                           content = [["R (kOhm)", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", ""]], has_row_header = True)['code']
-
-        for st_id in sub_toggle_id:
-            notion.blocks.children.append(block_id = st_id, children = [table_code])
+        for label in FABDATA_DB_LABELS[:len(created_page_ids)]:
+            print(f"{label} page content is created!", file=sys.stderr, flush=True)
 
+    requests_made = sum(engine.calls.values())
+    print(f"Fab content: {requests_made} Notion requests {dict(engine.calls)}", file=sys.stderr, flush=True)
+
+    if mode in ("all", "fill"):
+        journal.record("fab_child_page_ids", created_page_ids)
+        journal.finish()
         # return {"success": True}
         return {
             "success": True,
             "fab_child_page_ids": created_page_ids,
+            "requests": dict(engine.calls),
+            "resumed": journal.resumed,
         }
 
 
+def add_fab_content(
+    *,
+    notion_token: str,
+    page_url: str,
+    num_chips: int,
+    payload: dict,
+    fabdata_db_urls: list[str],
+    mode: str = "all",
+):
+    with track("add_fab_content"):
+        return run_notion(
+            notion_token,
+            lambda engine: _add_fab_content(
+                engine,
+                page_url=page_url,
+                num_chips=num_chips,
+                payload=payload,
+                fabdata_db_urls=fabdata_db_urls,
+                mode=mode,
+            ),
+        )
+
+
 
 
 def main():
@@ -0,0 +1,291 @@
+# notion/notion_engine.py
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextvars
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+
+from notion.notion_metrics import InstrumentedAsyncClient, InstrumentedClient, attempt as metrics_attempt
+
+
+# ----------------------------------------------------------------------
+# Limits
+# ----------------------------------------------------------------------
+# Notion allows an average of ~3 requests / second per integration and
+# answers 429 (with Retry-After) above that. Independent calls run
+# concurrently, but never more than NOTION_MAX_CONCURRENCY in flight and
+# never faster than the token bucket allows.
+
+NOTION_RATE_PER_SEC = float(os.environ.get("NOTION_RATE_PER_SEC", "3"))
+NOTION_BURST = int(os.environ.get("NOTION_BURST", "3"))
+NOTION_MAX_CONCURRENCY = int(os.environ.get("NOTION_MAX_CONCURRENCY", "3"))
+
+# retries (Retry-After wins over backoff). A 429 was rejected before
+# doing anything, so every endpoint retries it. Timeouts / 5xx / 409 may
+# hide a request that succeeded on the server: only endpoints that are
+# safe to repeat retry those. Creates and appends raise instead, and the
+# caller (or the step journal) decides.
+NOTION_MAX_RETRIES = 5
+NOTION_BACKOFF = 0.5
+RETRY_STATUS = (409, 429, 500, 502, 503, 504)
+RATE_LIMITED = 429
+
+# last part of the dotted endpoint name: reads, and writes that set
+# (rather than add) state
+IDEMPOTENT_ACTIONS = ("retrieve", "list", "query", "search", "update", "delete")
+
+
+def is_idempotent(endpoint: str) -> bool:
+    return endpoint.rsplit(".", 1)[-1] in IDEMPOTENT_ACTIONS
+
+
+# ----------------------------------------------------------------------
+# Token bucket
+# ----------------------------------------------------------------------
+# Notion's limit is per integration (token), not per connection, so
+# every engine and sync client in the process that uses a token draws
+# from the same bucket (shared_bucket). Engines run on their own event
+# loops, often on other threads: the bucket is guarded by a thread lock
+# and callers sleep outside it.
+
+class TokenBucket:
+    """
+    Token bucket: `rate` tokens / second, at most `burst` saved up.
+    pause(seconds) empties the bucket for that long (server Retry-After).
+    Safe to share between threads and event loops.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(float(rate), 0.01)
+        self.burst = max(int(burst), 1)
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _take(self) -> float:
+        """Take a token: 0, or how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while (delay := self._take()) > 0:
+            await asyncio.sleep(delay)
+
+    def wait(self) -> None:
+        """Blocking acquire (sync clients)."""
+        while (delay := self._take()) > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self._tokens = 0.0
+            self._stamp = now
+
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def shared_bucket(notion_token: str) -> TokenBucket:
+    """The process-wide bucket of one token (NOTION_RATE_PER_SEC / NOTION_BURST)."""
+    with _buckets_lock:
+        bucket = _buckets.get(notion_token)
+        if bucket is None:
+            bucket = _buckets[notion_token] = TokenBucket(NOTION_RATE_PER_SEC, NOTION_BURST)
+        return bucket
+
+
+# ----------------------------------------------------------------------
+# Engine
+# ----------------------------------------------------------------------
+
+def _retry_after(err: HTTPResponseError) -> float | None:
+    headers = getattr(err, "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class NotionEngine:
+    """
+    Rate-limited, concurrent Notion API calls on notion_client.AsyncClient
+    (instrumented, see notion_metrics).
+
+        async def work(engine):
+            page, db = await asyncio.gather(
+                engine.call("pages.retrieve", page_id=pid),
+                engine.call("databases.retrieve", database_id=did),
+            )
+
+        run_notion(notion_token, work)
+
+    Must be used inside one event loop (run_notion handles that).
+    """
+
+    def __init__(
+        self,
+        notion_token: str,
+        *,
+        concurrency: int = NOTION_MAX_CONCURRENCY,
+        rate: float | None = None,
+        burst: int | None = None,
+        max_retries: int = NOTION_MAX_RETRIES,
+    ):
+        if not notion_token:
+            raise ValueError("notion_token is required")
+        self.client = InstrumentedAsyncClient(auth=notion_token)
+        # own bucket only when asked for other limits
+        if rate is None and burst is None:
+            self.bucket = shared_bucket(notion_token)
+        else:
+            self.bucket = TokenBucket(rate or NOTION_RATE_PER_SEC, burst or NOTION_BURST)
+        self._slots = asyncio.Semaphore(max(int(concurrency), 1))
+        self.max_retries = max_retries
+        # requests sent per endpoint (retries included)
+        self.calls = collections.Counter()
+
+    def _endpoint(self, name: str) -> Callable[..., Awaitable[Any]]:
+        target = self.client
+        for part in name.split("."):
+            target = getattr(target, part)
+        return target
+
+    async def call(self, endpoint: str, **kwargs) -> Any:
+        """
+        Call one endpoint by dotted name ("pages.create",
+        "blocks.children.append", ...) with retries (see RETRY_STATUS).
+        """
+        fn = self._endpoint(endpoint)
+        repeatable = is_idempotent(endpoint)
+        attempt = 0
+
+        while True:
+            try:
+                async with self._slots:
+                    await self.bucket.acquire()
+                    self.calls[endpoint] += 1
+                    with metrics_attempt(attempt):
+                        return await fn(**kwargs)
+
+            except (HTTPResponseError, RequestTimeoutError) as e:
+                status = getattr(e, "status", None)
+                if repeatable:
+                    retryable = isinstance(e, RequestTimeoutError) or status in RETRY_STATUS
+                else:
+                    retryable = status == RATE_LIMITED
+                if not retryable or attempt >= self.max_retries:
+                    raise
+
+                delay = _retry_after(e) if isinstance(e, HTTPResponseError) else None
+                if delay is not None:
+                    # server said how long: stop every caller, not just this one
+                    self.bucket.pause(delay)
+                else:
+                    delay = NOTION_BACKOFF * (2 ** attempt) * (1 + random.random() / 2)
+                    await asyncio.sleep(delay)
+                attempt += 1
+
+    async def gather(self, *aws: Awaitable[Any]) -> list:
+        """asyncio.gather that cancels the rest when one call fails."""
+        tasks = [asyncio.ensure_future(a) for a in aws]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+# ----------------------------------------------------------------------
+# Sync client (notion_ops, eeroq_notion, outbox drainer)
+# ----------------------------------------------------------------------
+
+class PacedClient(InstrumentedClient):
+    """
+    notion_client.Client whose requests take tokens from the shared
+    bucket of its token, so sync calls and engines share one budget.
+    A 429 with Retry-After pauses the bucket for everyone, then raises
+    as before.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket = shared_bucket(kwargs.get("auth") or "")
+
+    def request(self, path, method, query=None, body=None, auth=None):
+        self.bucket.wait()
+        try:
+            return super().request(path, method, query, body, auth)
+        except HTTPResponseError as e:
+            delay = _retry_after(e)
+            if getattr(e, "status", None) == RATE_LIMITED and delay is not None:
+                self.bucket.pause(delay)
+            raise
+
+
+# ----------------------------------------------------------------------
+# Sync entry point (Streamlit scripts / CLI)
+# ----------------------------------------------------------------------
+
+def run_notion(notion_token: str, work: Callable[[NotionEngine], Awaitable[Any]], **engine_opts) -> Any:
+    """
+    Run `work(engine)` to completion on a fresh event loop and return its
+    result. Safe to call from a thread that already runs a loop (the work
+    then runs on a helper thread).
+    """
+
+    async def main():
+        engine = NotionEngine(notion_token, **engine_opts)
+        try:
+            return await work(engine)
+        finally:
+            await engine.aclose()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(main())
+
+    box = {}
+
+    def runner():
+        try:
+            box["result"] = asyncio.run(main())
+        except BaseException as e:
+            box["error"] = e
+
+    # carry the caller's context (notion_metrics action) into the thread
+    t = threading.Thread(target=contextvars.copy_context().run, args=(runner,), name="notion-engine")
+    t.start()
+    t.join()
+    if "error" in box:
+        raise box["error"]
+    return box["result"]
@@ -0,0 +1,162 @@
+# notion/notion_index.py
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+from notion.pkg.eeroq_notion import iter_database_query
+
+
+# ----------------------------------------------------------------------
+# Local database index
+# ----------------------------------------------------------------------
+# Lookups by title (design linking)
+# used to send one "contains" query per call and read only its first
+# page of results. Instead, each database is read once (paginated) into
+# a per-process index
+#   page id -> {"id", "url", "title", "last_edited_time"}
+# and then kept current with queries filtered on last_edited_time, so a
+# lookup is a dictionary hit plus, at most every NOTION_INDEX_TTL
+# seconds, one small incremental query.
+#
+# Notion queries skip archived pages, so an incremental refresh cannot
+# see a page disappear: archive_page drops it here, and the whole index
+# is rebuilt every NOTION_INDEX_REBUILD seconds for pages archived by hand.
+
+NOTION_INDEX_TTL = float(os.environ.get("NOTION_INDEX_TTL", "30"))
+NOTION_INDEX_REBUILD = float(os.environ.get("NOTION_INDEX_REBUILD", "3600"))
+
+
+def _plain(prop: dict) -> str:
+    if not isinstance(prop, dict):
+        return ""
+    value = prop.get(prop.get("type") or "")
+    if isinstance(value, list):
+        return "".join(part.get("plain_text", "") for part in value).strip()
+    if isinstance(value, (str, int, float)):
+        return str(value).strip()
+    return ""
+
+
+def _entry(row: dict) -> dict:
+    props = row.get("properties") or {}
+    title = next((_plain(p) for p in props.values() if isinstance(p, dict) and p.get("type") == "title"), "")
+    return {
+        "id": row["id"],
+        "url": row.get("url", ""),
+        "title": title,
+        "last_edited_time": row.get("last_edited_time") or "",
+    }
+
+
+def _key(object_id: str) -> str:
+    return (object_id or "").replace("-", "")
+
+
+class DatabaseIndex:
+
+    def __init__(self, database_id: str):
+        self.database_id = database_id
+        self.pages: dict[str, dict] = {}
+        self.cursor = ""          # newest last_edited_time seen
+        self.checked = 0.0        # time.monotonic() of the last refresh
+        self.built = 0.0          # ... of the last full read
+        self._lock = threading.Lock()
+
+    def _apply(self, rows) -> int:
+        n = 0
+        for row in rows:
+            if row.get("archived") or row.get("in_trash"):
+                self.pages.pop(_key(row["id"]), None)
+                continue
+            entry = _entry(row)
+            self.pages[_key(entry["id"])] = entry
+            self.cursor = max(self.cursor, entry["last_edited_time"])
+            n += 1
+        return n
+
+    def refresh(self, client, force: bool = False) -> None:
+        """Read what changed since the last refresh (everything the first time)."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self.checked < NOTION_INDEX_TTL:
+                return
+
+            if not self.built or now - self.built >= NOTION_INDEX_REBUILD:
+                self.pages = {}
+                self.cursor = ""
+                self._apply(iter_database_query(self.database_id, client))
+                self.built = now
+            elif self.cursor:
+                # last_edited_time has minute precision: on_or_after re-reads
+                # the last minute, which the page-id keys make harmless
+                self._apply(iter_database_query(
+                    self.database_id,
+                    client,
+                    filter = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": self.cursor}},
+                ))
+            self.checked = now
+
+    def note(self, row: dict) -> None:
+        """Add / update a page this process just created or edited."""
+        with self._lock:
+            self._apply([row])
+
+    def forget(self, page_id: str) -> None:
+        with self._lock:
+            self.pages.pop(_key(page_id), None)
+
+    def _match_title(self, title: str) -> dict | None:
+        needle = title.strip().lower()
+        exact, partial = [], []
+        for entry in self.pages.values():
+            text = entry["title"].lower()
+            if text == needle:
+                exact.append(entry)
+            elif needle in text:
+                partial.append(entry)
+        # Notion's "contains" search, exact titles first, newest first
+        for found in (exact, partial):
+            if found:
+                return dict(max(found, key = lambda e: e["last_edited_time"]))
+        return None
+
+    def lookup(self, client, match, value: str) -> dict | None:
+        self.refresh(client)
+        hit = match(value)
+        if hit is None:
+            # maybe created since the last refresh
+            self.refresh(client, force = True)
+            hit = match(value)
+        return hit
+
+    def find_title(self, client, title: str) -> dict | None:
+        return self.lookup(client, self._match_title, title)
+
+
+_indexes: dict[str, DatabaseIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def database_index(database_id: str) -> DatabaseIndex:
+    """The process-wide index of one database (created empty, filled on first lookup)."""
+    key = _key(database_id)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = DatabaseIndex(database_id)
+        return index
+
+
+def note_page(row: dict) -> None:
+    """Feed a page object into the index of its database, if that one is indexed."""
+    parent = (row or {}).get("parent") or {}
+    index = _indexes.get(_key(parent.get("database_id") or ""))
+    if index is not None and row.get("id"):
+        index.note(row)
+
+
+def forget_page(page_id: str) -> None:
+    for index in list(_indexes.values()):
+        index.forget(page_id)
@@ -0,0 +1,94 @@
+# notion/notion_journal.py
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+
+
+# ----------------------------------------------------------------------
+# Step journal
+# ----------------------------------------------------------------------
+# A multi-request Notion action (add_fab_content) records each finished
+# step here, so a rerun after a failure (rate limit, timeout, restart)
+# continues from the first unfinished step instead of creating the
+# pages and blocks again.
+#
+# One JSON file per action + target page in NOTION_JOURNAL_DIR, written
+# after every step (temp file + rename: a crash never leaves half a file):
+#   {"action": "fab_content", "page_id": "...", "complete": false,
+#    "updated": 1700000000.0,
+#    "steps": {"<step key>": <result>, ...}}
+#
+# Step keys and results are up to the caller; a step is only recorded
+# once Notion acknowledged it.
+
+NOTION_JOURNAL_DIR = os.environ.get(
+    "NOTION_JOURNAL_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".notion_journal"),
+)
+
+_lock = threading.Lock()
+
+
+class StepJournal:
+
+    def __init__(self, action: str, page_id: str, directory: str = NOTION_JOURNAL_DIR):
+        self.action = action
+        self.page_id = page_id.replace("-", "")
+        self.path = os.path.join(directory, f"{action}_{self.page_id}.json")
+        self.complete = False
+        self.steps: dict = {}
+        self.resumed = False
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable Notion journal {self.path}: {e}")
+            return
+
+        self.complete = bool(data.get("complete"))
+        self.steps = data.get("steps") or {}
+        self.resumed = bool(self.steps)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.steps
+
+    def get(self, key: str, default=None):
+        return self.steps.get(key, default)
+
+    def record(self, key: str, value) -> None:
+        self.steps[key] = value
+        self._save()
+
+    def finish(self) -> None:
+        self.complete = True
+        self._save()
+
+    def discard(self) -> None:
+        self.steps = {}
+        self.complete = False
+        with _lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _save(self) -> None:
+        data = {
+            "action": self.action,
+            "page_id": self.page_id,
+            "complete": self.complete,
+            "updated": time.time(),
+            "steps": self.steps,
+        }
+        with _lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
@@ -0,0 +1,229 @@
+# notion/notion_metrics.py
+from __future__ import annotations
+
+import bisect
+import collections
+import contextlib
+import contextvars
+import json
+import re
+import threading
+import time
+
+from notion_client import AsyncClient, Client
+from notion_client.errors import HTTPResponseError
+
+
+# ----------------------------------------------------------------------
+# Notion call accounting
+# ----------------------------------------------------------------------
+# Every request sent through the clients below is recorded:
+#   action    high-level caller, e.g. "create_fab_page",
+#             "add_fab_content > mode=setup" (nested: "outer > inner")
+#   op        "PATCH pages/:id", "POST blocks/:id/children", ...
+#   target    the object id in the path
+#   duration  seconds, HTTP status (0 = timeout / network), retry no.
+#
+# Calls are aggregated per (action, op) with a latency histogram, and
+# every action run is kept as one summary (latest RECENT_RUNS).
+# The store is per process, like the Streamlit server.
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)   # seconds, upper bounds (+ overflow)
+RECENT_RUNS = 100
+
+_action = contextvars.ContextVar("notion_action", default=None)
+_attempt = contextvars.ContextVar("notion_attempt", default=0)
+
+_ID_SEGMENT = re.compile(r"^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$")
+
+
+class _Stats:
+    __slots__ = ("calls", "errors", "retries", "total", "max", "buckets", "statuses")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.statuses = collections.Counter()
+
+    def add(self, duration: float, status: int, retry: int) -> None:
+        self.calls += 1
+        self.errors += status == 0 or status >= 400
+        self.retries += retry > 0
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+        self.statuses[status] += 1
+
+    def percentile(self, q: float) -> float | None:
+        """Upper bucket bound holding the q-quantile (None: overflow bucket)."""
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS + (None,), self.buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "total_s": round(self.total, 3),
+            "mean_s": round(self.total / self.calls, 3) if self.calls else 0.0,
+            "max_s": round(self.max, 3),
+            "p50_le_s": self.percentile(0.5),
+            "p95_le_s": self.percentile(0.95),
+            "histogram": dict(zip([f"<={b}s" for b in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"], self.buckets)),
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+        }
+
+
+class _Run:
+    """
+    Calls made during one action (shared by its tasks / threads). Tasks
+    started inside may finish after the block exits and still count.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.ended = None
+        self.calls = 0
+        self.errors = 0
+        self.api_s = 0.0
+        self.ops = collections.Counter()
+
+    def as_dict(self) -> dict:
+        return {
+            "action": self.name,
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "wall_s": round((self.ended or time.time()) - self.started, 3),
+            "api_s": round(self.api_s, 3),
+            "calls": self.calls,
+            "errors": self.errors,
+            "ops": dict(self.ops),
+        }
+
+
+_lock = threading.Lock()
+_stats: dict[tuple[str, str], _Stats] = {}
+_runs: collections.deque = collections.deque(maxlen=RECENT_RUNS)
+
+
+def _operation(method: str, path: str) -> tuple[str, str]:
+    parts = path.strip("/").split("/")
+    target = next((p for p in parts if _ID_SEGMENT.match(p)), "")
+    op = "/".join(":id" if _ID_SEGMENT.match(p) else p for p in parts)
+    return f"{method.upper()} {op}", target
+
+
+def record(method: str, path: str, duration: float, status: int) -> None:
+    op, target = _operation(method, path)
+    run = _action.get()
+    action = run.name if run is not None else "(untracked)"
+    retry = _attempt.get()
+
+    with _lock:
+        _stats.setdefault((action, op), _Stats()).add(duration, status, retry)
+        if run is not None:
+            run.calls += 1
+            run.errors += status == 0 or status >= 400
+            run.api_s += duration
+            run.ops[op] += 1
+
+    if status == 0 or status >= 400:
+        print(f"⚠️ Notion {op} {target} -> {status or 'no response'} ({duration:.2f}s, {action})")
+
+
+@contextlib.contextmanager
+def track(name: str):
+    """
+    Tag every Notion call made inside (threads via run_notion and asyncio
+    tasks included) with this action; nested actions read "outer > inner".
+    """
+    parent = _action.get()
+    run = _Run(f"{parent.name} > {name}" if parent is not None else name)
+    token = _action.set(run)
+    with _lock:
+        _runs.append(run)
+    try:
+        yield run
+    finally:
+        _action.reset(token)
+        run.ended = time.time()
+
+
+@contextlib.contextmanager
+def attempt(n: int):
+    """Retry number of the call made inside (NotionEngine)."""
+    token = _attempt.set(n)
+    try:
+        yield
+    finally:
+        _attempt.reset(token)
+
+
+def summary() -> list[dict]:
+    """Per (action, op) rows, worst total time first."""
+    with _lock:
+        rows = [{"action": a, "op": op, **s.as_dict()} for (a, op), s in _stats.items()]
+    return sorted(rows, key=lambda r: r["total_s"], reverse=True)
+
+
+def recent_runs() -> list[dict]:
+    with _lock:
+        return [run.as_dict() for run in reversed(_runs)]
+
+
+def export_json() -> str:
+    return json.dumps({"buckets_s": LATENCY_BUCKETS, "summary": summary(), "runs": recent_runs()}, indent=2)
+
+
+def reset() -> None:
+    with _lock:
+        _stats.clear()
+        _runs.clear()
+
+
+# ----------------------------------------------------------------------
+# Instrumented clients
+# ----------------------------------------------------------------------
+# All endpoints of notion_client go through Client.request(path, method, ...).
+
+def _status(err: Exception) -> int:
+    if isinstance(err, HTTPResponseError):
+        return getattr(err, "status", 0) or 0
+    return 0
+
+
+class InstrumentedClient(Client):
+
+    def request(self, path, method, query=None, body=None, auth=None):
+        start = time.perf_counter()
+        try:
+            result = super().request(path, method, query, body, auth)
+        except Exception as e:
+            record(method, path, time.perf_counter() - start, _status(e))
+            raise
+        record(method, path, time.perf_counter() - start, 200)
+        return result
+
+
+class InstrumentedAsyncClient(AsyncClient):
+
+    async def request(self, path, method, query=None, body=None, auth=None):
+        start = time.perf_counter()
+        try:
+            result = await super().request(path, method, query, body, auth)
+        except Exception as e:
+            record(method, path, time.perf_counter() - start, _status(e))
+            raise
+        record(method, path, time.perf_counter() - start, 200)
+        return result
@@ -1,20 +1,30 @@
 # pkg/notion_ops.py
 from __future__ import annotations
 
+from functools import lru_cache
 from typing import Iterable, Optional
 from notion_client import Client as NotionClient
-from notion.pkg.eeroq_notion import Page, Database
+from notion.notion_engine import PacedClient
+from notion.notion_metrics import track
+from notion.pkg.eeroq_notion import Page, Database, remember_page
 from notion_client.helpers import get_id
+from notion.notion_index import database_index, forget_page, note_page
 
 
 # ----------------------------------------------------------------------
 # Core client helper
 # ----------------------------------------------------------------------
 
+@lru_cache(maxsize=4)
+def _cached_client(notion_token: str) -> NotionClient:
+    return PacedClient(auth=notion_token)
+
+
 def get_notion_client(notion_token: str) -> NotionClient:
+    """One client per token, reused (keeps its HTTP connections alive)."""
     if not notion_token:
         raise ValueError("notion_token is required")
-    return NotionClient(auth=notion_token)
+    return _cached_client(notion_token)
 
 
 # ----------------------------------------------------------------------
@@ -37,6 +47,7 @@ def normalize_page_id(pid: str) -> str:
 # Archive page (with optional relation clearing)
 # ----------------------------------------------------------------------
 
+@track("archive_page")
 def archive_page(
     *,
     notion_token: str,
@@ -64,13 +75,16 @@ def archive_page(
             client.pages.update(page_id=page_id, properties=rel_updates)
 
     # 2) Archive / unarchive
-    client.pages.update(page_id=page_id, archived=bool(archived))
+    remember_page(client.pages.update(page_id=page_id, archived=bool(archived)))
+    if archived:
+        forget_page(page_id)
 
 
 # ----------------------------------------------------------------------
 # Create Measurement page (Bluefors / ICEOxford)
 # ----------------------------------------------------------------------
 
+@track("create_measure_page")
 def create_measure_page(
     *,
     notion_token: str,
@@ -97,6 +111,7 @@ def create_measure_page(
     page_id = ""
 
     if isinstance(created, dict):
+        note_page(created)
         url = created.get("url", "") or ""
         page_id = created.get("id", "") or ""
     else:
@@ -110,6 +125,7 @@ def create_measure_page(
 # Create Fab page
 # ----------------------------------------------------------------------
 
+@track("create_fab_page")
 def create_fab_page(
     *,
     notion_token: str,
@@ -133,6 +149,7 @@ def create_fab_page(
     page_id = ""
 
     if isinstance(created, dict):
+        note_page(created)
         url = created.get("url", "") or created.get("public_url", "") or ""
         page_id = created.get("id", "") or ""
     else:
@@ -146,6 +163,7 @@ def create_fab_page(
 # Retrieve page (used for cooldown inspection)
 # ----------------------------------------------------------------------
 
+@track("get_page")
 def get_page(
     *,
     notion_token: str,
@@ -156,7 +174,8 @@ def get_page(
         raise ValueError("page_id is required")
 
     client = get_notion_client(notion_token)
-    page = client.pages.retrieve(page_id=page_id)
+    page = client.pages.retrieve(page_id=page_id)   # live: edited by hand in Notion
+    remember_page(page)
 
     props = page.get("properties") or {}
     cd = props.get("Cooldown dates") or {}
@@ -174,6 +193,7 @@ def get_page(
 # Set relation (SAFE default, exact behavior preserved)
 # ----------------------------------------------------------------------
 
+@track("set_relation")
 def set_relation(
     *,
     notion_token: str,
@@ -203,16 +223,19 @@ def set_relation(
             if not rel:
                 return
 
-    client.pages.update(
+    updated = client.pages.update(
         page_id=page_id,
         properties={prop_name: {"relation": rel}},
     )
+    remember_page(updated)
+    note_page(updated)
 
 
 # ----------------------------------------------------------------------
 # Update date range (Cooldown / Warmup / Measure)
 # ----------------------------------------------------------------------
 
+@track("update_date_range")
 def update_date_range(
     *,
     notion_token: str,
@@ -234,16 +257,19 @@ def update_date_range(
     if end_date:
         date_obj["end"] = end_date
 
-    client.pages.update(
+    updated = client.pages.update(
         page_id=page_id,
         properties={prop_name: {"date": date_obj}},
     )
+    remember_page(updated)
+    note_page(updated)
 
 
 # ----------------------------------------------------------------------
 # Update page properties by page_url (Fab / Measurement rename, etc.)
 # ----------------------------------------------------------------------
 
+@track("update_page_properties")
 def update_page_properties(
     *,
     notion_token: str,
@@ -269,7 +295,7 @@ def update_page_properties(
 
     db = Database("DB", url=db_url)
     page = Page("link", page_url)
-    db.update_page_properties(page, properties)
+    note_page(db.update_page_properties(page, properties))
 
 
 
@@ -277,6 +303,7 @@ def update_page_properties(
 # Find page URL in database by title (Design linking)
 # ----------------------------------------------------------------------
 
+@track("get_page_url_by_title")
 def get_page_url_by_title(
     *,
     notion_token: str,
@@ -285,7 +312,8 @@ def get_page_url_by_title(
 ) -> str:
     """
     Search a Notion database by title (contains match)
-    and return the first matching page URL.
+    and return the first matching page URL (exact title first).
+    Served from the local database index (notion_index).
     """
 
     if not notion_token:
@@ -297,26 +325,14 @@ def get_page_url_by_title(
 
     client = get_notion_client(notion_token)
 
-    db_id = get_id(db_url)
-
-    results = client.databases.query(
-        database_id=db_id,
-        filter={
-            "property": "title",
-            "rich_text": {
-                "contains": title,
-            },
-        },
-    )
-
-    items = results.get("results", [])
-    if not items:
+    entry = database_index(get_id(db_url)).find_title(client, title)
+    if entry is None:
         return ""
 
-    return items[0].get("url", "")
-
+    return entry.get("url", "")
 
 
+@track("get_cooldown_page")
 def get_cooldown_page(
     *,
     notion_token: str,
@@ -333,7 +349,8 @@ def get_cooldown_page(
 
     client = get_notion_client(notion_token)
 
-    page = client.pages.retrieve(page_id=page_id)
+    page = client.pages.retrieve(page_id=page_id)   # live: edited by hand in Notion
+    remember_page(page)
 
     props = page.get("properties") or {}
     cd = props.get("Cooldown dates") or {}
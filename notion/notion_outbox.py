@@ -0,0 +1,431 @@
+# notion/notion_outbox.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable
+
+from notion_client.errors import APIResponseError
+from notion_client.helpers import get_id
+
+from notion.notion_metrics import track
+from notion.notion_ops import archive_page, normalize_page_id, update_date_range, update_page_properties
+
+
+# ----------------------------------------------------------------------
+# Notion outbox
+# ----------------------------------------------------------------------
+# save_full_run commits to Firestore and then records its Notion side
+# effects here instead of calling Notion inline. A background drainer
+# (one thread per process) applies them, so the save returns as soon as
+# Firestore acknowledged.
+#
+# Entries live in a local SQLite file so they survive a Streamlit
+# restart. Per entry:
+#   key      coalescing key: a newer entry with the same key replaces
+#            (or, for page properties, merges into) a pending one
+#   digest   idempotency key = hash(op, payload); an entry whose digest
+#            is the last one applied for its key is skipped
+#   status   pending -> running -> done | failed
+#
+# Transient errors (429 / 5xx / network) are retried with backoff;
+# validation errors (4xx) and entries out of attempts become "failed"
+# and are shown on the run until retried.
+
+NOTION_OUTBOX_PATH = os.environ.get(
+    "NOTION_OUTBOX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".notion_outbox.sqlite3"),
+)
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BACKOFF = 5.0          # seconds, doubled per attempt
+OUTBOX_MAX_BACKOFF = 300.0
+OUTBOX_LEASE = 120.0          # a "running" entry older than this is re-run
+OUTBOX_POLL = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id       TEXT NOT NULL,
+    op           TEXT NOT NULL,
+    key          TEXT NOT NULL,
+    page         TEXT NOT NULL DEFAULT '',
+    payload      TEXT NOT NULL,
+    digest       TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    next_at      REAL NOT NULL DEFAULT 0,
+    last_error   TEXT NOT NULL DEFAULT '',
+    created_at   REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_at);
+CREATE INDEX IF NOT EXISTS outbox_run ON outbox (run_id, status);
+CREATE TABLE IF NOT EXISTS applied (
+    key     TEXT PRIMARY KEY,
+    digest  TEXT NOT NULL
+);
+"""
+
+_db_lock = threading.Lock()
+_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _ready
+    conn = sqlite3.connect(NOTION_OUTBOX_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _ready:
+        conn.executescript(_SCHEMA)
+        _ready = True
+    return conn
+
+
+def _digest(op: str, payload: dict) -> str:
+    return hashlib.sha1(json.dumps([op, payload], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _page_key(page: str) -> str:
+    """Page id without dashes, from an id or a notion.so URL."""
+    page = (page or "").strip()
+    if page.startswith("http"):
+        page = get_id(page)
+    return normalize_page_id(page).replace("-", "")
+
+
+# ----------------------------------------------------------------------
+# Operations (what an entry does)
+# ----------------------------------------------------------------------
+
+def _op_page_properties(token: str, p: dict) -> None:
+    update_page_properties(notion_token=token, db_url=p["db_url"], page_url=p["page_url"], properties=p["properties"])
+
+
+def _op_date_range(token: str, p: dict) -> None:
+    update_date_range(
+        notion_token=token,
+        page_id=p["page_id"],
+        prop_name=p["prop_name"],
+        start_date=p["start_date"],
+        end_date=p.get("end_date") or "",
+    )
+
+
+def _op_archive(token: str, p: dict) -> None:
+    archive_page(notion_token=token, page_id=p["page_id"], archived=True, clear_relations=p.get("clear_relations", False))
+
+
+OPS: dict[str, Callable[[str, dict], None]] = {
+    "page_properties": _op_page_properties,
+    "date_range": _op_date_range,
+    "archive": _op_archive,
+}
+
+
+# ----------------------------------------------------------------------
+# Enqueue
+# ----------------------------------------------------------------------
+
+def enqueue(run_id: str, op: str, payload: dict, *, key: str, page: str = "", merge: bool = False) -> int:
+    """
+    Record one side effect. A pending entry with the same key is
+    replaced (merge=True: payload["properties"] merged, newer wins)
+    instead of adding a second call.
+    """
+    if op not in OPS:
+        raise ValueError(f"unknown outbox op: {op!r}")
+
+    now = time.time()
+    with _db_lock:
+        conn = _connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, payload FROM outbox WHERE key = ? AND status = 'pending' ORDER BY id DESC LIMIT 1",
+                (key,),
+            ).fetchone()
+
+            if row is not None:
+                if merge:
+                    merged = json.loads(row["payload"])
+                    merged.update({k: v for k, v in payload.items() if k != "properties"})
+                    merged["properties"] = {**merged.get("properties", {}), **payload.get("properties", {})}
+                    payload = merged
+                conn.execute(
+                    "UPDATE outbox SET payload = ?, digest = ?, attempts = 0, next_at = 0, "
+                    "last_error = '', updated_at = ? WHERE id = ?",
+                    (json.dumps(payload), _digest(op, payload), now, row["id"]),
+                )
+                entry_id = row["id"]
+            else:
+                entry_id = conn.execute(
+                    "INSERT INTO outbox (run_id, op, key, page, payload, digest, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (run_id, op, key, page, json.dumps(payload), _digest(op, payload), now, now),
+                ).lastrowid
+
+            if op == "archive" and page:
+                # anything still queued for an archived page would only fail
+                conn.execute(
+                    "DELETE FROM outbox WHERE page = ? AND op != 'archive' AND status IN ('pending', 'failed')",
+                    (page,),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    _wake.set()
+    return entry_id
+
+
+def enqueue_page_properties(run_id: str, *, db_url: str, page_url: str, properties: dict) -> int:
+    page = _page_key(page_url)
+    return enqueue(
+        run_id,
+        "page_properties",
+        {"db_url": db_url, "page_url": page_url, "properties": dict(properties)},
+        key=f"props:{page}",
+        page=page,
+        merge=True,
+    )
+
+
+def enqueue_date_range(run_id: str, *, page_id: str, prop_name: str, start_date: str, end_date: str = "") -> int:
+    page = _page_key(page_id)
+    return enqueue(
+        run_id,
+        "date_range",
+        {"page_id": page_id, "prop_name": prop_name, "start_date": start_date, "end_date": end_date or ""},
+        key=f"date:{page}:{prop_name}",
+        page=page,
+    )
+
+
+def enqueue_archive(run_id: str, *, page_id: str, clear_relations: bool = False) -> int:
+    page = _page_key(page_id)
+    return enqueue(
+        run_id,
+        "archive",
+        {"page_id": page_id, "clear_relations": clear_relations},
+        key=f"archive:{page}",
+        page=page,
+    )
+
+
+# ----------------------------------------------------------------------
+# Drain
+# ----------------------------------------------------------------------
+
+def _is_permanent(err: Exception) -> bool:
+    status = getattr(err, "status", None)
+    return isinstance(err, (ValueError, KeyError)) or (
+        isinstance(err, APIResponseError) and status is not None and 400 <= status < 500 and status not in (409, 429)
+    )
+
+
+def _claim(conn: sqlite3.Connection, now: float):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT * FROM outbox WHERE (status = 'pending' AND next_at <= ?) "
+            "OR (status = 'running' AND next_at <= ?) ORDER BY id LIMIT 1",
+            (now, now),
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE outbox SET status = 'running', next_at = ?, updated_at = ? WHERE id = ?",
+                (now + OUTBOX_LEASE, now, row["id"]),
+            )
+        conn.execute("COMMIT")
+        return row
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _finish(conn: sqlite3.Connection, row, *, error: Exception | None) -> None:
+    now = time.time()
+    if error is None:
+        # an entry that is running is never coalesced into (enqueue only
+        # touches pending ones), so its payload is the one just applied
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE outbox SET status = 'done', updated_at = ? WHERE id = ?", (now, row["id"]))
+            conn.execute(
+                "INSERT INTO applied (key, digest) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET digest = excluded.digest",
+                (row["key"], row["digest"]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return
+
+    attempts = row["attempts"] + 1
+    if _is_permanent(error) or attempts >= OUTBOX_MAX_ATTEMPTS:
+        status, next_at = "failed", 0
+    else:
+        status, next_at = "pending", now + min(OUTBOX_BACKOFF * (2 ** (attempts - 1)), OUTBOX_MAX_BACKOFF)
+
+    conn.execute(
+        "UPDATE outbox SET status = ?, attempts = ?, next_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+        (status, attempts, next_at, str(error)[:500], now, row["id"]),
+    )
+
+
+def drain_once(notion_token: str) -> bool:
+    """Apply the next due entry; False when nothing is due."""
+    conn = _connect()
+    try:
+        row = _claim(conn, time.time())
+        if row is None:
+            return False
+
+        applied = conn.execute("SELECT digest FROM applied WHERE key = ?", (row["key"],)).fetchone()
+        if applied is not None and applied["digest"] == row["digest"]:
+            # already in Notion (e.g. re-queued after a crash past the call)
+            _finish(conn, row, error=None)
+            return True
+
+        try:
+            with track(f"outbox:{row['op']}"):
+                OPS[row["op"]](notion_token, json.loads(row["payload"]))
+        except Exception as e:
+            print(f"⚠️ Notion outbox #{row['id']} ({row['op']}) failed: {e}")
+            _finish(conn, row, error=e)
+        else:
+            _finish(conn, row, error=None)
+        return True
+    finally:
+        conn.close()
+
+
+_wake = threading.Event()
+_drainer: threading.Thread | None = None
+_drainer_lock = threading.Lock()
+
+
+def _drain_forever(notion_token: str) -> None:
+    while True:
+        try:
+            while drain_once(notion_token):
+                pass
+        except Exception as e:   # keep the drainer alive (db locked, disk, ...)
+            print(f"⚠️ Notion outbox drainer error: {e}")
+        _wake.wait(OUTBOX_POLL)
+        _wake.clear()
+
+
+def start_drainer(notion_token: str) -> None:
+    """Start the process-wide drainer thread (no-op if running)."""
+    global _drainer
+    with _drainer_lock:
+        if _drainer is not None and _drainer.is_alive():
+            return
+        _drainer = threading.Thread(target=_drain_forever, args=(notion_token,), name="notion-outbox", daemon=True)
+        _drainer.start()
+
+
+# ----------------------------------------------------------------------
+# Status (UI)
+# ----------------------------------------------------------------------
+
+def run_status(run_id: str) -> dict[str, Any]:
+    """{"pending": n, "failed": n, "errors": [(op, last_error), ...]} for one run."""
+    conn = _connect()
+    try:
+        counts = dict(
+            conn.execute(
+                "SELECT status, COUNT(*) FROM outbox WHERE run_id = ? AND status IN ('pending', 'running', 'failed') "
+                "GROUP BY status",
+                (run_id,),
+            ).fetchall()
+        )
+        errors = [
+            (r["op"], r["last_error"])
+            for r in conn.execute(
+                "SELECT op, last_error FROM outbox WHERE run_id = ? AND status = 'failed' ORDER BY id",
+                (run_id,),
+            )
+        ]
+    finally:
+        conn.close()
+
+    return {
+        "pending": counts.get("pending", 0) + counts.get("running", 0),
+        "failed": counts.get("failed", 0),
+        "errors": errors,
+    }
+
+
+def retry_failed(run_id: str) -> int:
+    """
+    Re-queue the run's failed entries; returns how many. A failed entry
+    is not replayed over a newer entry with the same key: it is dropped,
+    or for page properties reduced to the properties no newer entry sets
+    (merged into a pending one when there is one).
+    """
+    now = time.time()
+    n = 0
+    with _db_lock:
+        conn = _connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            failed = conn.execute(
+                "SELECT * FROM outbox WHERE run_id = ? AND status = 'failed' ORDER BY id",
+                (run_id,),
+            ).fetchall()
+
+            for row in failed:
+                newer = conn.execute(
+                    "SELECT id, status, payload FROM outbox WHERE key = ? AND id > ? ORDER BY id",
+                    (row["key"], row["id"]),
+                ).fetchall()
+
+                payload = json.loads(row["payload"])
+                if newer and row["op"] == "page_properties":
+                    covered = set()
+                    for r in newer:
+                        covered.update(json.loads(r["payload"]).get("properties", {}))
+                    payload["properties"] = {
+                        k: v for k, v in payload.get("properties", {}).items() if k not in covered
+                    }
+                    pending = next((r for r in reversed(newer) if r["status"] == "pending"), None)
+
+                    if payload["properties"] and pending is not None:
+                        merged = json.loads(pending["payload"])
+                        merged["properties"] = {**payload["properties"], **merged.get("properties", {})}
+                        conn.execute(
+                            "UPDATE outbox SET payload = ?, digest = ?, updated_at = ? WHERE id = ?",
+                            (json.dumps(merged), _digest(row["op"], merged), now, pending["id"]),
+                        )
+                        payload["properties"] = {}
+                        n += 1
+
+                if newer and not payload.get("properties"):
+                    # superseded (date range / archive) or nothing left
+                    conn.execute("DELETE FROM outbox WHERE id = ?", (row["id"],))
+                    continue
+
+                conn.execute(
+                    "UPDATE outbox SET status = 'pending', payload = ?, digest = ?, attempts = 0, "
+                    "next_at = 0, updated_at = ? WHERE id = ?",
+                    (json.dumps(payload), _digest(row["op"], payload), now, row["id"]),
+                )
+                n += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    _wake.set()
+    return n
@@ -0,0 +1,280 @@
+# notion/notion_worker.py
+from __future__ import annotations
+
+import atexit
+import itertools
+import json
+import os
+import queue
+import struct
+import subprocess
+import sys
+import threading
+from typing import Any, Callable
+
+
+# ----------------------------------------------------------------------
+# Persistent Notion worker
+# ----------------------------------------------------------------------
+# Running a Notion action as `python script.py '<json>'` pays for a new
+# interpreter plus the notion_client / streamlit imports on every call,
+# which dominates small jobs (a date-range update). Instead, a few
+# long-lived worker processes are started once per Streamlit process
+# and reused: imports, the cached notion Client (keep-alive connections)
+# and module-level state stay warm between jobs.
+#
+# Wire format on the worker's stdin / stdout: one frame per message,
+#   4-byte big-endian length + UTF-8 JSON
+#   request  {"id": n, "job": "get_page", "payload": {...}}
+#   response {"id": n, "ok": true, "result": {...}}
+#            {"id": n, "ok": false, "error": "...", "type": "ValueError"}
+#
+# Anything a job prints goes to the worker's stderr (stdout is frames only).
+
+NOTION_WORKERS = int(os.environ.get("NOTION_WORKERS", "2"))
+NOTION_WORKER_TIMEOUT = float(os.environ.get("NOTION_WORKER_TIMEOUT", "300"))
+
+_HEADER = struct.Struct(">I")
+
+
+def write_frame(stream, message: dict) -> None:
+    body = json.dumps(message).encode("utf-8")
+    stream.write(_HEADER.pack(len(body)) + body)
+    stream.flush()
+
+
+def read_frame(stream) -> dict | None:
+    """Next message, or None at end of stream."""
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    (size,) = _HEADER.unpack(header)
+    body = stream.read(size)
+    if len(body) < size:
+        return None
+    return json.loads(body.decode("utf-8"))
+
+
+# ----------------------------------------------------------------------
+# Jobs (run inside the worker)
+# ----------------------------------------------------------------------
+# Same payloads as the notion/*.py scripts they replace; the token and
+# DB URLs come from the worker environment (set by the Streamlit side).
+
+def _job_get_page(payload: dict) -> dict:
+    from notion.notion_ops import get_page
+
+    return get_page(notion_token=os.environ["NOTION_TOKEN"], page_id=payload["page_id"])
+
+
+def _job_update_page(payload: dict) -> dict:
+    from notion.notion_ops import update_page_properties
+
+    update_page_properties(
+        notion_token=os.environ["NOTION_TOKEN"],
+        db_url=payload["db_url"],
+        page_url=payload["page_url"],
+        properties=payload["properties"],
+    )
+    return {"success": True}
+
+
+def _job_add_fab_content(payload: dict) -> dict:
+    from notion.notion_add_fab_content import add_fab_content
+
+    return add_fab_content(
+        notion_token=os.environ["NOTION_TOKEN"],
+        page_url=payload["page_url"],
+        num_chips=payload.get("num_chips", 1),
+        payload=payload,
+        fabdata_db_urls=payload.get("fabdata_db_urls") or json.loads(os.environ.get("NOTION_FABDATA_DB_URLS", "[]")),
+        mode=payload.get("mode", "all"),
+    )
+
+
+JOBS: dict[str, Callable[[dict], Any]] = {
+    "get_page": _job_get_page,
+    "update_page": _job_update_page,
+    "add_fab_content": _job_add_fab_content,
+}
+
+# script path (as passed to run_notion_subprocess) -> job
+SCRIPT_JOBS = {
+    "notion/notion_get_page.py": "get_page",
+    "notion/notion_update_page.py": "update_page",
+    "notion/notion_add_fab_content.py": "add_fab_content",
+}
+
+
+def serve(stdin=None, stdout=None) -> None:
+    """Worker main loop: answer frames until stdin closes."""
+    stdin = stdin or sys.stdin.buffer
+    if stdout is None:
+        # keep the real stdout for frames; route prints to stderr
+        stdout = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        sys.stdout = sys.stderr
+
+    while True:
+        msg = read_frame(stdin)
+        if msg is None:
+            return
+
+        job = JOBS.get(msg.get("job"))
+        try:
+            if job is None:
+                raise ValueError(f"unknown Notion job: {msg.get('job')!r}")
+            reply = {"id": msg.get("id"), "ok": True, "result": job(msg.get("payload") or {})}
+        except Exception as e:
+            reply = {"id": msg.get("id"), "ok": False, "error": str(e), "type": type(e).__name__}
+
+        write_frame(stdout, reply)
+
+
+# ----------------------------------------------------------------------
+# Client side (Streamlit process)
+# ----------------------------------------------------------------------
+
+class WorkerUnavailable(RuntimeError):
+    """The worker could not run the job at all (safe to fall back)."""
+
+
+class NotionJobError(RuntimeError):
+    """The job ran and failed (Notion / validation error)."""
+
+
+class _Worker:
+    def __init__(self, env: dict):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "notion.notion_worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        self.replies: queue.Queue = queue.Queue()
+        threading.Thread(target=self._read, name="notion-worker-reader", daemon=True).start()
+
+    def _read(self):
+        while True:
+            try:
+                msg = read_frame(self.proc.stdout)
+            except Exception:
+                msg = None
+            self.replies.put(msg)
+            if msg is None:
+                return
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def request(self, msg: dict, timeout: float) -> dict:
+        try:
+            write_frame(self.proc.stdin, msg)
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerUnavailable(f"Notion worker not reachable: {e}")
+
+        try:
+            reply = self.replies.get(timeout=timeout)
+        except queue.Empty:
+            self.close()
+            raise NotionJobError(f"Notion job timed out after {timeout:.0f}s")
+
+        if reply is None:
+            # died mid-job: the job may have partly run, do not retry it
+            raise NotionJobError("Notion worker exited during the job")
+        return reply
+
+    def close(self):
+        if self.alive():
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=2)
+            except Exception:
+                self.proc.kill()
+
+
+class NotionWorkerPool:
+    """
+    Up to `size` warm worker processes; a job takes an idle one (or
+    starts one), dead workers are replaced on the next job.
+    """
+
+    def __init__(self, env: dict, size: int = NOTION_WORKERS):
+        self.env = env
+        self.size = max(int(size), 1)
+        self._idle: queue.Queue = queue.Queue()
+        self._started = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _checkout(self) -> _Worker:
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    start = self._started < self.size
+                    if start:
+                        self._started += 1
+                if start:
+                    try:
+                        return _Worker(self.env)
+                    except OSError as e:
+                        with self._lock:
+                            self._started -= 1
+                        raise WorkerUnavailable(f"Notion worker failed to start: {e}")
+                try:
+                    worker = self._idle.get(timeout=1)
+                except queue.Empty:
+                    continue    # re-check: a dead worker frees its slot
+
+            if worker.alive():
+                return worker
+            with self._lock:
+                self._started -= 1
+
+    def _checkin(self, worker: _Worker) -> None:
+        if worker.alive():
+            self._idle.put(worker)
+        else:
+            with self._lock:
+                self._started -= 1
+
+    def submit(self, job: str, payload: dict, *, timeout: float = NOTION_WORKER_TIMEOUT) -> Any:
+        """Run one job; returns its result or raises NotionJobError / WorkerUnavailable."""
+        worker = self._checkout()
+        try:
+            reply = worker.request({"id": next(self._ids), "job": job, "payload": payload}, timeout)
+        finally:
+            self._checkin(worker)
+
+        if not reply.get("ok"):
+            raise NotionJobError(reply.get("error") or "Notion job failed")
+        return reply.get("result")
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pool: NotionWorkerPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(env: dict) -> NotionWorkerPool:
+    """Process-wide pool (survives Streamlit reruns); env is used on first call."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = NotionWorkerPool(env)
+                atexit.register(_pool.close)
+    return _pool
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,11 +1,172 @@
 
 import os
-from notion_client import Client
+import copy
+import threading
+import time
+from collections import OrderedDict
 from notion_client.helpers import get_id
 import streamlit as st
 
+from notion.notion_engine import PacedClient, run_notion
+
 NOTION_TOKEN = st.secrets["notion"]["NOTION_TOKEN"]
-notion = Client(auth=NOTION_TOKEN)
+notion = PacedClient(auth=NOTION_TOKEN)
+
+
+
+
+# ----------------------------------------------------------------------
+# pages.retrieve / databases.retrieve cache
+# ----------------------------------------------------------------------
+# Page(url) / Database(url) retrieve on every construction, and the same
+# Fab / Measurement databases are opened on every save. Results are kept
+# per object id with a TTL (database schemas almost never change, pages
+# do) and LRU eviction. Our own writes refresh the entry from the write
+# response (remember_*).
+
+NOTION_PAGE_TTL = float(os.environ.get("NOTION_PAGE_TTL", "60"))
+NOTION_DATABASE_TTL = float(os.environ.get("NOTION_DATABASE_TTL", "3600"))
+NOTION_CACHE_SIZE = int(os.environ.get("NOTION_CACHE_SIZE", "256"))
+
+
+class TTLCache:
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = max(int(maxsize), 1)
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            if hit[0] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return hit[1]
+
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+
+
+_page_cache = TTLCache(NOTION_PAGE_TTL, NOTION_CACHE_SIZE)
+_database_cache = TTLCache(NOTION_DATABASE_TTL, NOTION_CACHE_SIZE)
+
+
+def _cache_key(object_id: str) -> str:
+    return (object_id or "").replace("-", "").lower()
+
+
+
+
+def _remember(cache: TTLCache, raw: dict):
+    # keep whichever copy is newer (last_edited_time is ISO-8601, sortable)
+    if not isinstance(raw, dict) or not raw.get("id"):
+        return
+    key = _cache_key(raw["id"])
+    cached = cache.get(key)
+    if cached is not None and (cached.get("last_edited_time") or "") > (raw.get("last_edited_time") or ""):
+        return
+    cache.put(key, copy.deepcopy(raw))
+
+
+def remember_page(raw: dict):
+    """Cache a page object from any response (create / update / query)."""
+    _remember(_page_cache, raw)
+
+
+def remember_database(raw: dict):
+    """Cache a database object from any response (create / update)."""
+    _remember(_database_cache, raw)
+
+
+
+
+def _retrieve(cache: TTLCache, endpoint, object_id: str, last_edited_time: str | None) -> dict:
+    key = _cache_key(object_id)
+    cached = cache.get(key)
+    # a caller that saw a newer last_edited_time (e.g. in a query result)
+    # forces a refetch
+    if cached is not None and (last_edited_time is None or cached.get("last_edited_time") == last_edited_time):
+        return copy.deepcopy(cached)
+
+    raw = endpoint(object_id)
+    cache.put(key, copy.deepcopy(raw))
+    return raw
+
+
+def cached_database(database_id: str) -> dict | None:
+    """Cached databases.retrieve result (a private copy), or None."""
+    cached = _database_cache.get(_cache_key(database_id))
+    return copy.deepcopy(cached) if cached is not None else None
+
+
+def retrieve_page(page_id: str, last_edited_time: str | None = None) -> dict:
+    """notion.pages.retrieve through the cache (a private copy)."""
+    return _retrieve(_page_cache, lambda i: notion.pages.retrieve(page_id = i), page_id, last_edited_time)
+
+
+def retrieve_database(database_id: str, last_edited_time: str | None = None) -> dict:
+    """notion.databases.retrieve through the cache (a private copy)."""
+    return _retrieve(_database_cache, lambda i: notion.databases.retrieve(database_id = i), database_id, last_edited_time)
+
+
+
+
+def _update_page(**kwargs) -> dict:
+    result = notion.pages.update(**kwargs)
+    remember_page(result)
+    return result
+
+
+def _update_database(**kwargs) -> dict:
+    result = notion.databases.update(**kwargs)
+    remember_database(result)
+    return result
+
+
+def _create_page(**kwargs) -> dict:
+    result = notion.pages.create(**kwargs)
+    remember_page(result)
+    return result
+
+
+def iter_database_query(database_id: str, client = None, **query):
+    """
+    Every row of notion.databases.query (filter / sorts in query),
+    following next_cursor: 100 rows per request instead of the first page.
+    """
+    client = client or notion
+    cursor = None
+    while True:
+        kwargs = dict(query, database_id = database_id, page_size = 100)
+        if cursor:
+            kwargs["start_cursor"] = cursor
+        result = client.databases.query(**kwargs)
+
+        for row in result.get("results", []):
+            remember_page(row)
+            yield row
+
+        cursor = result.get("next_cursor")
+        if not result.get("has_more") or not cursor:
+            return
 
 
 color_list = [
@@ -35,186 +196,122 @@ def change_page_title(new_title: str, url: str):
     for v in properties_code.values():
         if 'title' in v:
             v['title'][0]['text']['content'] = new_title
-    notion.pages.update(page_id = get_parent_id(url), properties = properties_code)
+    return _update_page(page_id = get_parent_id(url), properties = properties_code)
 
 
 
 
 def change_database_title(new_title: str, url: str):
     title_code = [{'type': 'text', 'text': {'content': new_title, 'link': None}}]
-    notion.databases.update(database_id = get_parent_id(url), title = title_code)
+    _update_database(database_id = get_parent_id(url), title = title_code)
 
 
 
 
-def get_block_code(url: str):
-    block_req = []
-    children = notion.blocks.children.list(get_parent_id(url))['results']
-    # black_list = ['child_database', 'child_page', 'column_list', 'file', 'image', 'pdf']
-    black_list = ['child_database', 'child_page', 'file', 'image', 'pdf']
-    # nested_list = ['bulleted_list_item', 'numbered_list_item', 'to_do', 'toggle', 'table']
-    nested_list = ['bulleted_list_item', 'numbered_list_item', 'to_do', 'toggle', 'table', 'column_list']
-
-
-    for child in children:
-        if child['type'] in black_list:
-            print('{} copy is not supported with Python and try on Notion webpage'.format(child['type']))
-            content = child['type']
-            block_req.append({"paragraph": {"rich_text": [{"text": {"content": content + ' is not supported with Python and try on Notion webpage'},
-                "annotations": {"bold": False,"italic": True, "strikethrough": True, "underline": False, "code": False, "color": 'red',}}]}})
-
-
-        elif child['type'] == 'callout':
-            child[child['type']].pop('icon')
-            block_req.append({child['type']: child[child['type']]})
-
-
-        elif child['type'] in nested_list:
-            child_req = {child['type']: child[child['type']]}
-            grand_child_req = []
-            if child['has_children']:
-                grand_children = notion.blocks.children.list(child['id'])['results']
-                for grand_child in grand_children:
-                    grand_child_req.append({grand_child['type']: grand_child[grand_child['type']]})
-                
-                    child_req[child['type']].update({'children': grand_child_req})
-    
-                    grand_grand_child_req = []
-                    if grand_child['has_children']:
-                        grand_grand_children = notion.blocks.children.list(grand_child['id'])['results']
-                        for grand_grand_child in grand_grand_children:
-                            grand_grand_child_req.append({grand_grand_child['type']: grand_grand_child[grand_grand_child['type']]})
-        
-                        grand_child[grand_child['type']].update({'children': grand_grand_child_req})
-    
-    
-                        # grand_grand_grand_child_req = []
-                        # if grand_grand_child['has_children']:
-                        #     grand_grand_grand_children = notion.blocks.children.list(grand_grand_child['id'])['results']
-                        #     for grand_grand_grand_child in grand_grand_grand_children:
-                        #         grand_grand_grand_child_req.append({grand_grand_grand_child['type']: grand_grand_grand_child[grand_grand_grand_child['type']]})
-        
-                        #     grand_grand_child[grand_grand_child['type']].update({'children': grand_grand_grand_child_req})
-                                                    
-            else:
-                child_req = {child['type']: child[child['type']]}
-                    
-            block_req.append(child_req)
-        
-        else:
-            block_req.append({child['type']: child[child['type']]})
+# ----------------------------------------------------------------------
+# Block tree reader
+# ----------------------------------------------------------------------
+# One reader behind get_block_code / get_block_info / get_block_info_from_id:
+# every level is paginated (has_more / next_cursor), sibling subtrees are
+# fetched concurrently on the rate-limited engine, and there is no depth
+# cap. Each node is compact:
+#   {'id': ..., 'type': ..., 'value': block[type], 'children': [nodes]}
 
-    return block_req
+def _reads_children(block: dict) -> bool:
+    if not block.get('has_children'):
+        return False
+    # separate pages, never inlined
+    if block['type'] in ['child_page', 'child_database']:
+        return False
+    # a synced-block replica only points at the original
+    if block['type'] == 'synced_block' and block['synced_block'].get('synced_from'):
+        return False
+    return True
 
-        
 
 
-def get_block_info(url: str):
-    id_list = []
-    content_list = []
-    code_list = []
 
-    children = notion.blocks.children.list(get_parent_id(url))['results']
-    black_list = ['file', 'image', 'pdf', 'video']
-    black_list2 = ['child_database', 'child_page', 'link_preview', 'template']
-    nested_list = ['bulleted_list_item', 'numbered_list_item', 'to_do', 'toggle', 'table', 'column_list']
+async def _list_all_children(engine, block_id: str) -> list:
+    blocks = []
+    kwargs = {'block_id': block_id, 'page_size': 100}
+    while True:
+        res = await engine.call('blocks.children.list', **kwargs)
+        blocks += res['results']
+        if not res.get('has_more'):
+            return blocks
+        kwargs['start_cursor'] = res['next_cursor']
 
-    for i, child in enumerate(children):
-        child_name = 'child'+str(i)
-        id_list.append({child_name: child['id']})
 
-    
-    for i, child in enumerate(children):
 
-        if child['type'] in black_list:
 
-            child_name = 'child'+str(i)
-            content_list.append({child_name : child['type']})
+async def _read_tree(engine, block_id: str, depth: int, max_depth) -> list:
+    blocks = await _list_all_children(engine, block_id)
+    nodes = [{'id': b['id'], 'type': b['type'], 'value': b[b['type']], 'children': []} for b in blocks]
 
-            if child[child['type']]['type'] == "external":
-                code_list.append({child['type']: child[child['type']]})
+    if max_depth is None or depth < max_depth:
+        deeper = [i for i, b in enumerate(blocks) if _reads_children(b)]
+        subtrees = await engine.gather(*(_read_tree(engine, blocks[i]['id'], depth + 1, max_depth) for i in deeper))
+        for i, subtree in zip(deeper, subtrees):
+            nodes[i]['children'] = subtree
 
-            else:
-                print('The copy of {} with upload is not supported with Python and try on Notion webpage'.format(child['type']))
-                code_list.append({"paragraph": {"rich_text": [{"text": {"content": 'The copy of ' + child['type'] + ' with upload is not supported with Python and try on Notion webpage'},
-                    "annotations": {"bold": False,"italic": True, "strikethrough": True, "underline": False, "code": False, "color": 'red',}}]}})
+    return nodes
 
 
-        elif child['type'] in black_list2:
 
-            child_name = 'child'+str(i)
-            content_list.append({child_name : child['type']})
 
-            print('The copy of {} is not supported with Python and try on Notion webpage'.format(child['type']))
-            code_list.append({"paragraph": {"rich_text": [{"text": {"content": "The copy of " + child['type'] + ' is not supported with Python and try on Notion webpage'},
-                "annotations": {"bold": False,"italic": True, "strikethrough": True, "underline": False, "code": False, "color": 'red',}}]}})     
+def read_block_tree(block_id: str, max_depth: int | None = None) -> list:
+    """Children of block_id as a list of nodes, all levels (or max_depth)."""
+    return run_notion(NOTION_TOKEN, lambda engine: _read_tree(engine, block_id, 1, max_depth))
 
 
-        elif child['type'] == 'callout':
-            child[child['type']].pop('icon')
-            
-            child_name = 'child'+str(i)
-            content_list.append({child_name : child['type']})
-            
-            code_list.append({child['type']: child[child['type']]})
-            # content_list.append({child['type']: child[child['type']]})
 
 
-        elif child['type'] == 'paragraph':
-            code_list.append({child['type']: child[child['type']]})
-            child_name = 'child'+str(i)
+def _unsupported_code(text: str) -> dict:
+    return {"paragraph": {"rich_text": [{"text": {"content": text},
+        "annotations": {"bold": False,"italic": True, "strikethrough": True, "underline": False, "code": False, "color": 'red',}}]}}
 
-            try:
-                content = child[child['type']]['rich_text'][0]['type']
-            except:
-                content = 'space'
 
-            content_list.append({child_name : content})
 
 
-        elif child['type'] in nested_list:
-            child_req = {child['type']: child[child['type']]}
-            
-            child_name = 'child'+str(i)
-            content_list.append({child_name : child['type']})
-            
-            grand_child_req = []
-            if child['has_children']:
-                grand_children = notion.blocks.children.list(child['id'])['results']
-                for grand_child in grand_children:
-                    grand_child_req.append({grand_child['type']: grand_child[grand_child['type']]})
-                
-                    child_req[child['type']].update({'children': grand_child_req})
-    
-                    grand_grand_child_req = []
-                    if grand_child['has_children']:
-                        grand_grand_children = notion.blocks.children.list(grand_child['id'])['results']
-                        for grand_grand_child in grand_grand_children:
-                            grand_grand_child_req.append({grand_grand_child['type']: grand_grand_child[grand_grand_child['type']]})
-        
-                        grand_child[grand_child['type']].update({'children': grand_grand_child_req})
-    
-    
-                        # grand_grand_grand_child_req = []
-                        # if grand_grand_child['has_children']:
-                        #     grand_grand_grand_children = notion.blocks.children.list(grand_grand_child['id'])['results']
-                        #     for grand_grand_grand_child in grand_grand_grand_children:
-                        #         grand_grand_grand_child_req.append({grand_grand_grand_child['type']: grand_grand_grand_child[grand_grand_grand_child['type']]})
-        
-                        #     grand_grand_child[grand_grand_child['type']].update({'children': grand_grand_grand_child_req})
-                                                    
-            else:
-                child_req = {child['type']: child[child['type']]}
-                    
-            code_list.append(child_req)
-        
-        else:
-            code_list.append({child['type']: child[child['type']]})
+def _node_code(node: dict, strict: bool = False) -> dict:
+    """
+    Append code for a node and its subtree. strict=True is get_block_code's
+    rule (no files / images at all); otherwise external files are kept.
+    """
+    btype = node['type']
+    value = node['value']
+
+    if strict and btype in ['child_database', 'child_page', 'file', 'image', 'pdf']:
+        print('{} copy is not supported with Python and try on Notion webpage'.format(btype))
+        return _unsupported_code(btype + ' is not supported with Python and try on Notion webpage')
+
+    if not strict and btype in ['file', 'image', 'pdf', 'video'] and value.get('type') != "external":
+        print('The copy of {} with upload is not supported with Python and try on Notion webpage'.format(btype))
+        return _unsupported_code('The copy of ' + btype + ' with upload is not supported with Python and try on Notion webpage')
+
+    if not strict and btype in ['child_database', 'child_page', 'link_preview', 'template']:
+        print('The copy of {} is not supported with Python and try on Notion webpage'.format(btype))
+        return _unsupported_code("The copy of " + btype + ' is not supported with Python and try on Notion webpage')
+
+    if btype == 'callout':
+        value.pop('icon', None)
+
+    if node['children']:
+        value['children'] = [_node_code(child, strict) for child in node['children']]
+
+    return {btype: value}
+
 
-            child_name = 'child'+str(i)
-            content_list.append({child_name : child['type']})
 
-    return id_list, content_list, code_list
+
+def get_block_code(url: str):
+    return [_node_code(node, strict=True) for node in read_block_tree(get_parent_id(url))]
+
+
+
+
+def get_block_info(url: str):
+    return get_block_info_from_id(get_parent_id(url))
 
 
 
@@ -224,114 +321,118 @@ def get_block_info_from_id(id: str):
     content_list = []
     code_list = []
 
-    children = notion.blocks.children.list(id)['results']
-    black_list = ['file', 'image', 'pdf', 'video']
-    black_list2 = ['child_database', 'child_page', 'link_preview', 'template']
-    nested_list = ['bulleted_list_item', 'numbered_list_item', 'to_do', 'toggle', 'table', 'column_list']
-
-    for i, child in enumerate(children):
+    for i, node in enumerate(read_block_tree(id)):
         child_name = 'child'+str(i)
-        id_list.append({child_name: child['id']})
+        id_list.append({child_name: node['id']})
 
-    
-    for i, child in enumerate(children):
+        content = node['type']
+        if node['type'] == 'paragraph':
+            try:
+                content = node['value']['rich_text'][0]['type']
+            except:
+                content = 'space'
+        content_list.append({child_name: content})
 
-        if child['type'] in black_list:
+        code_list.append(_node_code(node))
 
-            child_name = 'child'+str(i)
-            content_list.append({child_name : child['type']})
+    return id_list, content_list, code_list
 
-            if child[child['type']]['type'] == "external":
-                code_list.append({child['type']: child[child['type']]})
 
-            else:
-                print('The copy of {} with upload is not supported with Python and try on Notion webpage'.format(child['type']))
-                code_list.append({"paragraph": {"rich_text": [{"text": {"content": 'The copy of ' + child['type'] + ' with upload is not supported with Python and try on Notion webpage'},
-                    "annotations": {"bold": False,"italic": True, "strikethrough": True, "underline": False, "code": False, "color": 'red',}}]}})
 
 
-        elif child['type'] in black_list2:
+# ----------------------------------------------------------------------
+# Block tree writer
+# ----------------------------------------------------------------------
+# blocks.children.append takes at most 100 blocks per children array and
+# two nesting levels below the appended blocks per request.
+# append_block_tree sends what fits and appends the rest under the ids
+# the API returns, so a tree read above can be written back whole.
 
-            child_name = 'child'+str(i)
-            content_list.append({child_name : child['type']})
+MAX_APPEND_CHILDREN = 100
+MAX_APPEND_DEPTH = 3        # the appended blocks + two nesting levels
 
-            print('The copy of {} is not supported with Python and try on Notion webpage'.format(child['type']))
-            code_list.append({"paragraph": {"rich_text": [{"text": {"content": "The copy of " + child['type'] + ' is not supported with Python and try on Notion webpage'},
-                "annotations": {"bold": False,"italic": True, "strikethrough": True, "underline": False, "code": False, "color": 'red',}}]}})     
 
+def _block_type(code: dict) -> str:
+    return code.get('type') or next(k for k in code if k != 'object')
 
-        elif child['type'] == 'callout':
-            child[child['type']].pop('icon')
-            
-            child_name = 'child'+str(i)
-            content_list.append({child_name : child['type']})
-            
-            code_list.append({child['type']: child[child['type']]})
-            # content_list.append({child['type']: child[child['type']]})
 
+def _pop_children(code: dict) -> list:
+    return code[_block_type(code)].pop('children', None) or []
 
-        elif child['type'] == 'paragraph':
-            code_list.append({child['type']: child[child['type']]})
-            child_name = 'child'+str(i)
 
-            try:
-                content = child[child['type']]['rich_text'][0]['type']
-            except:
-                content = 'space'
+def _fit_request(blocks: list, depth: int, path: tuple, later: list):
+    """
+    Cut blocks (at depth, 1 = appended blocks) down to one request, in
+    place. What is cut goes to later as (path, blocks): path is the
+    child indexes of the parent block, () for block_id itself.
+    """
+    for i, code in enumerate(blocks):
+        # a column_list is created with its columns and their children:
+        # below the top level it cannot fit, so it and the siblings after
+        # it (to keep their order) go into their own request
+        if depth > 1 and _block_type(code) == 'column_list':
+            later.append((path, blocks[i:]))
+            del blocks[i:]
+            return
 
-            content_list.append({child_name : content})
+        kids = _pop_children(code)
+        if not kids:
+            continue
+        if depth == MAX_APPEND_DEPTH:
+            later.append((path + (i,), kids))
+            continue
 
+        head, rest = kids[:MAX_APPEND_CHILDREN], kids[MAX_APPEND_CHILDREN:]
+        _fit_request(head, depth + 1, path + (i,), later)
+        if head:
+            code[_block_type(code)]['children'] = head
+        if rest:
+            later.append((path + (i,), rest))
 
-        elif child['type'] in nested_list:
-            child_req = {child['type']: child[child['type']]}
-            
-            child_name = 'child'+str(i)
-            content_list.append({child_name : child['type']})
-            
-            grand_child_req = []
-            if child['has_children']:
-                grand_children = notion.blocks.children.list(child['id'])['results']
-                for grand_child in grand_children:
-                    grand_child_req.append({grand_child['type']: grand_child[grand_child['type']]})
-                
-                    child_req[child['type']].update({'children': grand_child_req})
-    
-                    grand_grand_child_req = []
-                    if grand_child['has_children']:
-                        grand_grand_children = notion.blocks.children.list(grand_child['id'])['results']
-                        for grand_grand_child in grand_grand_children:
-                            grand_grand_child_req.append({grand_grand_child['type']: grand_grand_child[grand_grand_child['type']]})
-        
-                        grand_child[grand_child['type']].update({'children': grand_grand_child_req})
-    
-    
-                        # grand_grand_grand_child_req = []
-                        # if grand_grand_child['has_children']:
-                        #     grand_grand_grand_children = notion.blocks.children.list(grand_grand_child['id'])['results']
-                        #     for grand_grand_grand_child in grand_grand_grand_children:
-                        #         grand_grand_grand_child_req.append({grand_grand_grand_child['type']: grand_grand_grand_child[grand_grand_grand_child['type']]})
-        
-                        #     grand_grand_child[grand_grand_child['type']].update({'children': grand_grand_grand_child_req})
-                                                    
-            else:
-                child_req = {child['type']: child[child['type']]}
-                    
-            code_list.append(child_req)
-        
-        else:
-            code_list.append({child['type']: child[child['type']]})
 
-            child_name = 'child'+str(i)
-            content_list.append({child_name : child['type']})
+def append_block_tree(block_id: str, code_list: list) -> list:
+    """Append code_list (any size / depth) under block_id; top-level results."""
+    results = []
 
-    return id_list, content_list, code_list
+    for start in range(0, len(code_list), MAX_APPEND_CHILDREN):
+        chunk = copy.deepcopy(code_list[start:start + MAX_APPEND_CHILDREN])
+        later = []
+        _fit_request(chunk, 1, (), later)
+
+        response = notion.blocks.children.append(block_id = block_id, children = chunk)['results']
+        results += response
+
+        # nested ids are not in the append response: list once per parent
+        listed = {}
+
+        def block_at(path):
+            if not path:
+                return block_id
+            if len(path) == 1:
+                return response[path[0]]['id']
+            parent_id = block_at(path[:-1])
+            if parent_id not in listed:
+                listed[parent_id] = notion.blocks.children.list(block_id = parent_id, page_size = 100)['results']
+            return listed[parent_id][path[-1]]['id']
+
+        for path, kids in later:
+            append_block_tree(block_at(path), kids)
+
+    return results
 
 
 
 
 def get_database_info(url: str)-> dict:
     database_id = get_parent_id(url)
-    raw_info = notion.databases.retrieve(database_id = database_id)
+    raw_info = retrieve_database(database_id)
+    return parse_database_info(raw_info)
+
+
+
+
+def parse_database_info(raw_info: dict)-> dict:
+    # databases.retrieve response -> info dict (no API call)
     info = {}
     properties = []
     properties_code = raw_info['properties']
@@ -498,7 +599,14 @@ def get_header_code(header_list: list) -> dict:
 
 def get_page_info(url: str)-> dict:
     page_id = get_parent_id(url)
-    raw_info = notion.pages.retrieve(page_id)
+    raw_info = retrieve_page(page_id)
+    return parse_page_info(raw_info)
+
+
+
+
+def parse_page_info(raw_info: dict)-> dict:
+    # pages.retrieve / create / update response -> info dict (no API call)
     info = {}
     properties = {}
 
@@ -793,7 +901,7 @@ def get_properties_code_without_id(properties_code: dict):
 
 def get_properties_from_id(page_id: str, copy = False) -> tuple:
 
-    prop_code = notion.pages.retrieve(page_id)['properties']
+    prop_code = retrieve_page(page_id)['properties']
     prop = {}
 
     for k, v in prop_code.items():
@@ -846,6 +954,9 @@ def get_properties_from_id(page_id: str, copy = False) -> tuple:
 
 class Page():
 
+    # linked pages load these from Notion on first access
+    _lazy = ('name', 'icon', 'properties', 'properties_code')
+
 
     def __init__(self, name: str = "", url: str = ""):
         self.name = name
@@ -858,24 +969,40 @@ class Page():
         self.linked = False
 
         if self.url != "":
+            # id comes from the URL; no request until a property is read
             self.id = get_parent_id(self.url) 
             self.linked = True  
+            for attr in self._lazy:
+                del self.__dict__[attr]
+
+
+
+
+    def __getattr__(self, attr):
+        if attr in Page._lazy and self.__dict__.get('linked'):
+            self.load(get_page_info(self.__dict__['url']))
+            return self.__dict__[attr]
+        raise AttributeError(attr)
+
+
+
 
-            source_pg_info = get_page_info(self.url)
-            self.properties = source_pg_info['properties']
-            self.properties_code = source_pg_info['properties_code']
-            self.icon = source_pg_info['icon']
+    def load(self, source_pg_info: dict):
+        """Fill name / icon / properties from a page info dict (parse_page_info)."""
+        self.properties = source_pg_info['properties']
+        self.properties_code = source_pg_info['properties_code']
+        self.icon = source_pg_info['icon']
             
-            # Page is NOT database page
-            if source_pg_info['parent'] in  ['workspace', 'page_id']:
-                try:
-                    self.name = source_pg_info['properties']['title']
-                except:
-                    self.name = ""
+        # Page is NOT database page
+        if source_pg_info['parent'] in  ['workspace', 'page_id']:
+            try:
+                self.name = source_pg_info['properties']['title']
+            except:
+                self.name = ""
 
-            # page is database page
-            else:
-                self.name = source_pg_info['page_name']
+        # page is database page
+        else:
+            self.name = source_pg_info['page_name']
 
 
 
@@ -892,7 +1019,7 @@ class Page():
 
 
     def get_info(self) -> dict:
-        result = notion.pages.retrieve(page_id = self.id)
+        result = retrieve_page(self.id)
         return result
 
 
@@ -935,16 +1062,18 @@ class Page():
 
 
 
-        new_page = notion.pages.create(parent = {"page_id": self.id}, icon = icon, properties = properties_code)
+        new_page = _create_page(parent = {"page_id": self.id}, icon = icon, properties = properties_code)
         page.url = new_page['url']
         page.id = new_page['id']
 
-        new_pg_info = get_page_info(page.url)
-        # page.id = new_pg_info['id']
+        # the create response is the new page: no read-after-write
+        new_pg_info = parse_page_info(new_page)
         page.properties = new_pg_info['properties']
         page.properties_code = new_pg_info['properties_code']
         change_page_title(page.name, page.url)
 
+        return new_page
+
 
 
 
@@ -963,22 +1092,22 @@ class Page():
         properties_code = source_pg_info['properties_code']
         icon = source_pg_info['icon']
 
-        new_page = notion.pages.create(parent = {"page_id": self.id}, icon = icon, properties = properties_code)
+        new_page = _create_page(parent = {"page_id": self.id}, icon = icon, properties = properties_code)
 
         source_name = source_pg_info['page_name'] + " (copy)"
         if source_pg_info['page_name'] == "":
             source_name = "New page (copy)"
 
-        change_page_title(source_name, new_page['url'])
+        renamed = change_page_title(source_name, new_page['url'])
         
-        copy_pg_info = get_page_info(new_page['url'])
+        copy_pg_info = parse_page_info(renamed)
         copy_page.properties = copy_pg_info['properties']
         copy_page.properties_code = copy_pg_info['properties_code']
         copy_page.id = new_page['id']
         copy_page.url = new_page['url']
 
         content_copy = get_block_info(page.url)[2]
-        new_blocks = notion.blocks.children.append(block_id = copy_page.id, children = content_copy)
+        new_blocks = append_block_tree(copy_page.id, content_copy)
         
 
         return copy_page
@@ -1001,6 +1130,7 @@ class Page():
         db_properties_code = get_header_code(database.properties)
 
         new_db = notion.databases.create(parent = parent_page_id_code, title = db_title_code, properties = db_properties_code, icon = icon, is_inline = inline)
+        remember_database(new_db)
         database.id = new_db['id']
         database.url = new_db['url']
 
@@ -1034,7 +1164,7 @@ class Page():
         change_database_title(name, new_db.url)
 
         
-        db_pg_list = notion.databases.query(**{"database_id": database.id,})['results']
+        db_pg_list = list(iter_database_query(database.id))
 
         for i in reversed(range(len(db_pg_list))):
             db_pg_info = get_page_info(db_pg_list[i]['url'])
@@ -1052,11 +1182,11 @@ class Page():
 
 
             properties_code = db_pg_info['properties_code']
-            new_db_page = notion.pages.create(parent = {"database_id": new_db.id}, icon = icon, properties = properties_code)
+            new_db_page = _create_page(parent = {"database_id": new_db.id}, icon = icon, properties = properties_code)
 
             # copy page content
             content_copy = get_block_info(db_pg_list[i]['url'])[2]
-            new_blocks = notion.blocks.children.append(block_id = new_db_page['id'], children = content_copy)
+            new_blocks = append_block_tree(new_db_page['id'], content_copy)
 
 
         current_info = get_database_info(new_db.url)
@@ -1146,13 +1276,13 @@ class Page():
     def copy_content(self, page: object):
 
         content_copy = get_block_info(page.url)[2]
-        new_blocks = notion.blocks.children.append(block_id = self.id, children = content_copy)
+        new_blocks = append_block_tree(self.id, content_copy)
         
         block_copied = Block('block_copy')
         block_copied.code_list = content_copy
         # block_copied.id = new_blocks['results'][0]['id']
 
-        for nb in new_blocks['results']:
+        for nb in new_blocks:
             block_copied.id_list.append(nb["id"])
 
 
@@ -1196,7 +1326,7 @@ class Page():
 
     def update_icon(self, icon: str):
         icon_code = {"type": "emoji", "emoji": icon}
-        notion.pages.update(page_id = self.id, icon = icon_code, properties = {})
+        _update_page(page_id = self.id, icon = icon_code, properties = {})
         self.icon = icon_code
 
 
@@ -1205,6 +1335,10 @@ class Page():
 
 class Database:
 
+    # linked databases load these from Notion on first access
+    _lazy = ('icon', 'properties', 'properties_code')
+
+
     def __init__(self, name: str = "", url: str = ""):
         self.name = name
         self.url = url
@@ -1215,22 +1349,39 @@ class Database:
         self.linked = False
 
         if self.url != "":
+            # id comes from the URL; no request until a property is read
             self.id = get_parent_id(self.url)
             self.linked = True
+            for attr in self._lazy:
+                del self.__dict__[attr]
+
 
-            source_db_info = get_database_info(self.url)
-            self.properties = source_db_info['properties']
-            self.properties_code = source_db_info['properties_code']
 
-            if source_db_info['icon'] != None:
-                self.icon = source_db_info['icon']
+
+    def __getattr__(self, attr):
+        if attr in Database._lazy and self.__dict__.get('linked'):
+            self.load(get_database_info(self.__dict__['url']))
+            return self.__dict__[attr]
+        raise AttributeError(attr)
+
+
+
+
+    def load(self, source_db_info: dict):
+        """Fill icon / properties from a database info dict (parse_database_info)."""
+        self.properties = source_db_info['properties']
+        self.properties_code = source_db_info['properties_code']
+        self.icon = ""
+
+        if source_db_info['icon'] != None:
+            self.icon = source_db_info['icon']
 
 
 
 
     def get_info(self)-> dict:
 
-        result = notion.databases.retrieve(database_id = self.id)
+        result = retrieve_database(self.id)
 
         return result
 
@@ -1290,12 +1441,12 @@ class Database:
             if pg_info['parent'] == 'database_id':  # if it's database page
                 properties_code = pg_info['properties_code']
                 # new_page = notion.pages.create(parent = {"database_id": self.id}, icon = icon_code, properties = properties_code)
-                new_page = notion.pages.create(parent = {"database_id": self.id}, icon = icon, properties = properties_code)
+                new_page = _create_page(parent = {"database_id": self.id}, icon = icon, properties = properties_code)
 
 
                 # copy page content
                 content_copy = get_block_info(page.url)[2]
-                new_blocks = notion.blocks.children.append(block_id = new_page['id'], children = content_copy)
+                new_blocks = append_block_tree(new_page['id'], content_copy)
  
                 page.url = new_page['url']
 
@@ -1307,19 +1458,20 @@ class Database:
         else:
             if page.properties != {}: # database page type
                 properties_code = get_properties_code(self.properties, **page.properties)
-                new_page = notion.pages.create(parent = {"database_id": self.id}, icon = icon, properties = properties_code)
+                new_page = _create_page(parent = {"database_id": self.id}, icon = icon, properties = properties_code)
                 page.url = new_page['url']
 
             else:  # no database page type
                 print("This is not database page. Try with database page")
 
-        new_pg_info = get_page_info(new_page['url'])
+        # the create response is the new page: no read-after-write
+        new_pg_info = parse_page_info(new_page)
         page.id = new_pg_info['id']
         # page.url = new_pg_info['url']
         page.properties = new_pg_info['properties']
         page.properties_code = new_pg_info['properties_code']
 
-        # return page
+        return new_page
 
  
 
@@ -1340,9 +1492,9 @@ class Database:
 
             properties_code = source_pg_info['properties_code']
             properties = source_pg_info['properties']
-            new_page = notion.pages.create(parent = {"database_id": self.id}, icon = icon, properties = properties_code)
-            change_page_title(source_pg_info['page_name'] + " (copy)", new_page['url'])
-            new_page_info = get_page_info(new_page['url'])
+            new_page = _create_page(parent = {"database_id": self.id}, icon = icon, properties = properties_code)
+            renamed = change_page_title(source_pg_info['page_name'] + " (copy)", new_page['url'])
+            new_page_info = parse_page_info(renamed)
             new_db_page.properties = new_page_info['properties']
             new_db_page.properties_code = new_page_info['properties_code']
             new_db_page.id = new_page['id']
@@ -1350,7 +1502,7 @@ class Database:
 
             # copy page content
             content_copy = get_block_info(page.id)[2]
-            new_blocks = notion.blocks.children.append(block_id = new_page['id'], children = content_copy)
+            new_blocks = append_block_tree(new_page['id'], content_copy)
 
             return new_db_page
 
@@ -1368,22 +1520,27 @@ class Database:
         # if page.icon != "":
         #     icon_code = {'emoji': page.icon}
 
-        if page.icon != "":
-            icon = page.icon
-            notion.pages.update(page_id = page.id, icon = icon, properties = new_properties_code)
+        # a linked page's own icon (never loaded) need not be re-sent
+        icon = page.__dict__.get('icon', "")
+
+        if icon != "":
+            updated = _update_page(page_id = page.id, icon = icon, properties = new_properties_code)
         else:
-            notion.pages.update(page_id = page.id, properties = new_properties_code)
+            updated = _update_page(page_id = page.id, properties = new_properties_code)
 
-        source_pg_info = get_page_info(page.url)
+        # the update response is the page as saved: no read-after-write
+        source_pg_info = parse_page_info(updated)
         page.properties = source_pg_info['properties']
         page.properties_code = source_pg_info['properties_code']
 
+        return updated
+
 
 
     def update_icon(self, icon: str):
 
         icon_code = {"type": "emoji", "emoji": icon}
-        notion.databases.update(database_id = self.id, icon = icon_code)
+        _update_database(database_id = self.id, icon = icon_code)
         self.icon = icon_code
 
 
@@ -1391,7 +1548,7 @@ class Database:
     def update_page_icon(self, page: object, icon: str):
 
         icon_code = {"type": "emoji", "emoji": icon}
-        notion.pages.update(page_id = page.id, icon = icon_code, properties = {})
+        _update_page(page_id = page.id, icon = icon_code, properties = {})
 
 
 
@@ -0,0 +1,394 @@
+# services/attachments.py
+
+import datetime
+import hashlib
+import os
+import sys
+
+import requests
+
+from firebase_client import (
+    FirestoreConflict,
+    WriteBatch,
+    firestore_delete,
+    firestore_get,
+    firestore_iter,
+    firestore_run_query,
+    firestore_to_python,
+)
+from services.drive import (
+    delete_file_via_cleanroom_api,
+    file_sha256,
+    upload_file_via_cleanroom_api,
+    upload_files_via_cleanroom_api,
+)
+
+
+# ============================================================
+# CONTENT-ADDRESSED ATTACHMENT REGISTRY
+# ============================================================
+#
+# Collection "attachments", one document per (Drive folder, content):
+#   id (document) : "{sha256}_{folder_id}" ("{sha256}" when the folder is
+#                   unknown, e.g. backfilled entries)
+#   sha256, drive_id, url, name, size, mime_type, folder_id, created
+#   refs          : how many attachment slots (runs' design / fab
+#                   files) point at drive_id
+#
+# Before uploading, the file is hashed (chunk by chunk) and looked up:
+# the same bytes already in the same Drive folder are reused and only
+# the run metadata changes. Replacing / deleting an attachment releases
+# one reference; the Drive file is trashed with the last one. Drive
+# files that are not registered (uploaded before the registry) are
+# owned by one slot and trashed directly, as before.
+#
+# Entries are only ever created (exists=False precondition), never
+# overwritten: an upload that finds an entry already there (concurrent
+# upload, or a lookup that failed) takes a reference on it and trashes
+# its own copy, so a registered drive_id never loses its refs.
+#
+# Registry errors never block an upload: it then goes to Drive as usual.
+
+ATTACHMENTS = "attachments"
+REFS_RETRIES = 3
+DRIVE_DOWNLOAD_URL = "https://drive.google.com/uc?export=download&id={}"
+
+
+def attachment_id(sha256, folder_id=""):
+    return f"{sha256}_{folder_id}" if folder_id else sha256
+
+
+def _entry(doc):
+    entry = {k: firestore_to_python(v) for k, v in (doc.get("fields") or {}).items()}
+    entry["doc_id"] = doc["name"].split("/")[-1]
+    entry.setdefault("sha256", entry["doc_id"].split("_", 1)[0])
+    entry["update_time"] = doc.get("updateTime")
+    return entry
+
+
+def lookup_attachment(sha256, id_token, folder_id=""):
+    """Registry entry for this content in this folder, or None."""
+    doc = firestore_get(ATTACHMENTS, attachment_id(sha256, folder_id), id_token)
+    if "fields" not in doc:
+        return None
+    return _entry(doc)
+
+
+def find_attachment_by_drive_id(file_id, id_token):
+    query = {
+        "from": [{"collectionId": ATTACHMENTS}],
+        "where": {
+            "fieldFilter": {
+                "field": {"fieldPath": "drive_id"},
+                "op": "EQUAL",
+                "value": {"stringValue": file_id},
+            }
+        },
+        "limit": 1,
+    }
+    docs = firestore_run_query(query, id_token)
+    return _entry(docs[0]) if docs else None
+
+
+def _add_ref(entry, delta, id_token):
+    """
+    refs += delta, guarded by the entry's updateTime (re-read on a
+    concurrent change). Returns the updated entry, or None once the
+    entry is gone / released.
+    """
+    for _ in range(REFS_RETRIES):
+        refs = int(entry.get("refs") or 0)
+        if refs <= 0:
+            return None
+
+        batch = WriteBatch(id_token)
+        batch.update_field(ATTACHMENTS, entry["doc_id"], "refs", refs + delta, update_time=entry["update_time"])
+        try:
+            batch.commit()
+        except FirestoreConflict:
+            doc = firestore_get(ATTACHMENTS, entry["doc_id"], id_token)
+            if "fields" not in doc:
+                return None
+            entry = _entry(doc)
+            continue
+
+        entry["refs"] = refs + delta
+        entry["update_time"] = batch.update_times.get((ATTACHMENTS, entry["doc_id"]))
+        return entry
+
+    raise RuntimeError(f"attachment {entry['sha256'][:12]}: too many concurrent updates")
+
+
+def _create_entry(sha256, data, id_token, folder_id=""):
+    """Create the registry entry; FirestoreConflict if it already exists."""
+    batch = WriteBatch(id_token)
+    batch.set(ATTACHMENTS, attachment_id(sha256, folder_id), {
+        "sha256": sha256,
+        "folder_id": folder_id,
+        "created": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        **data,
+    }, exists=False)
+    batch.commit()
+
+
+def _register(sha256, out, *, size, folder_id, mime_type, id_token):
+    """
+    Register a fresh upload. Returns None when it now owns the entry, or
+    the existing entry (one more reference taken) when it lost the race.
+    """
+    for _ in range(REFS_RETRIES):
+        try:
+            _create_entry(sha256, {
+                "drive_id": out.get("id", ""),
+                "url": out.get("url", ""),
+                "name": out.get("name", ""),
+                "size": int(size),
+                "mime_type": mime_type,
+                "refs": 1,
+            }, id_token, folder_id)
+            return None
+        except FirestoreConflict:
+            entry = lookup_attachment(sha256, id_token, folder_id)
+            if entry is not None and entry.get("drive_id"):
+                entry = _add_ref(entry, +1, id_token)
+                if entry is not None:
+                    return entry
+            # released in between: try to create it again
+
+    raise RuntimeError(f"attachment {sha256[:12]}: too many concurrent updates")
+
+
+def _reuse(sha256, folder_id, id_token):
+    """Take one more reference on a registered copy in folder_id (None: upload)."""
+    try:
+        entry = lookup_attachment(sha256, id_token, folder_id)
+        if entry is None or not entry.get("drive_id"):
+            return None
+        return _add_ref(entry, +1, id_token)
+    except Exception as e:
+        print(f"⚠️ attachment registry lookup failed ({sha256[:12]}): {e}")
+        return None
+
+
+def _reused_reply(entry, filename):
+    return {
+        "success": True,
+        "id": entry["drive_id"],
+        "url": entry.get("url", ""),
+        "name": filename,
+        "sha256": entry["sha256"],
+        "deduplicated": True,
+    }
+
+
+def _after_upload(out, sha256, uploaded_file, folder_id, id_token, filename):
+    out = dict(out or {})
+    out["sha256"] = sha256
+    out["deduplicated"] = False
+    if out.get("success") and out.get("id"):
+        try:
+            existing = _register(
+                sha256,
+                out,
+                size=getattr(uploaded_file, "size", 0) or 0,
+                folder_id=folder_id,
+                mime_type=getattr(uploaded_file, "type", None) or "application/octet-stream",
+                id_token=id_token,
+            )
+        except Exception as e:
+            print(f"⚠️ attachment registry write failed ({sha256[:12]}): {e}")
+            return out
+
+        if existing is not None:
+            # same content registered meanwhile: use that copy, drop ours
+            dropped = delete_file_via_cleanroom_api(file_id=out["id"])
+            if not dropped.get("success", False):
+                print(f"⚠️ duplicate upload {out['id']} not trashed: {dropped.get('error')}")
+            return _reused_reply(existing, filename)
+    return out
+
+
+def upload_attachment(*, uploaded_file, filename, folder_id, id_token, on_progress=None):
+    """
+    upload_file_via_cleanroom_api with content dedup. Same reply, plus
+    "sha256" and "deduplicated" (True: no bytes were sent).
+    """
+    sha256 = file_sha256(uploaded_file)
+
+    entry = _reuse(sha256, folder_id, id_token)
+    if entry is not None:
+        if on_progress:
+            size = getattr(uploaded_file, "size", 0) or 0
+            on_progress(size, size)
+        return _reused_reply(entry, filename)
+
+    out = upload_file_via_cleanroom_api(
+        uploaded_file=uploaded_file,
+        filename=filename,
+        folder_id=folder_id,
+        on_progress=on_progress,
+        sha256=sha256,
+    )
+    return _after_upload(out, sha256, uploaded_file, folder_id, id_token, filename)
+
+
+def upload_attachments(*, files, folder_id, id_token, on_progress=None):
+    """
+    upload_files_via_cleanroom_api with content dedup: registered files
+    and repeats within the batch are not sent again.
+    """
+    replies = [None] * len(files)
+    hashes = [file_sha256(f) for f, _ in files]
+
+    first = {}         # sha256 -> index uploaded in this batch
+    to_upload = []
+    for i, ((uploaded_file, filename), sha256) in enumerate(zip(files, hashes)):
+        if sha256 in first:
+            continue
+        entry = _reuse(sha256, folder_id, id_token)
+        if entry is not None:
+            replies[i] = _reused_reply(entry, filename)
+            if on_progress:
+                size = getattr(uploaded_file, "size", 0) or 0
+                on_progress(i, size, size)
+            continue
+        first[sha256] = i
+        to_upload.append(i)
+
+    outs = upload_files_via_cleanroom_api(
+        files=[(files[i][0], files[i][1], hashes[i]) for i in to_upload],
+        folder_id=folder_id,
+        on_progress=(lambda j, sent, total: on_progress(to_upload[j], sent, total)) if on_progress else None,
+    )
+    for i, out in zip(to_upload, outs):
+        replies[i] = _after_upload(out, hashes[i], files[i][0], folder_id, id_token, files[i][1])
+
+    # repeats of a file uploaded above
+    for i, sha256 in enumerate(hashes):
+        if replies[i] is None:
+            entry = _reuse(sha256, folder_id, id_token)
+            if entry is not None:
+                replies[i] = _reused_reply(entry, files[i][1])
+            else:
+                replies[i] = {"success": False, "error": f"same content as {files[first[sha256]][1]} (not registered)"}
+            if on_progress:
+                size = getattr(files[i][0], "size", 0) or 0
+                on_progress(i, size, size)
+
+    return replies
+
+
+def release_attachment(*, file_id, id_token):
+    """
+    Drop one reference to a Drive file (replace / delete). Trashes it
+    with the last reference, or right away if it is not registered.
+    Same reply shape as delete_file_via_cleanroom_api.
+    """
+    try:
+        entry = find_attachment_by_drive_id(file_id, id_token)
+    except Exception as e:
+        # unknown sharing: keeping a file is safer than trashing a shared one
+        return {"success": False, "error": f"attachment registry unavailable: {e}"}
+
+    if entry is not None:
+        entry = _add_ref(entry, -1, id_token)
+        if entry is not None and int(entry.get("refs") or 0) > 0:
+            return {"success": True, "kept": True, "refs": entry["refs"]}
+        if entry is not None:
+            firestore_delete(ATTACHMENTS, entry["doc_id"], id_token)
+
+    return delete_file_via_cleanroom_api(file_id=file_id)
+
+
+# ============================================================
+# BACKFILL (attachments uploaded before the registry)
+# ============================================================
+
+def run_attachment_ids(metadata):
+    """Drive ids referenced by a run's design / fab metadata."""
+    ids = []
+    for section in ("design", "fab"):
+        for item in (metadata or {}).get(section) or []:
+            if not isinstance(item, dict):
+                continue
+            key = (item.get("key") or "").strip()
+            value = str(item.get("value") or "").strip()
+            if value and (key in ("FileId", "Filed") or key.startswith("FileId_")):
+                ids.append(value)
+    return ids
+
+
+def _drive_sha256(file_id):
+    h = hashlib.sha256()
+    size = 0
+    with requests.get(DRIVE_DOWNLOAD_URL.format(file_id), stream=True, timeout=60) as r:
+        r.raise_for_status()
+        if r.headers.get("Content-Type", "").startswith("text/html"):
+            raise RuntimeError("Drive answered with a page (not shared, or too large to download directly)")
+        for chunk in r.iter_content(1024 * 1024):
+            h.update(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
+
+def backfill_attachment_hashes(id_token, *, dry_run=False):
+    """
+    Hash every Drive file referenced by a run and register it. refs is
+    the number of references found. Contents already registered (or a
+    second Drive copy of them) are left alone. Returns (registered, failed).
+    """
+    refs = {}
+    for doc in firestore_iter("runs", id_token, field_paths=["metadata.design", "metadata.fab"]):
+        metadata = firestore_to_python(doc.get("fields", {}).get("metadata", {})) or {}
+        for file_id in run_attachment_ids(metadata):
+            refs[file_id] = refs.get(file_id, 0) + 1
+
+    registered, failed = 0, 0
+    seen = set()
+    for file_id, n in refs.items():
+        if find_attachment_by_drive_id(file_id, id_token) is not None:
+            continue
+        try:
+            sha256, size = _drive_sha256(file_id)
+        except Exception as e:
+            print(f"{file_id}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+
+        # folder unknown: entries keyed by content only (never reused for
+        # uploads, but their refs protect shared Drive files on release)
+        if sha256 in seen or lookup_attachment(sha256, id_token) is not None:
+            continue
+        seen.add(sha256)
+        registered += 1
+        if dry_run:
+            continue
+
+        try:
+            _create_entry(sha256, {
+                "drive_id": file_id,
+                "url": DRIVE_DOWNLOAD_URL.format(file_id),
+                "name": "",
+                "size": size,
+                "mime_type": "",
+                "refs": n,
+            }, id_token)
+        except FirestoreConflict:
+            registered -= 1
+
+    return registered, failed
+
+
+def main():
+    id_token = os.environ.get("FIREBASE_ID_TOKEN", "").strip()
+    if not id_token:
+        print("FIREBASE_ID_TOKEN env var missing", file=sys.stderr)
+        sys.exit(2)
+
+    dry_run = "--dry-run" in sys.argv[1:]
+    registered, failed = backfill_attachment_hashes(id_token, dry_run=dry_run)
+    print(f"{registered} attachment(s) {'to register' if dry_run else 'registered'}, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,224 @@
-
-import json
-import streamlit as st
 import base64
+import hashlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+import streamlit as st
+
+
+# ============================================================
+# DRIVE UPLOADS (cleanroom Apps Script web app)
+# ============================================================
+#
+# Small files go up in one request, as before:
+#   {"drive_upload": true, folder_id, filename, mime_type, file_base64}
+#
+# Files larger than DRIVE_CHUNK_SIZE use the chunked protocol, so no
+# request holds more than one chunk (base64) and a failed chunk is
+# retried on its own:
+#   {"drive_upload_start": true, folder_id, filename, mime_type,
+#    size, sha256, chunks}               -> {"success", "upload_id",
+#                                            "received": [index, ...]}
+#   {"drive_upload_chunk": true, upload_id, index, chunk_base64}
+#                                        -> {"success"}
+#   {"drive_upload_finish": true, upload_id}
+#                                        -> same reply as drive_upload
+#
+# Chunks are idempotent by index. "received" lists the chunks the
+# endpoint already holds for the same folder + sha256 (an earlier,
+# interrupted upload), which are skipped. An endpoint that does not
+# answer drive_upload_start with a successful JSON reply carrying an
+# upload_id (older script: error page, 4xx, success false) gets the
+# single request. drive_upload_finish is only retried when it cannot
+# have been handled (connect timeout, 429).
+#
+# CLEANROOM_WEBAPP_URL overrides the secrets URL, e.g. to point at the
+# local stand-in (python -m services.drive_local).
+
+DRIVE_CHUNK_SIZE = int(os.environ.get("DRIVE_CHUNK_SIZE", str(4 * 1024 * 1024)))   # raw bytes
+DRIVE_UPLOAD_WORKERS = int(os.environ.get("DRIVE_UPLOAD_WORKERS", "3"))
+DRIVE_TIMEOUT = 60
+DRIVE_CHUNK_RETRIES = 4
+DRIVE_BACKOFF = 1.0
+
+_local = threading.local()
+
+
+def _webapp_url():
+    return os.environ.get("CLEANROOM_WEBAPP_URL") or st.secrets["app"]["cleanroom_logger_webapp_url"]
+
+
+def _http():
+    # one keep-alive session per thread (uploads run on a pool)
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _post(url, payload, *, retries=0, repeatable=True):
+    """
+    POST JSON; network errors, 429 and 5xx are retried with backoff.
+    Not repeatable: only a connect timeout or a 429 (the request was not
+    handled) is retried, as a lost reply may follow a completed request.
+    """
+    for attempt in range(retries + 1):
+        try:
+            r = _http().post(url, json=payload, timeout=DRIVE_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = RuntimeError(f"Upload failed: {e}")
+            if not repeatable and not isinstance(e, requests.ConnectTimeout):
+                raise error
+        else:
+            if r.status_code == 200:
+                try:
+                    return r.json()
+                except ValueError:
+                    raise RuntimeError(f"Invalid JSON response: {r.text[:2000]}")
+            error = RuntimeError(f"Upload failed: HTTP {r.status_code}: {r.text[:2000]}")
+            if r.status_code != 429 and (r.status_code < 500 or not repeatable):
+                raise error
+
+        if attempt < retries:
+            time.sleep(DRIVE_BACKOFF * (2 ** attempt))
+    raise error
+
+
+def _size(uploaded_file):
+    size = getattr(uploaded_file, "size", None)
+    if size is None:
+        uploaded_file.seek(0, os.SEEK_END)
+        size = uploaded_file.tell()
+    return size
 
 
-def upload_file_via_cleanroom_api(*, uploaded_file, filename: str, folder_id: str):
-    url = st.secrets["app"]["cleanroom_logger_webapp_url"]
+def _chunks(uploaded_file):
+    uploaded_file.seek(0)
+    while True:
+        chunk = uploaded_file.read(DRIVE_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
 
-    file_bytes = uploaded_file.getvalue()
+
+def file_sha256(uploaded_file):
+    """Hex sha256 of an uploaded file, read chunk by chunk."""
+    h = hashlib.sha256()
+    for chunk in _chunks(uploaded_file):
+        h.update(chunk)
+    uploaded_file.seek(0)
+    return h.hexdigest()
+
+
+def _upload_single(url, uploaded_file, filename, folder_id, mime_type):
+    uploaded_file.seek(0)
     payload = {
         "drive_upload": True,
         "folder_id": folder_id,
         "filename": filename,
-        "mime_type": uploaded_file.type or "application/octet-stream",
-        "file_base64": base64.b64encode(file_bytes).decode(),
+        "mime_type": mime_type,
+        "file_base64": base64.b64encode(uploaded_file.read()).decode(),
     }
+    return _post(url, payload)
 
-    r = requests.post(
-        url,
-        json=payload,
-        timeout=60,
-    )
 
-    # Debug (you already saw this working)
-    st.write("STATUS:", r.status_code)
-    st.write("TEXT:", r.text)
+def upload_file_via_cleanroom_api(*, uploaded_file, filename: str, folder_id: str, on_progress=None, sha256=None):
+    """
+    Upload one file to the Drive folder; returns the endpoint's reply
+    ({"success", "id", "url", "name"}). on_progress(sent_bytes, total_bytes)
+    is called after each chunk; sha256 saves hashing a file twice.
+    """
+    url = _webapp_url()
+    mime_type = getattr(uploaded_file, "type", None) or "application/octet-stream"
+    total = _size(uploaded_file)
 
-    if r.status_code != 200:
-        raise RuntimeError(f"Upload failed: {r.text}")
+    if total > DRIVE_CHUNK_SIZE:
+        n_chunks = -(-total // DRIVE_CHUNK_SIZE)
+        try:
+            start = _post(url, {
+                "drive_upload_start": True,
+                "folder_id": folder_id,
+                "filename": filename,
+                "mime_type": mime_type,
+                "size": total,
+                "sha256": sha256 or file_sha256(uploaded_file),
+                "chunks": n_chunks,
+            }, retries=DRIVE_CHUNK_RETRIES)
+        except RuntimeError:
+            start = None    # not JSON, 4xx, unreachable: the single request decides
+
+        ok = isinstance(start, dict) and start.get("success")
+        upload_id = start.get("upload_id") if ok else None
+        if upload_id:
+            received = set(start.get("received") or [])
+            sent = 0
+            for index, chunk in enumerate(_chunks(uploaded_file)):
+                if index not in received:
+                    out = _post(url, {
+                        "drive_upload_chunk": True,
+                        "upload_id": upload_id,
+                        "index": index,
+                        "chunk_base64": base64.b64encode(chunk).decode(),
+                    }, retries=DRIVE_CHUNK_RETRIES)
+                    if not out.get("success", False):
+                        return out
+                sent += len(chunk)
+                if on_progress:
+                    on_progress(sent, total)
+
+            # finish creates the Drive file: not repeated after a lost reply
+            return _post(url, {"drive_upload_finish": True, "upload_id": upload_id},
+                         retries=DRIVE_CHUNK_RETRIES, repeatable=False)
+
+    out = _upload_single(url, uploaded_file, filename, folder_id, mime_type)
+    if on_progress:
+        on_progress(total, total)
+    return out
+
+
+def upload_files_via_cleanroom_api(*, files, folder_id: str, on_progress=None):
+    """
+    Upload several files concurrently (DRIVE_UPLOAD_WORKERS at a time).
+
+    files: [(uploaded_file, filename), ...] or [(uploaded_file, filename, sha256), ...]
+    on_progress(i, sent_bytes, total_bytes) runs in the calling thread
+    (safe for Streamlit elements). Returns one reply per file, in order;
+    a file that raised gets {"success": False, "error": ...}.
+    """
+    events = queue.Queue()
+
+    def _one(i, uploaded_file, filename, sha256=None):
+        try:
+            return upload_file_via_cleanroom_api(
+                uploaded_file=uploaded_file,
+                filename=filename,
+                folder_id=folder_id,
+                on_progress=lambda sent, total: events.put((i, sent, total)),
+                sha256=sha256,
+            )
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(DRIVE_UPLOAD_WORKERS, 1), thread_name_prefix="drive-upload") as pool:
+        futures = [pool.submit(_one, i, *item) for i, item in enumerate(files)]
+
+        while not all(fut.done() for fut in futures) or not events.empty():
+            try:
+                event = events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if on_progress:
+                on_progress(*event)
+
+        return [fut.result() for fut in futures]
 
-    # ✅ THIS IS THE FIX
-    try:
-        return r.json()
-    except Exception:
-        raise RuntimeError(f"Invalid JSON response: {r.text}")
 
 def delete_file_via_cleanroom_api(*, file_id: str):
-    url = st.secrets["app"]["cleanroom_logger_webapp_url"]
+    url = _webapp_url()
     payload = {"drive_delete": True, "file_id": file_id}
 
     r = requests.post(url, json=payload, timeout=60)
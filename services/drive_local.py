@@ -0,0 +1,173 @@
+# services/drive_local.py
+"""
+Local stand-in for the cleanroom Apps Script Drive endpoint.
+
+Speaks the protocol of services/drive.py (single upload, chunked
+upload, delete) and keeps files on disk:
+
+    python -m services.drive_local --port 8765 --root .drive_local
+    CLEANROOM_WEBAPP_URL=http://127.0.0.1:8765/ streamlit run admin.py
+
+Uploaded files are served back at GET /files/<id>.
+"""
+
+import argparse
+import base64
+import json
+import os
+import shutil
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class DriveStore:
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.files_dir = os.path.join(self.root, "files")
+        self.uploads_dir = os.path.join(self.root, "uploads")
+        os.makedirs(self.files_dir, exist_ok=True)
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    # ----- files -----
+    def _meta_path(self, file_id):
+        return os.path.join(self.files_dir, f"{file_id}.json")
+
+    def _save(self, base_url, folder_id, filename, mime_type, fill):
+        file_id = uuid.uuid4().hex
+        with open(os.path.join(self.files_dir, file_id), "wb") as f:
+            fill(f)
+        meta = {"id": file_id, "name": filename, "folder_id": folder_id, "mime_type": mime_type}
+        with open(self._meta_path(file_id), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        return {"success": True, "id": file_id, "name": filename, "url": f"{base_url}files/{file_id}"}
+
+    def meta(self, file_id):
+        try:
+            with open(self._meta_path(os.path.basename(file_id)), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def path(self, file_id):
+        return os.path.join(self.files_dir, os.path.basename(file_id))
+
+    # ----- protocol -----
+    def handle(self, req, base_url):
+        if req.get("drive_upload"):
+            data = base64.b64decode(req["file_base64"])
+            return self._save(base_url, req.get("folder_id"), req.get("filename"), req.get("mime_type"), lambda f: f.write(data))
+
+        if req.get("drive_upload_start"):
+            # same folder + content -> same upload: an interrupted one resumes
+            upload_id = f"{req.get('folder_id')}_{req['sha256']}"
+            upload_dir = os.path.join(self.uploads_dir, upload_id)
+            with self._lock:
+                os.makedirs(upload_dir, exist_ok=True)
+                with open(os.path.join(upload_dir, "start.json"), "w", encoding="utf-8") as f:
+                    json.dump(req, f)
+                received = sorted(int(n) for n in os.listdir(upload_dir) if n.isdigit())
+            return {"success": True, "upload_id": upload_id, "received": received}
+
+        if req.get("drive_upload_chunk"):
+            upload_dir = os.path.join(self.uploads_dir, os.path.basename(req["upload_id"]))
+            if not os.path.isdir(upload_dir):
+                return {"success": False, "error": "unknown upload_id"}
+            part = os.path.join(upload_dir, str(int(req["index"])))
+            with open(part + ".tmp", "wb") as f:
+                f.write(base64.b64decode(req["chunk_base64"]))
+            os.replace(part + ".tmp", part)
+            return {"success": True}
+
+        if req.get("drive_upload_finish"):
+            upload_dir = os.path.join(self.uploads_dir, os.path.basename(req["upload_id"]))
+            try:
+                with open(os.path.join(upload_dir, "start.json"), encoding="utf-8") as f:
+                    start = json.load(f)
+            except OSError:
+                return {"success": False, "error": "unknown upload_id"}
+            missing = [i for i in range(start["chunks"]) if not os.path.exists(os.path.join(upload_dir, str(i)))]
+            if missing:
+                return {"success": False, "error": f"missing chunks {missing}"}
+
+            def fill(out):
+                for i in range(start["chunks"]):
+                    with open(os.path.join(upload_dir, str(i)), "rb") as part:
+                        shutil.copyfileobj(part, out)
+
+            out = self._save(base_url, start.get("folder_id"), start.get("filename"), start.get("mime_type"), fill)
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            return out
+
+        if req.get("drive_delete"):
+            file_id = os.path.basename(req.get("file_id") or "")
+            if self.meta(file_id) is None:
+                return {"success": False, "error": "file not found"}
+            os.remove(self.path(file_id))
+            os.remove(self._meta_path(file_id))
+            return {"success": True}
+
+        return {"success": False, "error": "unknown request"}
+
+
+def make_handler(store):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _base_url(self):
+            host, port = self.server.server_address[:2]
+            return f"http://{host}:{port}/"
+
+        def _reply(self, status, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            try:
+                req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+                out = store.handle(req, self._base_url())
+            except Exception as e:
+                out = {"success": False, "error": f"{type(e).__name__}: {e}"}
+            self._reply(200, json.dumps(out).encode("utf-8"))
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            meta = store.meta(parts[1]) if len(parts) == 2 and parts[0] == "files" else None
+            if meta is None:
+                self._reply(404, b"not found", "text/plain")
+                return
+            with open(store.path(meta["id"]), "rb") as f:
+                self._reply(200, f.read(), meta.get("mime_type") or "application/octet-stream")
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def serve_in_thread(root, host="127.0.0.1", port=0):
+    """Start the stand-in on a daemon thread; returns (server, url)."""
+    server = ThreadingHTTPServer((host, port), make_handler(DriveStore(root)))
+    threading.Thread(target=server.serve_forever, name="drive-local", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--root", default=".drive_local")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(DriveStore(args.root)))
+    print(f"Drive stand-in on http://{args.host}:{args.port}/ (files in {os.path.abspath(args.root)})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
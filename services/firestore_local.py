@@ -0,0 +1,500 @@
+# services/firestore_local.py
+"""
+In-process fake of the Firestore REST surface used by firebase_client.
+
+Documents live in memory (wire format, as Firestore returns them):
+
+    GET    documents/{col}/{id}                      get (mask.fieldPaths)
+    GET    documents/{col}                           list (pageSize, pageToken,
+                                                     orderBy, mask.fieldPaths)
+    PATCH  documents/{col}/{id}[?updateMask...]      set / field-path update
+    DELETE documents/{col}/{id}
+    POST   documents:runQuery                        where / orderBy / limit / select
+    POST   documents:batchGet
+    POST   documents:commit                          updates + deletes, updateTime
+                                                     / exists preconditions, atomic
+
+Injected latency (seconds, + uniform jitter) and error rate (503
+UNAVAILABLE) apply to every request; tokens listed in expired_tokens
+get a 401, as an expired ID token would. Every request is counted in
+stats. Point the app at it with FIRESTORE_HOST:
+
+    python -m services.firestore_local --port 8086 --latency 0.05
+    FIRESTORE_HOST=http://127.0.0.1:8086 streamlit run viewer.py
+
+or in-process:
+
+    fake, server, host = serve_in_thread(latency=0.02)
+    fake.load("runs", {"main_001": {...python dict...}})
+    firebase_client.BASE_URL = f"{host}/v1/projects/{PROJECT_ID}/databases/(default)/documents"
+"""
+
+import argparse
+import collections
+import copy
+import datetime
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from core.firestore_codec import encode_fields, split_field_path
+
+
+_DOCUMENTS = re.compile(r"^/v1/projects/([^/]+)/databases/([^/]+)/documents(.*)$")
+
+
+class FirestoreError(Exception):
+
+    def __init__(self, code, status, message=""):
+        super().__init__(message or status)
+        self.code = code
+        self.status = status
+
+    def body(self):
+        return {"error": {"code": self.code, "status": self.status, "message": str(self)}}
+
+
+# ============================================================
+# VALUES
+# ============================================================
+
+def _sort_key(v):
+    """Firestore cross-type value ordering."""
+    if "nullValue" in v:
+        return (0, 0)
+    if "booleanValue" in v:
+        return (1, bool(v["booleanValue"]))
+    if "integerValue" in v:
+        return (2, int(v["integerValue"]))
+    if "doubleValue" in v:
+        return (2, float(v["doubleValue"]))
+    if "timestampValue" in v:
+        return (3, v["timestampValue"])
+    if "stringValue" in v:
+        return (4, v["stringValue"])
+    if "bytesValue" in v:
+        return (5, v["bytesValue"])
+    if "referenceValue" in v:
+        return (6, v["referenceValue"])
+    if "geoPointValue" in v:
+        g = v["geoPointValue"]
+        return (7, (g.get("latitude", 0), g.get("longitude", 0)))
+    if "arrayValue" in v:
+        return (8, [_sort_key(x) for x in v["arrayValue"].get("values", [])])
+    if "mapValue" in v:
+        return (9, sorted((k, _sort_key(x)) for k, x in v["mapValue"].get("fields", {}).items()))
+    return (10, json.dumps(v, sort_keys=True))
+
+
+def _get_path(fields, path):
+    keys = split_field_path(path)
+    node = fields
+    for k in keys[:-1]:
+        child = node.get(k)
+        if not child or "mapValue" not in child:
+            return None
+        node = child["mapValue"].get("fields", {})
+    return node.get(keys[-1])
+
+
+def _set_path(fields, path, value):
+    keys = split_field_path(path)
+    node = fields
+    for k in keys[:-1]:
+        child = node.get(k)
+        if not child or "mapValue" not in child:
+            child = node[k] = {"mapValue": {"fields": {}}}
+        node = child["mapValue"].setdefault("fields", {})
+    if value is None:
+        node.pop(keys[-1], None)
+    else:
+        node[keys[-1]] = value
+
+
+def _project(doc, paths):
+    if paths is None:
+        return doc
+    fields = {}
+    for path in paths:
+        if path == "__name__":
+            continue
+        value = _get_path(doc.get("fields", {}), path)
+        if value is not None:
+            _set_path(fields, path, value)
+    return {**doc, "fields": fields}
+
+
+def _matches(filt, fields):
+    if "compositeFilter" in filt:
+        comp = filt["compositeFilter"]
+        results = (_matches(f, fields) for f in comp.get("filters", []))
+        return any(results) if comp.get("op") == "OR" else all(results)
+
+    if "unaryFilter" in filt:
+        uf = filt["unaryFilter"]
+        value = _get_path(fields, uf["field"]["fieldPath"])
+        op = uf["op"]
+        if op == "IS_NULL":
+            return value is not None and "nullValue" in value
+        if op == "IS_NOT_NULL":
+            return value is not None and "nullValue" not in value
+        raise FirestoreError(400, "INVALID_ARGUMENT", f"unsupported unary filter {op}")
+
+    ff = filt["fieldFilter"]
+    value = _get_path(fields, ff["field"]["fieldPath"])
+    if value is None:
+        return False
+    op, want = ff["op"], ff["value"]
+    have_key, want_key = _sort_key(value), _sort_key(want)
+
+    if op == "EQUAL":
+        return have_key == want_key
+    if op == "NOT_EQUAL":
+        return have_key != want_key
+    if op == "ARRAY_CONTAINS":
+        return want_key in [_sort_key(x) for x in value.get("arrayValue", {}).get("values", [])]
+    if op == "IN":
+        return have_key in [_sort_key(x) for x in want.get("arrayValue", {}).get("values", [])]
+    if op == "NOT_IN":
+        return have_key not in [_sort_key(x) for x in want.get("arrayValue", {}).get("values", [])]
+
+    # range filters only match values of the same type
+    if have_key[0] != want_key[0]:
+        return False
+    if op == "LESS_THAN":
+        return have_key < want_key
+    if op == "LESS_THAN_OR_EQUAL":
+        return have_key <= want_key
+    if op == "GREATER_THAN":
+        return have_key > want_key
+    if op == "GREATER_THAN_OR_EQUAL":
+        return have_key >= want_key
+    raise FirestoreError(400, "INVALID_ARGUMENT", f"unsupported field filter {op}")
+
+
+# ============================================================
+# STORE
+# ============================================================
+
+class FakeFirestore:
+
+    def __init__(self, *, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.expired_tokens = set()
+        self.stats = collections.Counter()
+        self.root = "projects/local/databases/(default)/documents"   # set per request
+        self._docs = {}                     # (collection path, id) -> {fields, createTime, updateTime}
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._clock = 0
+
+    # ----- helpers -----
+    def _now(self):
+        # strictly increasing updateTime (real Firestore: microseconds)
+        stamp = time.time_ns() // 1000
+        self._clock = max(self._clock + 1, stamp)
+        dt = datetime.datetime.fromtimestamp(self._clock / 1e6, datetime.timezone.utc)
+        return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    def _name(self, key):
+        return f"{self.root}/{key[0]}/{key[1]}"
+
+    def _out(self, key, doc, mask=None):
+        # stored fields are replaced, never mutated: responses share them
+        return _project({"name": self._name(key), **doc}, mask)
+
+    def _key(self, name):
+        rel = name.split("/documents/", 1)[-1] if "/documents/" in name else name
+        collection, _, doc_id = rel.rpartition("/")
+        if not collection or not doc_id:
+            raise FirestoreError(400, "INVALID_ARGUMENT", f"bad document name {name!r}")
+        return collection, doc_id
+
+    def load(self, collection, docs):
+        """Add python dicts ({doc_id: data}) as documents."""
+        with self._lock:
+            for doc_id, data in docs.items():
+                now = self._now()
+                self._docs[(collection, doc_id)] = {
+                    "fields": encode_fields(data),
+                    "createTime": now,
+                    "updateTime": now,
+                }
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+            self.stats.clear()
+
+    def _write(self, key, fields, mask):
+        doc = self._docs.get(key)
+        now = self._now()
+        if mask is None:
+            new_fields = copy.deepcopy(fields)
+        else:
+            # fields named in the mask but absent from the body are deleted
+            new_fields = copy.deepcopy(doc["fields"]) if doc else {}
+            for path in mask:
+                _set_path(new_fields, path, copy.deepcopy(_get_path(fields, path)))
+        self._docs[key] = {
+            "fields": new_fields,
+            "createTime": doc["createTime"] if doc else now,
+            "updateTime": now,
+        }
+        return self._docs[key]
+
+    # ----- REST operations -----
+    def get(self, key, mask=None):
+        with self._lock:
+            doc = self._docs.get(key)
+            if doc is None:
+                raise FirestoreError(404, "NOT_FOUND", f"Document \"{self._name(key)}\" not found.")
+            return self._out(key, doc, mask)
+
+    def _collection(self, collection):
+        with self._lock:
+            return [(k, d) for k, d in sorted(self._docs.items()) if k[0] == collection]
+
+    def list(self, collection, *, page_size=None, page_token=None, order_by=None, mask=None):
+        docs = self._collection(collection)
+        if order_by:
+            for part in reversed([p.strip() for p in order_by.split(",") if p.strip()]):
+                path, _, direction = part.partition(" ")
+                docs = [(k, d) for k, d in docs if _get_path(d["fields"], path) is not None]
+                docs.sort(key=lambda kd: _sort_key(_get_path(kd[1]["fields"], path)), reverse=direction.lower() == "desc")
+
+        start = int(page_token or 0)
+        size = min(int(page_size or 300), 300)
+        page = docs[start:start + size]
+        out = {"documents": [self._out(k, d, mask) for k, d in page]} if page else {}
+        if start + size < len(docs):
+            out["nextPageToken"] = str(start + size)
+        return out
+
+    def patch(self, key, fields, mask=None):
+        with self._lock:
+            return self._out(key, self._write(key, fields, mask))
+
+    def delete(self, key):
+        with self._lock:
+            self._docs.pop(key, None)
+        return {}
+
+    def run_query(self, parent, query):
+        sources = query.get("from") or []
+        if len(sources) != 1 or sources[0].get("allDescendants"):
+            raise FirestoreError(400, "INVALID_ARGUMENT", "one collection per query")
+        collection = f"{parent}/{sources[0]['collectionId']}" if parent else sources[0]["collectionId"]
+
+        docs = self._collection(collection)
+
+        if "where" in query:
+            docs = [(k, d) for k, d in docs if _matches(query["where"], d["fields"])]
+        for order in reversed(query.get("orderBy") or []):
+            path = order["field"]["fieldPath"]
+            descending = order.get("direction") == "DESCENDING"
+            if path == "__name__":
+                docs.sort(key=lambda kd: kd[0], reverse=descending)
+                continue
+            docs = [(k, d) for k, d in docs if _get_path(d["fields"], path) is not None]
+            docs.sort(key=lambda kd: _sort_key(_get_path(kd[1]["fields"], path)), reverse=descending)
+        docs = docs[int(query.get("offset") or 0):]
+        if "limit" in query:
+            docs = docs[:int(query["limit"])]
+
+        select = query.get("select")
+        paths = [f["fieldPath"] for f in select.get("fields", [])] if select is not None else None
+        read_time = self._now()
+        if not docs:
+            return [{"readTime": read_time}]
+        return [{"document": self._out(k, d, paths), "readTime": read_time} for k, d in docs]
+
+    def batch_get(self, names, mask=None):
+        read_time = self._now()
+        out = []
+        with self._lock:
+            for name in names:
+                key = self._key(name)
+                doc = self._docs.get(key)
+                if doc is None:
+                    out.append({"missing": name, "readTime": read_time})
+                else:
+                    out.append({"found": self._out(key, doc, mask), "readTime": read_time})
+        return out
+
+    def commit(self, writes):
+        with self._lock:
+            # preconditions first: all or nothing
+            for w in writes:
+                target = w["update"]["name"] if "update" in w else w.get("delete")
+                if target is None:
+                    raise FirestoreError(400, "INVALID_ARGUMENT", "only update / delete writes are supported")
+                if w.get("updateTransforms") or w.get("transform"):
+                    raise FirestoreError(400, "INVALID_ARGUMENT", "field transforms are not supported")
+                current = w.get("currentDocument") or {}
+                doc = self._docs.get(self._key(target))
+                if "updateTime" in current and (doc is None or doc["updateTime"] != current["updateTime"]):
+                    raise FirestoreError(400, "FAILED_PRECONDITION", f"the stored version of {target} does not match the required base version")
+                if "exists" in current and bool(current["exists"]) != (doc is not None):
+                    raise FirestoreError(400 if doc is None else 409, "NOT_FOUND" if doc is None else "ALREADY_EXISTS", target)
+
+            results = []
+            for w in writes:
+                if "update" in w:
+                    mask = (w.get("updateMask") or {}).get("fieldPaths") if "updateMask" in w else None
+                    doc = self._write(self._key(w["update"]["name"]), w["update"].get("fields", {}), mask)
+                    results.append({"updateTime": doc["updateTime"]})
+                else:
+                    self._docs.pop(self._key(w["delete"]), None)
+                    results.append({})
+            return {"writeResults": results, "commitTime": self._now()}
+
+
+# ============================================================
+# HTTP
+# ============================================================
+
+def make_handler(fake):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = "HTTP/1.1"     # keep-alive, like googleapis.com
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(n)) if n else {}
+
+        def _handle(self, method):
+            body = self._body() if method in ("POST", "PATCH") else {}
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            m = _DOCUMENTS.match(url.path)
+
+            try:
+                if m is None:
+                    raise FirestoreError(404, "NOT_FOUND", url.path)
+                fake.root = f"projects/{m.group(1)}/databases/{m.group(2)}/documents"
+                rest = m.group(3)
+
+                if fake.latency or fake.jitter:
+                    time.sleep(fake.latency + fake._rng.uniform(0, fake.jitter))
+                if fake.error_rate and fake._rng.random() < fake.error_rate:
+                    raise FirestoreError(503, "UNAVAILABLE", "injected error")
+
+                auth = self.headers.get("Authorization", "")
+                token = auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+                if token and token in fake.expired_tokens:
+                    raise FirestoreError(401, "UNAUTHENTICATED", "Request had invalid authentication credentials.")
+
+                self._reply(200, self._route(method, rest, query, body))
+            except FirestoreError as e:
+                self._reply(e.code, e.body())
+            except Exception as e:
+                self._reply(400, FirestoreError(400, "INVALID_ARGUMENT", f"{type(e).__name__}: {e}").body())
+
+        def _route(self, method, rest, query, body):
+            mask = query.get("mask.fieldPaths")
+
+            if method == "POST" and rest.endswith(":runQuery"):
+                fake.stats["runQuery"] += 1
+                return fake.run_query(rest[:-len(":runQuery")].strip("/"), body.get("structuredQuery") or {})
+            if method == "POST" and rest == ":batchGet":
+                fake.stats["batchGet"] += 1
+                return fake.batch_get(body.get("documents") or [], (body.get("mask") or {}).get("fieldPaths"))
+            if method == "POST" and rest == ":commit":
+                fake.stats["commit"] += 1
+                return fake.commit(body.get("writes") or [])
+
+            parts = rest.strip("/").split("/")
+            if len(parts) % 2 == 1 and method == "GET":
+                fake.stats["list"] += 1
+                return fake.list(
+                    "/".join(parts),
+                    page_size=(query.get("pageSize") or [None])[0],
+                    page_token=(query.get("pageToken") or [None])[0],
+                    order_by=(query.get("orderBy") or [None])[0],
+                    mask=mask,
+                )
+            if len(parts) % 2 == 0 and parts[0]:
+                key = ("/".join(parts[:-1]), parts[-1])
+                if method == "GET":
+                    fake.stats["get"] += 1
+                    return fake.get(key, mask)
+                if method == "PATCH":
+                    fake.stats["patch"] += 1
+                    paths = query.get("updateMask.fieldPaths")
+                    if paths == ["*"]:
+                        # firestore_update's "*" mask: a top-level merge
+                        paths = list((body.get("fields") or {}).keys())
+                    return fake.patch(key, body.get("fields") or {}, paths)
+                if method == "DELETE":
+                    fake.stats["delete"] += 1
+                    return fake.delete(key)
+
+            raise FirestoreError(400, "INVALID_ARGUMENT", f"unsupported {method} {rest}")
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_PATCH(self):
+            self._handle("PATCH")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def serve_in_thread(fake=None, host="127.0.0.1", port=0, **options):
+    """Start a fake on a daemon thread; returns (fake, server, "http://host:port")."""
+    fake = fake or FakeFirestore(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="firestore-local", daemon=True).start()
+    return fake, server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory fake Firestore REST server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8086)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra uniform random latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 503")
+    parser.add_argument("--load", metavar="COLLECTION=FILE.json", action="append", default=[],
+                        help="preload {doc_id: data} from a JSON file")
+    args = parser.parse_args()
+
+    fake = FakeFirestore(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    for item in args.load:
+        collection, _, path = item.partition("=")
+        with open(path, encoding="utf-8") as f:
+            fake.load(collection, json.load(f))
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    print(f"Fake Firestore on http://{args.host}:{args.port} (FIRESTORE_HOST=http://{args.host}:{args.port})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-import copy
 import uuid
 
+from core.model import copy_layer_dicts
+
 def ensure_ids(flow):
     for layer in flow:
         for sub in layer["substeps"]:
@@ -58,6 +59,9 @@ def ensure_flow_ids(layers):
 def firestore_fields_to_layers(fields):
     """
     Convert Firestore run fields -> Python layers structure
+
+    Builds the editor dicts straight from the wire format: going through
+    decode_steps would build every chip / substep twice.
     """
 
     steps_raw = fields["steps"]["arrayValue"]["values"]
@@ -108,6 +112,6 @@ def build_default_flow(default_flow):
     Build a fresh editable flow from DEFAULT_FLOW.
     """
 
-    flow = copy.deepcopy(default_flow)
+    flow = copy_layer_dicts(default_flow)
     ensure_flow_ids(flow)
     return flow
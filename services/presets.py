@@ -16,7 +16,11 @@ def load_layer_presets_once(session_state, id_token, default_flow):
     session_state.setdefault("layer_presets", {})
 
     # 1) Load entire collection
-    all_docs = firestore_list("layer_presets", id_token)
+    all_docs = firestore_list(
+        "layer_presets",
+        id_token,
+        field_paths=["substeps", "display_name"],
+    )
 
     # preset_lookup = {}
     # for doc in all_docs.get("documents", []):
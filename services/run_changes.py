@@ -0,0 +1,108 @@
+# services/run_changes.py
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from core.change_tracker import ChangeTracker
+from firebase_client import (
+    FirestoreConflict, WriteBatch, add_write_listener, firestore_set, firestore_update_field,
+)
+
+
+# ============================================================
+# LOADED-RUN CHANGE TRACKER (admin, per Streamlit session)
+# ============================================================
+#
+# Set when a run is loaded; save_full_run diffs the editor state
+# against it and sends only the changed field paths.
+#
+# The admin also writes the run eagerly while editing (chip status
+# timestamps, Notion links, metadata, ...). Those writes go through the
+# helpers below, guarded by the tracker's updateTime; the write listener
+# adopts the new updateTime only for writes carrying that guard, so the
+# save precondition still fails when someone else wrote in between.
+# A guarded write that fails is never re-sent without the guard: the
+# user reloads the run instead.
+
+SESSION_KEY = "loaded_run_changes"
+
+CONFLICT_MESSAGE = (
+    "Not saved: this run was changed by someone else since you loaded it. "
+    "Reload the run and apply your changes again."
+)
+
+
+def start_tracking(run_doc, collection="runs"):
+    """Start tracking a freshly loaded run document."""
+    st.session_state[SESSION_KEY] = ChangeTracker.from_document(collection, run_doc)
+    return st.session_state[SESSION_KEY]
+
+
+def get_tracker(doc_id, collection="runs"):
+    """The tracker for doc_id, or None if that run is not the one loaded."""
+    tracker = st.session_state.get(SESSION_KEY)
+    if tracker is None or tracker.collection != collection or tracker.doc_id != doc_id:
+        return None
+    return tracker
+
+
+def commit_run_writes(batch, doc_id, collection="runs"):
+    """
+    Commit a WriteBatch touching the loaded run, guarded by the tracker's
+    updateTime.
+    Raises FirestoreConflict (nothing written) if the run changed since
+    it was loaded.
+    """
+    tracker = get_tracker(doc_id, collection)
+    if tracker is not None and tracker.update_time:
+        batch.require(collection, doc_id, tracker.update_time)
+    return batch.commit()
+
+
+def _commit_or_stop(batch, document, collection):
+    try:
+        commit_run_writes(batch, document, collection)
+    except FirestoreConflict:
+        st.error(CONFLICT_MESSAGE)
+        st.stop()
+    return {"updateTime": batch.update_times.get((collection, document))}
+
+
+def update_run_field(collection, document, field_path, value, id_token):
+    """
+    firestore_update_field, guarded when document is the loaded run
+    (on conflict: error shown, script stopped).
+    """
+    if get_tracker(document, collection) is None:
+        return firestore_update_field(collection, document, field_path, value, id_token)
+
+    batch = WriteBatch(id_token).update_field(collection, document, field_path, value)
+    return _commit_or_stop(batch, document, collection)
+
+
+def set_run(collection, document, data, id_token):
+    """
+    firestore_set, guarded when document is the loaded run
+    (on conflict: error shown, script stopped).
+    """
+    if get_tracker(document, collection) is None:
+        return firestore_set(collection, document, data, id_token)
+
+    batch = WriteBatch(id_token).set(collection, document, data)
+    return _commit_or_stop(batch, document, collection)
+
+
+def _follow_own_writes(collection, document, update_time=None, base_time=None):
+    # Listeners run in the writer's thread: only Streamlit script threads
+    # have a session to look at
+    if not update_time or not base_time or get_script_run_ctx() is None:
+        return
+
+    # Only a write guarded by the time the tracker holds proves nobody
+    # else wrote in between
+    tracker = get_tracker(document, collection)
+    if tracker is not None and tracker.update_time == base_time:
+        tracker.update_time = update_time
+
+
+add_write_listener(_follow_own_writes)
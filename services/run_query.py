@@ -0,0 +1,211 @@
+# services/run_query.py
+
+import datetime
+import os
+import sys
+
+from firebase_client import (
+    firestore_iter,
+    firestore_run_query,
+    firestore_update_fields,
+    firestore_to_python,
+)
+
+
+# ============================================================
+# DENORMALIZED FILTER FIELDS (top-level on every run document)
+# ============================================================
+#
+# lot_id : Design "Lotid" (as typed)
+# fabin  : Fab "Fabin"  date part, "YYYY-MM-DD" or ""
+# fabout : Fab "Fabout" date part, "YYYY-MM-DD" or ""
+#
+# Date-only strings compare correctly as strings, which is what lets
+# Firestore evaluate the Fab-in / Fab-out range filters server-side.
+#
+# NOTE: Firestore needs composite indexes for these queries:
+#   class ASC, run_no DESC
+#   class ASC, fabin ASC
+#   class ASC, fabout ASC
+#   class ASC, fabin ASC, fabout ASC
+# The first query that misses one returns a 400 with a console link
+# that creates it.
+
+RUN_FILTER_KEYS = ("lot_id", "fabin", "fabout")
+
+
+def _meta_get(meta_list, target_key):
+    """Case-insensitive lookup in a [{"key","value"}] metadata list."""
+    target = target_key.strip().lower()
+    for item in meta_list or []:
+        if isinstance(item, dict) and (item.get("key") or "").strip().lower() == target:
+            return item.get("value")
+    return ""
+
+
+def date_key(value) -> str:
+    """
+    "2026-01-05 14:22:10" -> "2026-01-05"
+    date(2026, 1, 5)      -> "2026-01-05"
+    anything else         -> ""
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime("%Y-%m-%d")
+
+    s = str(value or "").strip()[:10]
+    try:
+        datetime.datetime.strptime(s, "%Y-%m-%d")
+    except ValueError:
+        return ""
+    return s
+
+
+def run_filter_fields(metadata: dict) -> dict:
+    """
+    Build the denormalized filter fields from (python) run metadata.
+    Written next to run_no/class/device_name on every full save.
+    """
+    metadata = metadata if isinstance(metadata, dict) else {}
+    design = metadata.get("design", []) or []
+    fab = metadata.get("fab", []) or []
+
+    return {
+        "lot_id": str(_meta_get(design, "Lotid") or "").strip(),
+        "fabin":  date_key(_meta_get(fab, "Fabin")),
+        "fabout": date_key(_meta_get(fab, "Fabout")),
+    }
+
+
+# ============================================================
+# STRUCTURED QUERY
+# ============================================================
+
+def _field_filter(field, op, value):
+    return {
+        "fieldFilter": {
+            "field": {"fieldPath": field},
+            "op": op,
+            "value": {"stringValue": value},
+        }
+    }
+
+
+def build_runs_query(*, run_class, fabin_after=None, fabout_before=None, limit=None, names_only=False):
+    """
+    Firestore structuredQuery for the viewer's Filter Runs panel.
+
+    - class is always applied (EQUAL)
+    - fabin_after   -> fabin  >= date
+    - fabout_before -> ""< fabout <= date (runs with no Fabout are excluded)
+
+    Without date filters the result is ordered by run_no DESC and `limit`
+    applies. With a range filter Firestore orders by the range field, so
+    the limit is dropped (the filtered set is small) and callers sort by
+    run_no locally.
+
+    names_only=True projects to __name__, so each result carries only
+    name / createTime / updateTime (cheap change-detection listing).
+    """
+    filters = [_field_filter("class", "EQUAL", run_class)]
+
+    fabin_key = date_key(fabin_after) if fabin_after else ""
+    fabout_key = date_key(fabout_before) if fabout_before else ""
+
+    if fabin_key:
+        filters.append(_field_filter("fabin", "GREATER_THAN_OR_EQUAL", fabin_key))
+
+    if fabout_key:
+        filters.append(_field_filter("fabout", "GREATER_THAN", ""))
+        filters.append(_field_filter("fabout", "LESS_THAN_OR_EQUAL", fabout_key))
+
+    query = {"from": [{"collectionId": "runs"}]}
+
+    if names_only:
+        query["select"] = {"fields": [{"fieldPath": "__name__"}]}
+
+    if len(filters) == 1:
+        query["where"] = filters[0]
+    else:
+        query["where"] = {"compositeFilter": {"op": "AND", "filters": filters}}
+
+    if not (fabin_key or fabout_key):
+        query["orderBy"] = [{"field": {"fieldPath": "run_no"}, "direction": "DESCENDING"}]
+        if limit:
+            query["limit"] = int(limit)
+
+    return query
+
+
+def query_runs(id_token, *, run_class, fabin_after=None, fabout_before=None, limit=None):
+    """
+    Run the Filter Runs query server-side.
+    Returns run documents sorted by run_no DESC.
+    Raises requests.HTTPError on failure.
+    """
+    query = build_runs_query(
+        run_class=run_class,
+        fabin_after=fabin_after,
+        fabout_before=fabout_before,
+        limit=limit,
+    )
+    return sort_runs(firestore_run_query(query, id_token))
+
+
+def sort_runs(docs):
+    """Sort run documents by run_no DESC (in place) and return them."""
+    docs.sort(
+        key=lambda d: d.get("fields", {}).get("run_no", {}).get("stringValue", ""),
+        reverse=True,
+    )
+    return docs
+
+
+# ============================================================
+# BACKFILL (existing runs saved before the denormalized fields)
+# ============================================================
+
+def backfill_run_filter_fields(id_token, *, dry_run=False) -> int:
+    """
+    Write lot_id / fabin / fabout onto every run whose stored values are
+    missing or stale. One PATCH per changed run. Returns the number of
+    runs that needed an update.
+    """
+    changed = 0
+
+    for doc in firestore_iter(
+        "runs",
+        id_token,
+        field_paths=["metadata.design", "metadata.fab", *RUN_FILTER_KEYS],
+    ):
+        fields = doc.get("fields", {})
+        metadata = firestore_to_python(fields.get("metadata", {})) or {}
+
+        want = run_filter_fields(metadata)
+        have = {k: firestore_to_python(fields[k]) for k in RUN_FILTER_KEYS if k in fields}
+
+        if have == want:
+            continue
+
+        changed += 1
+        if dry_run:
+            continue
+
+        doc_id = doc["name"].split("/")[-1]
+        firestore_update_fields("runs", doc_id, want, id_token)
+
+    return changed
+
+
+def main():
+    id_token = os.environ.get("FIREBASE_ID_TOKEN", "").strip()
+    if not id_token:
+        print("FIREBASE_ID_TOKEN env var missing", file=sys.stderr)
+        sys.exit(2)
+
+    dry_run = "--dry-run" in sys.argv[1:]
+    n = backfill_run_filter_fields(id_token, dry_run=dry_run)
+    print(f"{n} run(s) {'need' if dry_run else 'updated with'} filter fields")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# services/run_snapshot.py
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from firebase_client import add_write_listener, firestore_batch_get, firestore_run_query
+from services.run_query import build_runs_query, date_key, sort_runs
+
+
+# ============================================================
+# RUN SNAPSHOT (delta refresh keyed on updateTime)
+# ============================================================
+#
+# Every autorefresh tick the viewer used to download every matching run
+# in full and rebuild every card. Runs change rarely, so each tick now:
+#
+#   1. lists only name + updateTime for the matching runs (__name__
+#      projection of the same Filter Runs query)
+#   2. batchGets the runs whose updateTime differs from the snapshot
+#   3. drops runs that no longer match
+#
+# Documents in the snapshot are shared between reruns and must be
+# treated as read-only by callers.
+
+
+class RunSnapshot:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}          # name -> full run document
+        self.last_fetched = 0    # documents downloaded on the last sync
+
+    def sync(self, id_token, *, run_class, fabin_after=None, fabout_before=None, limit=None):
+        """
+        Bring the snapshot up to date for one Filter Runs query (limit:
+        newest run_no first, see build_runs_query).
+        Returns run documents sorted by run_no DESC.
+        Raises requests.HTTPError on failure.
+        """
+        query = build_runs_query(
+            run_class=run_class,
+            fabin_after=fabin_after,
+            fabout_before=fabout_before,
+            limit=limit,
+            names_only=True,
+        )
+        listing = firestore_run_query(query, id_token)
+
+        with self._lock:
+            stale = [
+                row["name"] for row in listing
+                if self._docs.get(row["name"], {}).get("updateTime") != row.get("updateTime")
+            ]
+
+        fresh = firestore_batch_get(stale, id_token) if stale else {}
+
+        with self._lock:
+            self._docs.update(fresh)
+            self.last_fetched = len(fresh)
+            docs = [self._docs[row["name"]] for row in listing if row["name"] in self._docs]
+
+        return sort_runs(docs)
+
+    def forget(self, name=None):
+        """Drop one run (full resource name) or the whole snapshot."""
+        with self._lock:
+            if name is None:
+                self._docs.clear()
+            else:
+                self._docs.pop(name, None)
+
+
+# ============================================================
+# PER-DOCUMENT MEMO (derived card data)
+# ============================================================
+
+class DocMemo:
+    """
+    Bounded LRU of values derived from a document, keyed by
+    (name, updateTime). A card is rebuilt only when its run changed.
+    """
+
+    def __init__(self, max_entries=2000):
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.max_entries = max_entries
+
+    def get_or_build(self, doc, build):
+        key = (doc.get("name"), doc.get("updateTime"))
+
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        value = build()
+
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+        return value
+
+
+# ============================================================
+# SHARED RESULT CACHE (all sessions / tabs in this process)
+# ============================================================
+#
+# Wall displays run 10+ viewer tabs on the same filters. Within the TTL
+# they share one result; when it expires, the first tab refreshes and
+# the others wait for that same fetch (single-flight).
+#
+# Admin writes go through firebase_client, which calls invalidate_runs()
+# for the runs collection. That touches a stamp file, so viewers in
+# other Streamlit processes on the same host pick the change up on
+# their next tick instead of waiting out the TTL.
+
+RUNS_CACHE_TTL = float(os.environ.get("VIEWER_RUNS_TTL", "8"))
+# newest runs (by run_no) the viewer lists when not searching; 0 = all
+VIEWER_RUNS_LIMIT = int(os.environ.get("VIEWER_RUNS_LIMIT", "200"))
+RUNS_STAMP_PATH = os.environ.get(
+    "VIEWER_RUNS_STAMP",
+    os.path.join(tempfile.gettempdir(), "eeroq_runs.stamp"),
+)
+
+
+def _read_stamp():
+    try:
+        return os.stat(RUNS_STAMP_PATH).st_mtime_ns
+    except OSError:
+        return 0
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.docs = None
+        self.error = None
+
+
+class SharedRunsCache:
+    def __init__(self, snapshot, ttl=RUNS_CACHE_TTL):
+        self._snapshot = snapshot
+        self._lock = threading.Lock()
+        self._entries = {}    # key -> (loaded_at, stamp, generation, docs)
+        self._flights = {}    # key -> _Flight
+        self._generation = 0
+        self.ttl = ttl
+
+    def get(self, id_token, *, run_class, fabin_after=None, fabout_before=None, limit=None):
+        """
+        Same contract as RunSnapshot.sync, but shared and coalesced.
+        Returns a new list each call (documents themselves are read-only).
+        """
+        key = (
+            run_class,
+            date_key(fabin_after) if fabin_after else "",
+            date_key(fabout_before) if fabout_before else "",
+            int(limit) if limit else None,
+        )
+        stamp = _read_stamp()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry
+                and time.monotonic() - entry[0] < self.ttl
+                and entry[1] == stamp
+                and entry[2] == self._generation
+            ):
+                return list(entry[3])
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            generation = self._generation
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return list(flight.docs)
+
+        try:
+            docs = self._snapshot.sync(
+                id_token,
+                run_class=run_class,
+                fabin_after=fabin_after,
+                fabout_before=fabout_before,
+                limit=limit,
+            )
+            flight.docs = docs
+            with self._lock:
+                self._entries[key] = (time.monotonic(), stamp, generation, docs)
+            return list(docs)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+# Module-level so they survive Streamlit script reruns (one per process)
+run_snapshot = RunSnapshot()
+runs_cache = SharedRunsCache(run_snapshot)
+
+
+def invalidate_runs(collection="runs", document=None, update_time=None, base_time=None):
+    """
+    Expire every cached Filter Runs result (this process and, via the
+    stamp file, viewers in other processes). Registered as a
+    firebase_client write listener; safe to call directly after a save.
+    """
+    if collection != "runs":
+        return
+
+    runs_cache.invalidate()
+
+    try:
+        with open(RUNS_STAMP_PATH, "a"):
+            pass
+        os.utime(RUNS_STAMP_PATH, None)
+    except OSError as e:
+        print("⚠️ could not touch runs stamp:", e)
+
+
+add_write_listener(invalidate_runs)
+
+_memos = {}
+_memos_lock = threading.Lock()
+
+
+def get_doc_memo(namespace):
+    """One DocMemo per caller (viewer.py and viewer_no_login.py render differently)."""
+    with _memos_lock:
+        if namespace not in _memos:
+            _memos[namespace] = DocMemo()
+        return _memos[namespace]
@@ -1,6 +1,7 @@
 # services/timestamps.py
 
-from firebase_client import firestore_update_field
+from services.run_changes import update_run_field
+from core.model import Chip
 
 
 # ============================================================
@@ -18,47 +19,15 @@ def apply_chip_status_transition(chip_ref, old_status, new_status, now):
     This function ONLY mutates chip_ref.
     """
 
-    # ---------------------------------------------
-    # 1. pending → in_progress
-    # ---------------------------------------------
-    if old_status == "pending" and new_status == "in_progress":
-        chip_ref["started_at"] = now
-        chip_ref.pop("completed_at", None)
-
-    # ---------------------------------------------
-    # 2. in_progress → done
-    # ---------------------------------------------
-    elif old_status == "in_progress" and new_status == "done":
-        chip_ref["completed_at"] = now
-        
-    # ---------------------------------------------
-    # 3. pending → done  (skip-safe)
-    # ---------------------------------------------
-    elif old_status == "pending" and new_status == "done":
-        chip_ref["started_at"] = now
-        chip_ref["completed_at"] = now
-
-    # ---------------------------------------------
-    # 4. done → in_progress  (reset + restart)
-    # ---------------------------------------------
-    elif old_status == "done" and new_status == "in_progress":
-        chip_ref.pop("completed_at", None)
-        chip_ref["started_at"] = now
-
-    # ---------------------------------------------
-    # 5. done → pending  (full reset)
-    # ---------------------------------------------
-    elif old_status == "done" and new_status == "pending":
-        chip_ref.pop("completed_at", None)
-        chip_ref.pop("started_at", None)
-
-    # ---------------------------------------------
-    # 6. in_progress → pending  (reset start)
-    # ---------------------------------------------
-    elif old_status == "in_progress" and new_status == "pending":
-        chip_ref.pop("started_at", None)
-        chip_ref.pop("completed_at", None)
-    # -----------------------------------------------------
+    # Transition rules live on core.model.Chip (shared with Run.with_chip_status)
+    chip = Chip.from_dict(chip_ref).transition(old_status, new_status, now)
+
+    for key in ("started_at", "completed_at"):
+        value = getattr(chip, key)
+        if value is None:
+            chip_ref.pop(key, None)
+        else:
+            chip_ref[key] = value
 
 
 
@@ -109,7 +78,7 @@ def apply_package_auto_dates(
             if not chip_meta.get("pcb_ready"):
                 chip_meta["pcb_ready"] = now
 
-                firestore_update_field(
+                update_run_field(
                     "runs",
                     loaded_run_doc_id,
                     f"metadata.package.chips.{chip_uid}.pcb_ready",
@@ -122,7 +91,7 @@ def apply_package_auto_dates(
         elif old_status == "done" and new_status != "done":
             chip_meta.pop("pcb_ready", None)
 
-            firestore_update_field(
+            update_run_field(
                 "runs",
                 loaded_run_doc_id,
                 f"metadata.package.chips.{chip_uid}.pcb_ready",
@@ -140,7 +109,7 @@ def apply_package_auto_dates(
             if not chip_meta.get("bond_date"):
                 chip_meta["bond_date"] = now
 
-                firestore_update_field(
+                update_run_field(
                     "runs",
                     loaded_run_doc_id,
                     f"metadata.package.chips.{chip_uid}.bond_date",
@@ -153,7 +122,7 @@ def apply_package_auto_dates(
         elif old_status == "done" and new_status != "done":
             chip_meta.pop("bond_date", None)
 
-            firestore_update_field(
+            update_run_field(
                 "runs",
                 loaded_run_doc_id,
                 f"metadata.package.chips.{chip_uid}.bond_date",
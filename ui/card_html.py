@@ -0,0 +1,330 @@
+# ui/card_html.py
+
+import html
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from core.model import Chip, Substep
+
+
+# ============================================================
+# RUN CARD HTML (layer cards, chip badges, progress bars)
+# ============================================================
+#
+# Same markup the viewer built by concatenation, from templates
+# compiled once (bound str.format) and memoized:
+#
+#   run    : get_doc_memo("viewer") keeps each run's card per
+#            (name, updateTime), so an unchanged run is one lookup
+#   layer  : layer_card_html resolves everything the card shows (names,
+#            chip fields, progress) into a tuple, the layer's content
+#            key, and renders only keys it has not seen. A changed run
+#            re-renders only its changed layers; identical layers of
+#            different runs share one string.
+#   chip / progress bar : lru_cache on their few inputs
+#
+# Every cache is bounded (least recently used first out), so wall
+# displays that stay open for weeks keep a flat footprint.
+
+CARD_CACHE_SIZE = int(os.environ.get("VIEWER_CARD_CACHE", "4000"))    # layer cards
+CHIP_CACHE_SIZE = 4096
+
+
+class HtmlMemo:
+    """Bounded LRU of rendered HTML keyed by a content tuple."""
+
+    def __init__(self, max_entries=CARD_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            html_ = self._items.get(key)
+            if html_ is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return html_
+            self.misses += 1
+
+        html_ = render(key)
+
+        with self._lock:
+            self._items[key] = html_
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return html_
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+
+_layer_cards = HtmlMemo()
+
+
+def card_cache_stats():
+    return {
+        "layers": len(_layer_cards),
+        "hits": _layer_cards.hits,
+        "misses": _layer_cards.misses,
+        "chips": chip_badge_html.cache_info().currsize,
+    }
+
+
+# ============================================================
+# TEMPLATES
+# ============================================================
+
+_CHIP = (
+    "<span class='layer-chip' "
+    "style='background:{bg};color:{fg};padding:3px 6px;"
+    "border-radius:4px;font-size:0.78rem;' "
+    "title='{tooltip}'>"
+    "{name}"
+    "</span>"
+).format
+
+_BAR = '<div class="fab-progress {bar_class}"><div{fill} style="width:{pct}%"></div></div>'.format
+
+_CARD = (
+    "<div class='{card_class}'>"
+    "<div class='layer-card-title'>{title}</div>"
+    "{body}"
+    "</div>"
+).format
+
+_TITLE = "{prefix}{layer_name} ({progress}%){bar}".format
+
+_SUB_NAME = "<div style='font-size:0.80rem; font-weight:600; color:#333;'>{name}</div>".format
+
+_PACKAGE_ROW = "<div style='display:flex; gap:14px; margin-top:4px;'>{cells}</div>".format
+
+_PACKAGE_CELL = (
+    "<div style='flex:1;'>"
+    "{name}"
+    "<div class='layer-chip-container'>{chips}</div>"
+    "</div>"
+).format
+
+_SUBSTEP = (
+    "<div style='margin-top:3px;margin-bottom:2px;'>"
+    "{name}"
+    "<div class='layer-chip-container'>{chips}</div>"
+    "</div>"
+).format
+
+# visual status -> (background, text)
+_CHIP_COLORS = {
+    "done":        ("#d4edda", "#155724"),   # green
+    "terminate":   ("#F44336", "#FFFFFF"),   # true red
+    "in_progress": ("#fff3cd", "#856404"),   # yellow
+}
+_CHIP_PENDING = ("#eeeeee", "#555555")       # gray
+
+
+# ============================================================
+# CHIP BADGE / PROGRESS BAR
+# ============================================================
+
+def _chip_key(chip):
+    if type(chip) is Chip:
+        # parse_layers output: plain attributes, no mapping lookups
+        return (
+            (chip.status or "pending").lower(),
+            (chip.name or "").strip(),
+            (chip.type or "").strip().lower(),
+            chip.started_at or "",
+            chip.completed_at or "",
+        )
+    return (
+        (chip.get("status", "pending") or "pending").lower(),
+        (chip.get("name") or "").strip(),
+        (chip.get("type") or "").strip().lower(),
+        chip.get("started_at") or "",
+        chip.get("completed_at") or "",
+    )
+
+
+@lru_cache(maxsize=CHIP_CACHE_SIZE)
+def chip_badge_html(status, name, chip_type="", started="", completed=""):
+    # storage / delivery chips show their slot (store#1, delivery#2, ...)
+    if chip_type == "storage" or name.lower() == "storage":
+        label, visual = (status, "done") if status.startswith("store#") else ("storage", "pending")
+    elif chip_type == "delivery" or name.lower() == "delivery":
+        label, visual = (status, "done") if status.startswith("delivery#") else ("delivery", "pending")
+    else:
+        label, visual = name, status
+
+    bg, fg = _CHIP_COLORS.get(visual, _CHIP_PENDING)
+    tooltip = "&#10;".join([
+        html.escape(f"started at : {started}" if started else "started at :"),
+        html.escape(f"completed at : {completed}" if completed else "completed at :"),
+    ])
+    return _CHIP(bg=bg, fg=fg, tooltip=tooltip, name=html.escape(label))
+
+
+def chip_html(chip):
+    """Badge for one chip (dict or core.model.Chip)."""
+    return chip_badge_html(*_chip_key(chip))
+
+
+@lru_cache(maxsize=512)
+def progress_bar_html(pct: int, bar_class: str = "", terminated: bool = False) -> str:
+    """
+    pct: 0–100 (empty at 0, static at 100 or when terminated, animated between)
+    bar_class: "overall", "layer", "chip" (optional)
+    """
+    pct = int(pct)
+    if pct <= 0:
+        return _BAR(bar_class=bar_class, fill="", pct=0)
+    if pct >= 100 or terminated:
+        return _BAR(bar_class=bar_class, fill=' class="fab-progress-fill-complete"', pct=pct)
+    return _BAR(bar_class=bar_class, fill=' class="fab-progress-fill-flow"', pct=pct)
+
+
+# ============================================================
+# LAYER CARD
+# ============================================================
+
+def _sub_name(sub):
+    if type(sub) is Substep:
+        return sub.display_name
+    if isinstance(sub, str):
+        return sub
+    if isinstance(sub, dict):
+        for value in (sub.get("label"), sub.get("name")):
+            if isinstance(value, dict):
+                return value.get("stringValue")
+            if isinstance(value, str):
+                return value
+    return "Unknown"
+
+
+def _package_chip_labels(layers):
+    return {
+        sub.get("chip_uid"): sub.get("label") or sub.get("name") or "Unknown"
+        for layer in layers or ()
+        if layer.get("layer_name") == "Package"
+        for sub in layer.get("substeps", [])
+        if sub.get("chip_uid")
+    }
+
+
+def _measure_chip_uids(fields):
+    fridges = (
+        (fields or {}).get("metadata", {})
+        .get("mapValue", {}).get("fields", {})
+        .get("measure", {})
+        .get("mapValue", {}).get("fields", {})
+        .get("fridges", {})
+        .get("mapValue", {}).get("fields", {})
+    )
+    return {
+        uid: f.get("mapValue", {}).get("fields", {}).get("chip_uid", {}).get("stringValue")
+        for uid, f in fridges.items()
+    }
+
+
+def layer_card_key(layer, idx=None, fridge_labels=None, fields=None, layers=None):
+    """
+    Everything the card shows, as a hashable tuple:
+    (idx, layer_name, progress, ((substep name, (chip key, ...)), ...))
+    """
+    substeps = layer["substeps"]
+    names = [_sub_name(sub) for sub in substeps]
+
+    # Measurement: indexed fridge label + the measured chip's label
+    if layer.get("layer_name") == "Measurement":
+        chip_uids = _measure_chip_uids(fields)
+        chip_labels = _package_chip_labels(layers)
+        for i, sub in enumerate(substeps):
+            if not isinstance(sub, (dict, Substep)):
+                continue
+            fridge_uid = sub.get("fridge_uid")
+            if fridge_labels and fridge_uid and fridge_uid in fridge_labels:
+                names[i] = fridge_labels[fridge_uid]
+            chip_label = chip_labels.get(chip_uids.get(fridge_uid))
+            if chip_label:
+                names[i] = f"{names[i]} ({chip_label})"
+
+    return (
+        idx,
+        layer["layer_name"],
+        int(layer.get("progress", 0)),
+        tuple(
+            (name, tuple(_chip_key(c) for c in sub["chips"]))
+            for name, sub in zip(names, substeps)
+        ),
+    )
+
+
+def _card_class(lname, progress, subs):
+    statuses = [[c[0] for c in chips] for _, chips in subs]
+
+    if lname in ("package", "measurement"):
+        if progress == 0:
+            # terminated only if every substep has a terminated chip
+            if subs and all("terminate" in s for s in statuses):
+                return "layer-card terminated-layer"
+            return "layer-card pending-layer"
+        if progress == 100:
+            return "layer-card done-layer"
+        return "layer-card progress-layer"
+
+    if any("terminate" in s for s in statuses):
+        return "layer-card terminated-layer"
+    if progress == 100:
+        return "layer-card done-layer"
+    if progress > 0:
+        return "layer-card progress-layer"
+    return "layer-card pending-layer"
+
+
+def _chips(chip_keys):
+    return " ".join(chip_badge_html(*k) for k in chip_keys)
+
+
+def render_layer_card(key):
+    """HTML of one layer card from its layer_card_key."""
+    idx, layer_name, progress, subs = key
+    lname = layer_name.lower()
+
+    if lname == "package":
+        # 2-column grid
+        body = "".join(
+            _PACKAGE_ROW(cells="".join(
+                _PACKAGE_CELL(name=_SUB_NAME(name=name), chips=_chips(chips))
+                for name, chips in subs[i:i + 2]
+            ))
+            for i in range(0, len(subs), 2)
+        )
+    else:
+        hide_names = lname in ("design", "fabrication", "fab")
+        body = "".join(
+            _SUBSTEP(name="" if hide_names else _SUB_NAME(name=name), chips=_chips(chips))
+            for name, chips in subs
+        )
+
+    card_class = _card_class(lname, progress, subs)
+    title = _TITLE(
+        prefix=f"{idx + 1}. " if idx is not None else "",
+        layer_name=layer_name,
+        progress=progress,
+        bar=progress_bar_html(progress, "layer", terminated=card_class == "layer-card terminated-layer"),
+    )
+    return _CARD(card_class=card_class, title=title, body=body)
+
+
+def layer_card_html(layer, idx=None, fridge_labels=None, fields=None, layers=None):
+    """Layer card (memoized on its content key)."""
+    key = layer_card_key(layer, idx, fridge_labels=fridge_labels, fields=fields, layers=layers)
+    return _layer_cards.get_or_render(key, render_layer_card)
@@ -1,7 +1,10 @@
 
 import streamlit as st
 from core.metadata import (normalize_meta, ensure_kv_rows, build_package_chip_meta, get_package_chips, get_measure_fridges)
-from firebase_client import firestore_set, firestore_update_field, firestore_get, firestore_to_python
+from firebase_client import firestore_get, firestore_to_python
+from services.run_changes import set_run, update_run_field
+from services.run_query import run_filter_fields
+from notion.notion_worker import NOTION_WORKERS, SCRIPT_JOBS, NotionJobError, WorkerUnavailable, get_worker_pool
 import copy
 import datetime
 import os
@@ -51,13 +54,31 @@ def _pick_meas_db_url(fridge_label: str) -> str:
     return ""
 
 
-def run_notion_subprocess(*, script_path: str, payload: dict) -> dict:
+def _notion_env() -> dict:
     env = os.environ.copy()
     env["NOTION_TOKEN"] = st.secrets["notion"]["NOTION_TOKEN"]
     env["NOTION_FAB_DB_URL"] = st.secrets["notion"]["NOTION_FAB_DB_URL"]
     env["NOTION_MEAS_DB_URL_ICEOXFORD"] = st.secrets["notion"]["NOTION_MEAS_DB_URL_ICEOXFORD"]
     env["NOTION_MEAS_DB_URL_BLUEFORS"]  = st.secrets["notion"]["NOTION_MEAS_DB_URL_BLUEFORS"]
-   
+    if "NOTION_FABDATA_DB_URLS" in st.secrets["notion"]:
+        env["NOTION_FABDATA_DB_URLS"] = json.dumps(list(st.secrets["notion"]["NOTION_FABDATA_DB_URLS"]))
+    return env
+
+
+def run_notion_subprocess(*, script_path: str, payload: dict) -> dict:
+    env = _notion_env()
+
+    # ✅ warm worker first (no interpreter start / re-import per call);
+    #    the one-shot subprocess below stays as the fallback
+    job = SCRIPT_JOBS.get(script_path)
+    if job and NOTION_WORKERS > 0:
+        try:
+            return get_worker_pool(env).submit(job, payload)
+        except WorkerUnavailable as e:
+            print("⚠️ Notion worker unavailable, using subprocess:", e)
+        except NotionJobError as e:
+            raise RuntimeError(str(e))
+
     p = subprocess.run(
         [sys.executable, script_path, json.dumps(payload)],
         capture_output=True,
@@ -377,7 +398,7 @@ def render_design_override(*, loaded_run_no, loaded_run_doc_id, fields, layers_p
                         completed_row["value"] = new_val
                         st.session_state["design_completed_overridden"] = True
 
-                        firestore_set(
+                        set_run(
                             "runs",
                             loaded_run_doc_id,
                             {
@@ -387,6 +408,7 @@ def render_design_override(*, loaded_run_no, loaded_run_doc_id, fields, layers_p
                                 "creator": fields["creator"]["stringValue"],
                                 "steps": layers_py,
                                 "metadata": update_meta,
+                                **run_filter_fields(update_meta),
                             },
                             id_token=id_token,
                         )
@@ -480,7 +502,7 @@ def render_fab_override(*, loaded_run_no, loaded_run_doc_id, fields, layers_py,
 
                             row["value"] = new_val
 
-                            firestore_set(
+                            set_run(
                                 "runs",
                                 loaded_run_doc_id,
                                 {
@@ -490,6 +512,7 @@ def render_fab_override(*, loaded_run_no, loaded_run_doc_id, fields, layers_py,
                                     "creator": fields["creator"]["stringValue"],
                                     "steps": layers_py,
                                     "metadata": update_meta,
+                                    **run_filter_fields(update_meta),
                                 },
                                 id_token=id_token,
                             )
@@ -539,7 +562,7 @@ def save_package_info_core(
     # keeps pcb_ready / bond_date; updates only editable fields
     full_meta["package"]["chips"][chip_uid] = {**existing, **updated}
 
-    firestore_set(
+    set_run(
         "runs",
         loaded_run_doc_id,
         {
@@ -549,6 +572,7 @@ def save_package_info_core(
             "creator": fields["creator"]["stringValue"],
             "steps": update_layers,
             "metadata": full_meta,
+            **run_filter_fields(full_meta),
         },
         id_token=id_token,
     )
@@ -648,7 +672,7 @@ def render_package_override(*, chip_uid, chip_label, chip_meta_live, fields, upd
                                 .setdefault("chips", {}) \
                                 .setdefault(chip_uid, {})[key] = new_val
 
-                            firestore_update_field(
+                            update_run_field(
                                 "runs",
                                 loaded_run_doc_id,
                                 f"metadata.package.chips.{chip_uid}.{key}",
@@ -721,7 +745,7 @@ def save_measure_info_core(
 
     cur = full_meta["measure"]["fridges"][fridge_uid]
   
-    firestore_set(
+    set_run(
         "runs",
         loaded_run_doc_id,
         {
@@ -731,6 +755,7 @@ def save_measure_info_core(
             "creator": fields["creator"]["stringValue"],
             "steps": update_layers,
             "metadata": full_meta,
+            **run_filter_fields(full_meta),
         },
         id_token=id_token,
     )
@@ -839,7 +864,7 @@ def render_measure_override(
                                     .setdefault("fridges", {}) \
                                     .setdefault(fridge_uid, {})[meta_key] = new_val
 
-                                firestore_update_field(
+                                update_run_field(
                                     "runs",
                                     loaded_run_doc_id,
                                     f"metadata.measure.fridges.{fridge_uid}.{meta_key}",
@@ -993,7 +1018,7 @@ def render_measure_override(
                             .setdefault("fridges", {}) \
                             .setdefault(fridge_uid, {})["storage_time"] = new_val
 
-                        firestore_update_field(
+                        update_run_field(
                             "runs",
                             loaded_run_doc_id,
                             f"metadata.measure.fridges.{fridge_uid}.storage_time",
@@ -1,14 +1,14 @@
 # viewer.py  (clean, multi-layer grid with arrows)
 import streamlit as st
 import requests
-from firebase_client import firebase_sign_in_with_google, BASE_URL, firebase_refresh_id_token
+from firebase_client import firebase_sign_in_with_google, session_token_manager
 import streamlit.components.v1 as components
-import copy
-import time
-import html as html_escape
 from core.metadata import get_measure_fridges
+from core.firestore_codec import decode_value
 from ui.metadata_ui import format_range
 import urllib.parse
+from services.run_snapshot import runs_cache, get_doc_memo, VIEWER_RUNS_LIMIT
+from ui import card_html
 
 if "force_reset" not in st.session_state:
     st.session_state.clear()
@@ -769,6 +769,11 @@ def get_num(field_dict, default=0):
 def parse_layers(fields):
     """Return normalized list of layers & substeps.
 
+    Walks the wire format by hand into plain dicts: building
+    core.model Layer / Substep / Chip objects costs more than it saves
+    here (benchmarks/bench_firestore_decode.py), and the cards only
+    read them (ui/card_html takes dicts or model objects).
+
     Output format:
     [
       {
@@ -786,8 +791,6 @@ def parse_layers(fields):
     if not root:
         return []
 
-    first = root[0]["mapValue"]["fields"]
-
     layers = []
     for lv in root:
         f = lv["mapValue"]["fields"]
@@ -1011,59 +1014,9 @@ def parse_metadata_section(section):
     # """
     # return html
 
-def list_runs(id_token):
-    url = f"{BASE_URL}/runs"
-    r = requests.get(
-        url,
-        headers={"Authorization": f"Bearer {id_token}"}
-    )
-
-    if r.status_code != 200:
-        st.error("Failed to fetch runs.")
-        return []
-
-    j = r.json()
-    return j.get("documents", [])
-
-
-
-
 def firestore_to_python(v):
-    if not isinstance(v, dict):
-        return v
-
-    # string
-    if "stringValue" in v:
-        return v["stringValue"]
-
-    # int
-    if "integerValue" in v:
-        return int(v["integerValue"])
-
-    # float
-    if "doubleValue" in v:
-        return float(v["doubleValue"])
-
-    # bool
-    if "booleanValue" in v:
-        return bool(v["booleanValue"])
-
-    # ✅ ADD THIS — timestamp
-    if "timestampValue" in v:
-        return v["timestampValue"]
-
-    # map
-    if "mapValue" in v:
-        return {
-            kk: firestore_to_python(vv)
-            for kk, vv in v["mapValue"].get("fields", {}).items()
-        }
-
-    if "nullValue" in v:
-        return ""
-
-    return v
-
+    # Shared decoder; the viewer renders missing values as "" (nullValue -> "")
+    return decode_value(v, null="")
 
 
 
@@ -1104,307 +1057,17 @@ def get_meta_data(fields, meta_data_child: str, target_key: str):
 
 
 def substep_chip_html(chip):
-    raw_status = chip.get("status", "pending")
-    status = (raw_status or "pending").lower()
-
-    chip_name = (chip.get("name") or "").strip()
-    chip_type = (chip.get("type") or "").strip().lower()
-
-    # 🔑 special chip detection (robust fallback)
-    is_storage  = (chip_type == "storage")  or (chip_name.lower() == "storage")
-    is_delivery = (chip_type == "delivery") or (chip_name.lower() == "delivery")
-
-    # ----------------------------------
-    # Special display mapping
-    # ----------------------------------
-    if is_storage:
-        if status.startswith("store#"):
-            display_label = status          # store#1, store#2, ...
-            visual_status = "done"          # reuse green
-        else:
-            display_label = "storage"
-            visual_status = "pending"       # reuse gray
-
-    elif is_delivery:
-        if status.startswith("delivery#"):
-            display_label = status          # delivery#1, delivery#2, ...
-            visual_status = "done"          # reuse green
-        else:
-            display_label = "delivery"
-            visual_status = "pending"       # reuse gray
-
-    else:
-        display_label = chip_name
-        visual_status = status
-
-    # --- your original colors (UNCHANGED) ---
-    # if visual_status == "done":
-    #     bg, fg = "#d4edda", "#155724"
-    # elif visual_status == "in_progress":
-    #     bg, fg = "#fff3cd", "#856404"
-    # else:
-    #     bg, fg = "#eeeeee", "#555555"
-
-    if visual_status == "done":
-        bg, fg = "#d4edda", "#155724"      # green
-    elif visual_status == "terminate":
-        bg, fg = "#F44336", "#FFFFFF"      # TRUE RED
-    elif visual_status == "in_progress":
-        bg, fg = "#fff3cd", "#856404"      # yellow
-    else:
-        bg, fg = "#eeeeee", "#555555"      # gray
-
-
-    # --- timestamps (may be empty) ---
-    started = chip.get("started_at") or ""
-    completed = chip.get("completed_at") or ""
-
-    def line(label, value):
-        return f"{label} : {value}" if value else f"{label} :"
-
-    tooltip = "&#10;".join([
-        html_escape.escape(line("started at", started)),
-        html_escape.escape(line("completed at", completed)),
-    ])
-
-    name_html = html_escape.escape(display_label)
-
-    return (
-        f"<span class='layer-chip' "
-        f"style='background:{bg};color:{fg};padding:3px 6px;"
-        f"border-radius:4px;font-size:0.78rem;' "
-        f"title='{tooltip}'>"
-        f"{name_html}"
-        f"</span>"
-    )
-
-
+    return card_html.chip_html(chip)
 
 
 def layer_card_html(layer, idx=None, fridge_labels=None, fields=None, layers=None):
-
-
-    if idx is not None:
-        title_prefix = f"{idx + 1}. "
-    else:
-        title_prefix = ""
-
-    is_package = layer["layer_name"].lower() == "package"
-
-
-    progress = int(layer.get("progress", 0))
-    substeps = layer["substeps"]
-
-    # detect terminate in this layer
-    has_terminate = any(
-        (c.get("status") or "").lower() == "terminate"
-        for sub in substeps
-        for c in sub.get("chips", [])
-    )
-
-
-    # title_html = (
-    #     f"{title_prefix}{layer['layer_name']} ({progress}%)"
-    #     # f"{fab_progress_bar(progress, 'layer', terminated=has_terminate)}"
-    #     f"{fab_progress_bar(progress, 'layer')}"
-    # )
-
-    # substeps expanded
-    body_html = ""
-    is_package = layer["layer_name"].lower() == "package"
-
-
-    if is_package:
-        # -----------------------------
-        # Package: 2-column grid layout
-        # -----------------------------
-        for i in range(0, len(substeps), 2):
-            body_html += "<div style='display:flex; gap:14px; margin-top:4px;'>"
-
-            for sub in substeps[i:i+2]:
-                # ---- resolve substep label (same logic as before) ----
-                if isinstance(sub, str):
-                    sub_name = sub
-                elif isinstance(sub, dict):
-                    label = sub.get("label")
-                    name = sub.get("name")
-
-                    if isinstance(label, dict):
-                        sub_name = label.get("stringValue")
-                    elif isinstance(label, str):
-                        sub_name = label
-                    elif isinstance(name, dict):
-                        sub_name = name.get("stringValue")
-                    elif isinstance(name, str):
-                        sub_name = name
-                    else:
-                        sub_name = "Unknown"
-                else:
-                    sub_name = "Unknown"
-
-                chips_html = " ".join(substep_chip_html(c) for c in sub["chips"])
-
-                body_html += (
-                    "<div style='flex:1;'>"
-                    f"<div style='font-size:0.80rem; font-weight:600; color:#333;'>{sub_name}</div>"
-                    f"<div class='layer-chip-container'>{chips_html}</div>"
-                    "</div>"
-                )
-
-            body_html += "</div>"
-
-    else:
-        # --------------------------------
-        # All other layers: original layout
-        # --------------------------------
-        for sub in substeps:
-
-            # -----------------------------
-            # Resolve substep name (UNCHANGED)
-            # -----------------------------
-            if isinstance(sub, str):
-                sub_name = sub
-
-            elif isinstance(sub, dict):
-                label = sub.get("label")
-                name = sub.get("name")
-
-                if isinstance(label, dict):
-                    sub_name = label.get("stringValue")
-                elif isinstance(label, str):
-                    sub_name = label
-                elif isinstance(name, dict):
-                    sub_name = name.get("stringValue")
-                elif isinstance(name, str):
-                    sub_name = name
-                else:
-                    sub_name = "Unknown"
-
-            else:
-                sub_name = "Unknown"
-
-
-            display_name = sub_name
-
-            # ------------------------------------------------------------
-            # Measurement card: show indexed fridge label + chip label
-            # (ONLY affects the top card, not the metadata table)
-            # ------------------------------------------------------------
-            if layer.get("layer_name") == "Measurement" and isinstance(sub, dict):
-                fridge_uid = sub.get("fridge_uid")
-
-                # 1) indexed fridge label (Bluefors (1), Bluefors (2), ...)
-                if fridge_labels and fridge_uid and fridge_uid in fridge_labels:
-                    display_name = fridge_labels[fridge_uid]
-
-                # 2) append chip label (C01, C02, ...) from metadata.measure.fridges[uid].chip_uid
-                f = fields or {}
-                chip_uid = (
-                    f.get("metadata", {})
-                     .get("mapValue", {})
-                     .get("fields", {})
-                     .get("measure", {})
-                     .get("mapValue", {})
-                     .get("fields", {})
-                     .get("fridges", {})
-                     .get("mapValue", {})
-                     .get("fields", {})
-                     .get(fridge_uid, {})
-                     .get("mapValue", {})
-                     .get("fields", {})
-                     .get("chip_uid", {})
-                     .get("stringValue")
-                )
-
-                pkg_chips = get_package_chips(layers or st.session_state.get("parsed_layers", []))
-                chip_label = pkg_chips.get(chip_uid)
-
-                if chip_label:
-                    display_name = f"{display_name} ({chip_label})"
-
-
-
-            chips_html = " ".join(substep_chip_html(c) for c in sub["chips"])
-
-            hide_substep_label = layer["layer_name"].lower() in ("design", "fabrication", "fab")
-
-            body_html += (
-                f"<div style='margin-top:3px;margin-bottom:2px;'>"
-                + (
-                    ""
-                    if hide_substep_label
-                    else f"<div style='font-size:0.80rem; font-weight:600; color:#333;'>{display_name}</div>"
-                )
-                + f"<div class='layer-chip-container'>{chips_html}</div>"
-                + "</div>"
-            )
-
-
-    lname = layer["layer_name"].lower()
-
-    # ------------------------------------------
-    # PACKAGE + MEASUREMENT → corrected scheme
-    # ------------------------------------------
-    if lname in ("package", "measurement"):
-
-        if progress == 0:
-
-            total_substeps = len(substeps)
-            terminated_substeps = 0
-
-            for sub in substeps:
-                chips = sub.get("chips", [])
-
-                # A substep is considered terminated
-                # if ANY chip inside is terminated
-                if any(
-                    (c.get("status") or "").lower() == "terminate"
-                    for c in chips
-                ):
-                    terminated_substeps += 1
-
-            if total_substeps > 0 and terminated_substeps == total_substeps:
-                card_class = "layer-card terminated-layer"   # 🔴 all substeps terminated
-            else:
-                card_class = "layer-card pending-layer"      # ⚪ not all terminated
-
-        elif progress == 100:
-            card_class = "layer-card done-layer"
-
-        else:
-            card_class = "layer-card progress-layer"
-
-    # ------------------------------------------
-    # DESIGN + FAB → original logic untouched
-    # ------------------------------------------
-    else:
-        if has_terminate:
-            card_class = "layer-card terminated-layer"
-        elif progress == 100:
-            card_class = "layer-card done-layer"
-        elif progress > 0:
-            card_class = "layer-card progress-layer"
-        else:
-            card_class = "layer-card pending-layer"
-
-
-    # -------------------------------------------------
-    # 🔥 Animation should follow card color semantics
-    # -------------------------------------------------
-    layer_is_terminated = (card_class == "layer-card terminated-layer")
-
-    title_html = (
-        f"{title_prefix}{layer['layer_name']} ({progress}%)"
-        f"{fab_progress_bar(progress, 'layer', terminated=layer_is_terminated)}"
-    )
-
-
-    # Final return
-    return (
-        f"<div class='{card_class}'>"
-        f"<div class='layer-card-title'>{title_html}</div>"
-        f"{body_html}"
-        "</div>"
+    # templates + content-keyed memo: ui/card_html.py
+    return card_html.layer_card_html(
+        layer,
+        idx,
+        fridge_labels=fridge_labels,
+        fields=fields,
+        layers=layers or st.session_state.get("parsed_layers", []),
     )
 
 
@@ -1413,27 +1076,8 @@ def fab_progress_bar(pct: int, bar_class: str = "", terminated: bool = False) ->
     pct: 0–100
     bar_class: "overall", "layer", "chip" (optional)
     """
-    pct = int(pct)
-
-    # Add "fab-progress" + optional size class
-    wrapper = f'<div class="fab-progress {bar_class}">'
+    return card_html.progress_bar_html(int(pct), bar_class, terminated)
 
-    # 0% → empty
-    if pct <= 0:
-        return wrapper + '<div style="width:0%"></div></div>'
-
-    # 100% → completed (static)
-    if pct >= 100:
-        return wrapper + f'<div class="fab-progress-fill-complete" style="width:{pct}%"></div></div>'
-
-    # # 1–99% → animated stripes
-    # return wrapper + f'<div class="fab-progress-fill-flow" style="width:{pct}%"></div></div>'
-
-    # 1–99% → animated unless terminated
-    if terminated:
-        return wrapper + f'<div class="fab-progress-fill-complete" style="width:{pct}%"></div></div>'
-    else:
-        return wrapper + f'<div class="fab-progress-fill-flow" style="width:{pct}%"></div></div>'
 
 
 # -------------------------------------------------------------
@@ -1582,30 +1226,15 @@ if "viewer_user" not in st.session_state:
         st.stop()
 
     st.session_state["viewer_user"] = user
-    st.session_state["viewer_login_time"] = time.time()
 
     st.query_params.clear()
     st.rerun()
 
 
 
-# --- Auto-refresh token if expired ---
-expires_in = int(st.session_state.viewer_user.get("expiresIn", "3600"))
-login_time = st.session_state.get("login_time", time.time())
-
-# Check if 55 minutes passed
-if time.time() - login_time > 3300:  # 55 minutes
-    refresh_token = st.session_state.viewer_user["refreshToken"]
-    new_tokens = firebase_refresh_id_token(refresh_token)
-
-    # Update session_state with new tokens
-    st.session_state.viewer_user["idToken"] = new_tokens["id_token"]
-    st.session_state.viewer_user["refreshToken"] = new_tokens["refresh_token"]
-    st.session_state.viewer_user["expiresIn"] = new_tokens["expires_in"]
-    st.session_state.login_time = time.time()
-
-# Always use updated token
-token = st.session_state.viewer_user["idToken"]
+# Firebase ID token: refreshed ahead of expiry off the render path, and
+# on a 401 (firebase_client.TokenManager); passed as the token everywhere
+token = session_token_manager(st.session_state, "viewer_user")
 email = st.session_state.viewer_user["email"]
 
 
@@ -1811,8 +1440,27 @@ with top_right:
 
 
 
-runs = list_runs(token)
-# runs = list_runs()
+# Class + Fab-in/Fab-out filters run server-side (:runQuery);
+# Lot ID and device name are refined locally below.
+selected_class = st.session_state.get("viewer_run_class", "Main")
+
+# Newest VIEWER_RUNS_LIMIT runs by run_no; a Lot ID / device search looks
+# at every run (it is refined locally, after the query)
+runs_limit = None if (lotid_filter or device_filter) else (VIEWER_RUNS_LIMIT or None)
+
+try:
+    # Shared across tabs (TTL + single-flight); on refresh only runs whose
+    # updateTime moved are re-downloaded
+    runs = runs_cache.get(
+        token,
+        run_class=selected_class,
+        fabin_after=fabin_after,
+        fabout_before=fabout_before,
+        limit=runs_limit,
+    )
+except requests.RequestException:
+    st.error("Failed to fetch runs.")
+    runs = []
 
 if not runs:
     st.info("No runs found.")
@@ -1821,56 +1469,21 @@ if not runs:
 
 
 
-def get_meta_date_for_filter(fields, meta_data_child, target_key):
-    # Load metadata
-    meta = fields.get("metadata", {}).get("mapValue", {}).get("fields", {})
-    meta_child = meta.get(meta_data_child, {}).get("arrayValue", {}).get("values", [])
-
-    # Convert Firestore arrayValue → python
-    meta_child_py = [firestore_to_python(v) for v in meta_child]
-
-    # Extract target entry
-    return get_meta_value(meta_child_py, target_key)
-
-
 ############ new
 # ------------------------------------------------------------
 # APPLY FILTER LOGIC
 # ------------------------------------------------------------
 
-selected_class = st.session_state.get("viewer_run_class", "Main")
-
 def matches_filters(fields):
-    # -------------------------
-    # Run Class (ALWAYS applied)
-    # -------------------------
-    run_class = fields.get("class", {}).get("stringValue", "").strip()
-    if run_class != selected_class:
-        return False
-
     # -------------------------
     # Optional filters
+    # (Run Class + Fab-in/Fab-out already applied server-side by runs_cache.get)
     # -------------------------
-    run_no = fields["run_no"]["stringValue"]
     device = fields["device_name"]["stringValue"]
-    lot_id = get_meta_data(fields, "design", "Lotid")
-
-    fabin_str  = get_meta_date_for_filter(fields, "fab", "Fabin")
-    fabout_str = get_meta_date_for_filter(fields, "fab", "Fabout")
-
-    import datetime
-    def to_date(s):
-        if not s:
-            return None
-        for fmt in ("%Y-%m-%d", "%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S"):
-            try:
-                return datetime.datetime.strptime(str(s).strip(), fmt).date()
-            except ValueError:
-                pass
-        return None
-
-    fabin_date  = to_date(fabin_str)
-    fabout_date = to_date(fabout_str)
+    lot_id = (
+        fields.get("lot_id", {}).get("stringValue")
+        or get_meta_data(fields, "design", "Lotid")
+    )
 
     # Optional filters
     # if run_filter and run_filter.lower() not in run_no.lower():
@@ -1883,14 +1496,6 @@ def matches_filters(fields):
     if device_filter and device_filter.lower() not in device.lower():
         return False
 
-    if fabin_after:
-        if not fabin_date or fabin_date < fabin_after:
-            return False
-
-    if fabout_before:
-        if not fabout_date or fabout_date > fabout_before:
-            return False
-
     return True
 
 
@@ -1926,15 +1531,23 @@ filtered_runs = [doc for doc in runs if matches_filters(doc["fields"])]
 filtered_runs.sort(key=lambda d: d["fields"]["run_no"]["stringValue"], reverse=True)
 
 
-for doc in filtered_runs:
-    # fields = doc["fields"]
-    fields = copy.deepcopy(doc["fields"])
+def make_unique_label(base, existing_labels, force_index=False):
+    if not force_index and base not in existing_labels:
+        return base
+    i = 1
+    while f"{base} ({i})" in existing_labels:
+        i += 1
+    return f"{base} ({i})"
+
+
+def build_run_card(fields):
+    """
+    Everything on a run card that depends only on the run document.
+    Memoized per (name, updateTime), so unchanged runs skip parse_layers
+    and HTML generation on every autorefresh tick.
+    """
     run_no = fields["run_no"]["stringValue"]
     device = fields["device_name"]["stringValue"]
-    created_date = fields["created_date"]["stringValue"]
-    creator = fields["creator"]["stringValue"]
-
-    cooldown_triggered = False
 
     layers = parse_layers(fields)
     # st.write("DEBUG PARSED LAYERS:", layers)   # ← ADD HERE
@@ -1946,14 +1559,6 @@ for doc in filtered_runs:
     # ------------------------------------------------------------
     raw_fridges = get_measure_fridges(layers)
 
-    def make_unique_label(base, existing_labels, force_index=False):
-        if not force_index and base not in existing_labels:
-            return base
-        i = 1
-        while f"{base} ({i})" in existing_labels:
-            i += 1
-        return f"{base} ({i})"
-
     # count base labels
     base_counts = {}
     for base in raw_fridges.values():
@@ -2060,25 +1665,6 @@ for doc in filtered_runs:
 
 
 
-
-    # ---------------------------------------------------
-    # 🔍 CHECK COOLDOWN CHIP STATUS (PUT THIS HERE)
-    # ---------------------------------------------------
-    for layer in layers:
-        if layer["layer_name"].lower() == "measurement":
-            for sub in layer["substeps"]:
-                for chip in sub["chips"]:
-                    # st.write("DEBUG CHIP:", chip)
-
-                    # if chip["name"].lower() == "cooldown":
-                    if "cool" in chip["name"].lower():
-                        status = chip["status"]
-                        if status in ("in_progress", "done"):
-                            cooldown_triggered = True
-    # ----------------------------------------------------
- 
-
-
     def is_completed(c):
         status = (c.get("status") or "").lower()
         return (
@@ -2163,7 +1749,6 @@ for doc in filtered_runs:
 
 
 
-    design_date = get_meta_data(fields,"design", "Completed")
     fab_in = format_date_compact(get_meta_data(fields,"fab", "Fabin"))
     fab_out = format_date_compact(get_meta_data(fields,"fab", "Fabout"))
     lot_id = get_meta_data(fields,"design", "Lotid")
@@ -2206,15 +1791,6 @@ for doc in filtered_runs:
 
 
 
-    # detect terminate anywhere in run (for overall progress bar)
-    has_terminate_global = any(
-        (c.get("status") or "").lower() == "terminate"
-        for l in layers
-        for s in l.get("substeps", [])
-        for c in s.get("chips", [])
-    )
-
-
     dashboard_events = collect_dashboard_events_from_metadata(
         fields=fields,
         layers=layers,
@@ -2255,7 +1831,6 @@ for doc in filtered_runs:
 
     for l in layers:
         lname = (l.get("layer_name") or "").lower()
-        progress_l = int(l.get("progress", 0))
         substeps_l = l.get("substeps", [])
 
         # PACKAGE + MEASUREMENT
@@ -2348,8 +1923,42 @@ for doc in filtered_runs:
 
     auto_expand = not all_done
 
+    # Visible label (what user sees)
+    visible_label = (
+        f"#️ {run_no} ㅤ ⌨ {device} ㅤ 🆔 {lot_id} ㅤ ⚒️ fab {date_only(fab_in)} ➔ {date_only(fab_out)} ㅤ ❄️ Cooldown Start : {cooldown_banner_text}"
+    )
+
+    return {
+        "layers": layers,
+        "raw_fridges": raw_fridges,
+        "base_counts": base_counts,
+        "fridge_labels": fridge_labels,
+        "fridge_labels_no_chip": fridge_labels_no_chip,
+        "lot_id": lot_id,
+        "html": html,
+        "auto_expand": auto_expand,
+        "visible_label": visible_label,
+    }
+
+
+run_cards = get_doc_memo("viewer")
 
 
+for doc in filtered_runs:
+    # Snapshot documents are shared across reruns: read-only, no deepcopy
+    fields = doc["fields"]
+    card = run_cards.get_or_build(doc, lambda: build_run_card(fields))
+
+    layers = card["layers"]
+    raw_fridges = card["raw_fridges"]
+    base_counts = card["base_counts"]
+    fridge_labels = dict(card["fridge_labels"])   # tab_meas adds chip labels
+    fridge_labels_no_chip = card["fridge_labels_no_chip"]
+    lot_id = card["lot_id"]
+    html = card["html"]
+    auto_expand = card["auto_expand"]
+    visible_label = card["visible_label"]
+
     # If refinement filters applied → always expand
     if refinement_active:
         auto_expand = True
@@ -2359,10 +1968,7 @@ for doc in filtered_runs:
     # EXPANDER FOR THIS RUN
     # ----------------------------
 
-    # Visible label (what user sees)
-    visible_label = (
-        f"#️ {run_no} ㅤ ⌨ {device} ㅤ 🆔 {lot_id} ㅤ ⚒️ fab {date_only(fab_in)} ➔ {date_only(fab_out)} ㅤ ❄️ Cooldown Start : {cooldown_banner_text}"
-    )
+
     with st.expander(visible_label, expanded=auto_expand):
 
 
@@ -1,14 +1,16 @@
 # viewer.py  (clean, multi-layer grid with arrows)
 import streamlit as st
 import requests
-from firebase_client import firebase_sign_in_with_google, BASE_URL, firebase_refresh_id_token
+from firebase_client import firebase_sign_in_with_google, firebase_refresh_id_token
 import streamlit.components.v1 as components
-import copy
 import time
 import html as html_escape
 from core.metadata import get_measure_fridges
+from core.firestore_codec import decode_value
+from core.model import Substep
 from ui.metadata_ui import format_range
 import urllib.parse
+from services.run_snapshot import runs_cache, get_doc_memo, VIEWER_RUNS_LIMIT
 
 if "force_reset" not in st.session_state:
     st.session_state.clear()
@@ -771,6 +773,11 @@ def get_num(field_dict, default=0):
 def parse_layers(fields):
     """Return normalized list of layers & substeps.
 
+    Walks the wire format by hand into plain dicts: building
+    core.model Layer / Substep / Chip objects costs more than it saves
+    here (benchmarks/bench_firestore_decode.py), and the cards only
+    read them (ui/card_html takes dicts or model objects).
+
     Output format:
     [
       {
@@ -788,8 +795,6 @@ def parse_layers(fields):
     if not root:
         return []
 
-    first = root[0]["mapValue"]["fields"]
-
     layers = []
     for lv in root:
         f = lv["mapValue"]["fields"]
@@ -962,23 +967,6 @@ def parse_metadata_section(section):
 #     j = r.json()
 #     return j.get("documents", [])
 
-def list_runs():
-    url = f"{BASE_URL}/runs"
-    r = requests.get(url)
-
-    if r.status_code != 200:
-        st.error("Failed to fetch runs")
-        try:
-            st.write(r.json())
-        except Exception:
-            st.write(r.text)
-        return []
-
-    j = r.json()
-    return j.get("documents", [])
-
-
-
 # def list_runs(id_token):
 #     url = f"{BASE_URL}/runs"
 #     r = requests.get(
@@ -997,41 +985,8 @@ def list_runs():
 
 
 def firestore_to_python(v):
-    if not isinstance(v, dict):
-        return v
-
-    # string
-    if "stringValue" in v:
-        return v["stringValue"]
-
-    # int
-    if "integerValue" in v:
-        return int(v["integerValue"])
-
-    # float
-    if "doubleValue" in v:
-        return float(v["doubleValue"])
-
-    # bool
-    if "booleanValue" in v:
-        return bool(v["booleanValue"])
-
-    # ✅ ADD THIS — timestamp
-    if "timestampValue" in v:
-        return v["timestampValue"]
-
-    # map
-    if "mapValue" in v:
-        return {
-            kk: firestore_to_python(vv)
-            for kk, vv in v["mapValue"].get("fields", {}).items()
-        }
-
-    if "nullValue" in v:
-        return ""
-
-    return v
-
+    # Shared decoder; the viewer renders missing values as "" (nullValue -> "")
+    return decode_value(v, null="")
 
 
 
@@ -1193,7 +1148,7 @@ def layer_card_html(layer, idx=None, fridge_labels=None, fields=None, layers=Non
                 # ---- resolve substep label (same logic as before) ----
                 if isinstance(sub, str):
                     sub_name = sub
-                elif isinstance(sub, dict):
+                elif isinstance(sub, (dict, Substep)):
                     label = sub.get("label")
                     name = sub.get("name")
 
@@ -1291,7 +1246,7 @@ def layer_card_html(layer, idx=None, fridge_labels=None, fields=None, layers=Non
             if isinstance(sub, str):
                 sub_name = sub
 
-            elif isinstance(sub, dict):
+            elif isinstance(sub, (dict, Substep)):
                 label = sub.get("label")
                 name = sub.get("name")
 
@@ -1316,7 +1271,7 @@ def layer_card_html(layer, idx=None, fridge_labels=None, fields=None, layers=Non
             # Measurement card: show indexed fridge label + chip label
             # (ONLY affects the top card, not the metadata table)
             # ------------------------------------------------------------
-            if layer.get("layer_name") == "Measurement" and isinstance(sub, dict):
+            if layer.get("layer_name") == "Measurement" and isinstance(sub, (dict, Substep)):
                 fridge_uid = sub.get("fridge_uid")
 
                 # 1) indexed fridge label (Bluefors (1), Bluefors (2), ...)
@@ -1758,8 +1713,27 @@ with top_right:
 
 
 
-# runs = list_runs(token)
-runs = list_runs()
+# Class + Fab-in/Fab-out filters run server-side (:runQuery);
+# Lot ID and device name are refined locally below.
+selected_class = st.session_state.get("viewer_run_class", "Main")
+
+# Newest VIEWER_RUNS_LIMIT runs by run_no; a Lot ID / device search looks
+# at every run (it is refined locally, after the query)
+runs_limit = None if (lotid_filter or device_filter) else (VIEWER_RUNS_LIMIT or None)
+
+try:
+    # Shared across tabs (TTL + single-flight); on refresh only runs whose
+    # updateTime moved are re-downloaded
+    runs = runs_cache.get(
+        None,
+        run_class=selected_class,
+        fabin_after=fabin_after,
+        fabout_before=fabout_before,
+        limit=runs_limit,
+    )
+except requests.RequestException:
+    st.error("Failed to fetch runs.")
+    runs = []
 
 if not runs:
     st.info("No runs found.")
@@ -1767,56 +1741,21 @@ if not runs:
 
 
 
-def get_meta_date_for_filter(fields, meta_data_child, target_key):
-    # Load metadata
-    meta = fields.get("metadata", {}).get("mapValue", {}).get("fields", {})
-    meta_child = meta.get(meta_data_child, {}).get("arrayValue", {}).get("values", [])
-
-    # Convert Firestore arrayValue → python
-    meta_child_py = [firestore_to_python(v) for v in meta_child]
-
-    # Extract target entry
-    return get_meta_value(meta_child_py, target_key)
-
-
 ############ new
 # ------------------------------------------------------------
 # APPLY FILTER LOGIC
 # ------------------------------------------------------------
 
-selected_class = st.session_state.get("viewer_run_class", "Main")
-
 def matches_filters(fields):
-    # -------------------------
-    # Run Class (ALWAYS applied)
-    # -------------------------
-    run_class = fields.get("class", {}).get("stringValue", "").strip()
-    if run_class != selected_class:
-        return False
-
     # -------------------------
     # Optional filters
+    # (Run Class + Fab-in/Fab-out already applied server-side by runs_cache.get)
     # -------------------------
-    run_no = fields["run_no"]["stringValue"]
     device = fields["device_name"]["stringValue"]
-    lot_id = get_meta_data(fields, "design", "Lotid")
-
-    fabin_str  = get_meta_date_for_filter(fields, "fab", "Fabin")
-    fabout_str = get_meta_date_for_filter(fields, "fab", "Fabout")
-
-    import datetime
-    def to_date(s):
-        if not s:
-            return None
-        for fmt in ("%Y-%m-%d", "%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S"):
-            try:
-                return datetime.datetime.strptime(str(s).strip(), fmt).date()
-            except ValueError:
-                pass
-        return None
-
-    fabin_date  = to_date(fabin_str)
-    fabout_date = to_date(fabout_str)
+    lot_id = (
+        fields.get("lot_id", {}).get("stringValue")
+        or get_meta_data(fields, "design", "Lotid")
+    )
 
     # Optional filters
     # if run_filter and run_filter.lower() not in run_no.lower():
@@ -1829,14 +1768,6 @@ def matches_filters(fields):
     if device_filter and device_filter.lower() not in device.lower():
         return False
 
-    if fabin_after:
-        if not fabin_date or fabin_date < fabin_after:
-            return False
-
-    if fabout_before:
-        if not fabout_date or fabout_date > fabout_before:
-            return False
-
     return True
 
 
@@ -1872,15 +1803,23 @@ filtered_runs = [doc for doc in runs if matches_filters(doc["fields"])]
 filtered_runs.sort(key=lambda d: int(d["fields"]["run_no"]["stringValue"]), reverse=True)
 
 
-for doc in filtered_runs:
-    # fields = doc["fields"]
-    fields = copy.deepcopy(doc["fields"])
+def make_unique_label(base, existing_labels, force_index=False):
+    if not force_index and base not in existing_labels:
+        return base
+    i = 1
+    while f"{base} ({i})" in existing_labels:
+        i += 1
+    return f"{base} ({i})"
+
+
+def build_run_card(fields):
+    """
+    Everything on a run card that depends only on the run document.
+    Memoized per (name, updateTime), so unchanged runs skip parse_layers
+    and HTML generation on every autorefresh tick.
+    """
     run_no = fields["run_no"]["stringValue"]
     device = fields["device_name"]["stringValue"]
-    created_date = fields["created_date"]["stringValue"]
-    creator = fields["creator"]["stringValue"]
-
-    cooldown_triggered = False
 
     layers = parse_layers(fields)
     # st.write("DEBUG PARSED LAYERS:", layers)   # ← ADD HERE
@@ -1892,14 +1831,6 @@ for doc in filtered_runs:
     # ------------------------------------------------------------
     raw_fridges = get_measure_fridges(layers)
 
-    def make_unique_label(base, existing_labels, force_index=False):
-        if not force_index and base not in existing_labels:
-            return base
-        i = 1
-        while f"{base} ({i})" in existing_labels:
-            i += 1
-        return f"{base} ({i})"
-
     # count base labels
     base_counts = {}
     for base in raw_fridges.values():
@@ -2006,25 +1937,6 @@ for doc in filtered_runs:
 
 
 
-
-    # ---------------------------------------------------
-    # 🔍 CHECK COOLDOWN CHIP STATUS (PUT THIS HERE)
-    # ---------------------------------------------------
-    for layer in layers:
-        if layer["layer_name"].lower() == "measurement":
-            for sub in layer["substeps"]:
-                for chip in sub["chips"]:
-                    # st.write("DEBUG CHIP:", chip)
-
-                    # if chip["name"].lower() == "cooldown":
-                    if "cool" in chip["name"].lower():
-                        status = chip["status"]
-                        if status in ("in_progress", "done"):
-                            cooldown_triggered = True
-    # ----------------------------------------------------
- 
-
-
     def is_completed(c):
         status = (c.get("status") or "").lower()
         return (
@@ -2109,7 +2021,6 @@ for doc in filtered_runs:
 
 
 
-    design_date = get_meta_data(fields,"design", "Completed")
     fab_in = format_date_compact(get_meta_data(fields,"fab", "Fabin"))
     fab_out = format_date_compact(get_meta_data(fields,"fab", "Fabout"))
     lot_id = get_meta_data(fields,"design", "Lotid")
@@ -2120,45 +2031,6 @@ for doc in filtered_runs:
 
     fridge_labels = get_measure_fridges(layers)
 
-    meta_fields = (
-        fields.get("metadata", {})
-            .get("mapValue", {})
-            .get("fields", {})
-    )
-
-    meas_meta = (
-        meta_fields.get("measure", {})
-            .get("mapValue", {})
-            .get("fields", {})
-            .get("fridges", {})
-            .get("mapValue", {})
-            .get("fields", {})
-    )
-
-
-    fridge_display_label = build_measurement_fridge_display_labels(layers)
-
-    cooldown_texts = []
-
-    for fridge_uid, fridge_label in fridge_display_label.items():
-        f = firestore_to_python(meas_meta.get(fridge_uid, {})) if meas_meta else {}
-        cd = f.get("cooldown_start", "")
-        if cd:
-            cooldown_texts.append(
-                f"{fridge_label} {format_date_compact(cd)}"
-            )
-
-    cooldown_banner_text = ", ".join(cooldown_texts)
-
-
-
-    # detect terminate anywhere in run (for overall progress bar)
-    has_terminate_global = any(
-        (c.get("status") or "").lower() == "terminate"
-        for l in layers
-        for s in l.get("substeps", [])
-        for c in s.get("chips", [])
-    )
 
 
     dashboard_events = collect_dashboard_events_from_metadata(
@@ -2201,7 +2073,6 @@ for doc in filtered_runs:
 
     for l in layers:
         lname = (l.get("layer_name") or "").lower()
-        progress_l = int(l.get("progress", 0))
         substeps_l = l.get("substeps", [])
 
         # PACKAGE + MEASUREMENT
@@ -2287,7 +2158,44 @@ for doc in filtered_runs:
 
     auto_expand = not all_done
 
+    # Visible label (what user sees)
+    visible_label = (
+        # f"#️ {run_no} ㅤ ⌨ {device} ㅤ 🆔 {lot_id} ㅤ ⚒️ fab {date_only(fab_in)} ➔ {date_only(fab_out)} ㅤ ❄️ Cooldown Start : {cooldown_banner_text}"
+        f"#️ {run_no} ㅤ 🆔 {lot_id} ㅤ ⌨ {device} ㅤ ⚒️ Fab {date_only(fab_in)} ➔ {date_only(fab_out)}"
+
+    )
+
+
+    return {
+        "layers": layers,
+        "raw_fridges": raw_fridges,
+        "base_counts": base_counts,
+        "fridge_labels": fridge_labels,
+        "fridge_labels_no_chip": fridge_labels_no_chip,
+        "lot_id": lot_id,
+        "html": html,
+        "auto_expand": auto_expand,
+        "visible_label": visible_label,
+    }
+
 
+run_cards = get_doc_memo("viewer_no_login")
+
+
+for doc in filtered_runs:
+    # Snapshot documents are shared across reruns: read-only, no deepcopy
+    fields = doc["fields"]
+    card = run_cards.get_or_build(doc, lambda: build_run_card(fields))
+
+    layers = card["layers"]
+    raw_fridges = card["raw_fridges"]
+    base_counts = card["base_counts"]
+    fridge_labels = dict(card["fridge_labels"])   # tab_meas adds chip labels
+    fridge_labels_no_chip = card["fridge_labels_no_chip"]
+    lot_id = card["lot_id"]
+    html = card["html"]
+    auto_expand = card["auto_expand"]
+    visible_label = card["visible_label"]
 
     # If refinement filters applied → always expand
     if refinement_active:
@@ -2298,12 +2206,6 @@ for doc in filtered_runs:
     # EXPANDER FOR THIS RUN
     # ----------------------------
 
-    # Visible label (what user sees)
-    visible_label = (
-        # f"#️ {run_no} ㅤ ⌨ {device} ㅤ 🆔 {lot_id} ㅤ ⚒️ fab {date_only(fab_in)} ➔ {date_only(fab_out)} ㅤ ❄️ Cooldown Start : {cooldown_banner_text}"
-        f"#️ {run_no} ㅤ 🆔 {lot_id} ㅤ ⌨ {device} ㅤ ⚒️ Fab {date_only(fab_in)} ➔ {date_only(fab_out)}"
-
-    )
 
     with st.expander(visible_label, expanded=auto_expand):
 